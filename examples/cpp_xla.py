@@ -2,18 +2,16 @@ import sys
 
 
 def main():
-    from parseonly.reader import iter_sources
-    from parseonly.cpp import preprocess
+    from parseonly.parallel import parse_many
     source = sys.argv[1]
+    jobs = int(sys.argv[2]) if len(sys.argv) > 2 else None
 
     count = 0
     errors = 0
-    for fn, source in iter_sources(source, file_exts=['.h']):
-        print(f'{fn=} {len(source)=}')
-        try:
-          source = preprocess(source)
-        except Exception as msg:
-          print(f'Error: {msg}')
+    for fn, source, error in parse_many(source, jobs=jobs, file_exts=['.h']):
+        print(f'{fn=}')
+        if error is not None:
+          print(f'Error: {error}')
           errors += 1
           continue
         if source is None:
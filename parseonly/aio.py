@@ -0,0 +1,86 @@
+"""
+Asyncio front-end for parsing sources.
+
+File reads and parsing are executed in an executor so that the event
+loop is not blocked by large sources. Use a
+concurrent.futures.ProcessPoolExecutor instance as executor to parse
+sources in parallel.
+"""
+import os
+import asyncio
+
+from .reader import iter_filenames
+from .parallel import default_parse, parse_path
+
+
+async def parse_file(path, parse=None, executor=None):
+  """Return the result of parsing a source file.
+
+  parse is a function that is applied to the content of the file, by
+  default, cpp.preprocess is used. It must be picklable when executor
+  is a process pool. executor defaults to the event loop default
+  executor.
+  """
+  if parse is None:
+    parse = default_parse
+  loop = asyncio.get_running_loop()
+  return await loop.run_in_executor(executor, parse_path, parse, os.fspath(path))
+
+
+async def parse_tree(root, file_exts=None, root_path=None, parse=None, executor=None,
+                     concurrency=None, return_exceptions=False):
+  """Asynchronous iterator of pairs (filename, result) from parsing the
+  source files in the given path, see reader.iter_sources.
+
+  Results are yielded as soon as they are available. At most
+  concurrency files are parsed at a time and new files are scheduled
+  only when the consumer asks for more results. When the iteration is
+  cancelled or closed early, the scheduled parsing tasks are
+  cancelled.
+
+  When return_exceptions is true, an exception raised when parsing a
+  file is yielded as the result of the file. Otherwise, the exception
+  is propagated to the consumer.
+  """
+  if parse is None:
+    parse = default_parse
+  if concurrency is None:
+    concurrency = 2 * (os.cpu_count() or 1)
+  loop = asyncio.get_running_loop()
+  # walking the directory tree may block, hence it is done in the
+  # default executor:
+  items = iter_filenames(os.fspath(root), file_exts=file_exts, root_path=root_path)
+
+  async def worker(filename, path):
+    return filename, await loop.run_in_executor(executor, parse_path, parse, path)
+
+  pending = set()
+  filenames = dict()
+  exhausted = False
+  try:
+    while True:
+      while not exhausted and len(pending) < concurrency:
+        item = await loop.run_in_executor(None, next, items, None)
+        if item is None:
+          exhausted = True
+          break
+        task = loop.create_task(worker(*item))
+        filenames[task] = item[0]
+        pending.add(task)
+      if not pending:
+        break
+      done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+      for task in done:
+        filename = filenames.pop(task)
+        try:
+          filename, result = task.result()
+        except Exception as msg:
+          if not return_exceptions:
+            raise
+          result = msg
+        yield filename, result
+  finally:
+    for task in pending:
+      task.cancel()
+    if pending:
+      await asyncio.wait(pending)
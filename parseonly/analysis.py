@@ -0,0 +1,326 @@
+"""
+Static analysis of grammar specifications.
+
+Grammar types constructed with the switch, sequence, keyword,
+item_sequence, pair_or_item, item_optional_prefix, and
+item_optional_suffix factories are resolved into a graph of rules
+for which nullable, FIRST, and FOLLOW sets are computed. Grammar types
+that implement a custom split method are treated as opaque terminals
+that represent themselves in FIRST and FOLLOW sets. The FIRST set of
+an opaque type includes also the FIRST sets of the grammar types and
+strings that it declares in its _grammar_leading attribute (see
+leading_specs).
+
+The analysis reports the alternatives of switch and keyword rules
+that can never match (an earlier alternative always wins), and the
+alternatives that overlap (an earlier alternative may consume the
+same input before failing, which leads to backtracking).
+
+The nullable, first, and follow attributes of GrammarAnalysis are the
+precomputed tables that other tools may use, for instance, for
+checking which alternatives of a rule can start with a given token.
+The splitter does not dispatch on them: most alternatives of the C++
+and CPP switch rules start with opaque types, so a table keyed by the
+next character would rarely rule out an alternative.
+
+Usage:
+
+  python -m parseonly.analysis parseonly.cxx.grammar
+"""
+import sys
+import types
+import importlib
+import collections
+
+from .grammar import Grammar
+
+Diagnostic = collections.namedtuple('Diagnostic', ['kind', 'rule', 'alternatives', 'message'])
+
+
+def _resolve(spec):
+  if callable(spec) and getattr(spec, '__name__', None) == '<lambda>':
+    return spec()
+  return spec
+
+
+def rule_kind(cls):
+  """Return the factory kind of a grammar type or None when the type
+  implements a custom split method.
+  """
+  for c in cls.__mro__:
+    if 'split' in c.__dict__:
+      return c.__dict__.get('_grammar_kind')
+
+
+def rule_specs(cls):
+  """Return a dictionary of resolved components of a grammar type.
+  """
+  kind = rule_kind(cls)
+  if kind in ('switch', 'sequence', 'keyword'):
+    specs = []
+    for spec in cls._grammar_specs:
+      spec = _resolve(spec)
+      specs.extend(spec if type(spec) is tuple else (spec,))
+    return dict(specs=tuple(specs))
+  if kind == 'item_sequence':
+    return dict(item=_resolve(cls._item))
+  if kind == 'pair_or_item':
+    return dict(item=_resolve(cls._item), separators=tuple(map(_resolve, cls._separators)))
+  if kind == 'item_optional_suffix':
+    return dict(item=_resolve(cls._item), suffix=_resolve(cls._suffix))
+  if kind == 'item_optional_prefix':
+    return dict(item=_resolve(cls._item), prefix=_resolve(cls._prefix))
+  return dict()
+
+
+def leading_specs(cls):
+  """Return a set of grammar types and strings that the custom split
+  method of a grammar type applies to the beginning of its input.
+
+  The specifications are declared in the _grammar_leading attribute of
+  the type, for instance, a type which split method starts with
+  `word.split(ctx, line)` defines `_grammar_leading = (word,)`. Lambda
+  functions are resolved as in the specifications of grammar factories.
+  """
+  return set(map(_resolve, getattr(cls, '_grammar_leading', ())))
+
+
+def _label(spec):
+  return repr(spec) if isinstance(spec, str) else spec.__name__
+
+
+class GrammarAnalysis:
+  """Holds the results of grammar analysis.
+
+  Attributes:
+
+    rules     - a list of grammar types reachable from the roots
+    nullable  - a set of grammar types that can match empty input
+    first     - a dictionary that maps grammar types to their FIRST
+                sets (frozensets of strings and opaque grammar types)
+    follow    - a dictionary that maps grammar types to their FOLLOW
+                sets
+    diagnostics - a list of Diagnostic instances
+  """
+
+  def __init__(self, *roots):
+    self.rules = []
+    self.specs = dict()
+    self.leading = dict()
+    for root in roots:
+      if isinstance(root, str):
+        root = importlib.import_module(root)
+      if isinstance(root, types.ModuleType):
+        for obj in list(vars(root).values()):
+          if isinstance(obj, type) and issubclass(obj, Grammar) and obj.__module__ == root.__name__:
+            self._visit(obj)
+      else:
+        self._visit(root)
+    self.nullable = self._compute_nullable()
+    self.first = self._compute_first()
+    self.follow = self._compute_follow()
+    self.diagnostics = self._compute_diagnostics()
+
+  def _visit(self, cls):
+    stack = [cls]
+    while stack:
+      cls = stack.pop()
+      if cls in self.specs:
+        continue
+      specs = rule_specs(cls)
+      self.specs[cls] = specs
+      self.leading[cls] = leading_specs(cls) if rule_kind(cls) is None else set()
+      self.rules.append(cls)
+      for spec in self._components(cls) + list(self.leading[cls]):
+        if isinstance(spec, type) and issubclass(spec, Grammar):
+          stack.append(spec)
+
+  def _components(self, cls):
+    specs = self.specs[cls]
+    lst = list(specs.get('specs', ()))
+    for key in ['prefix', 'item', 'suffix']:
+      if key in specs:
+        lst.append(specs[key])
+    lst.extend(specs.get('separators', ()))
+    return lst
+
+  def is_opaque(self, spec):
+    return isinstance(spec, type) and rule_kind(spec) is None
+
+  def _nullable(self, spec, nullable):
+    if isinstance(spec, str):
+      return spec == ''
+    return spec in nullable
+
+  def _compute_nullable(self):
+    nullable = set()
+    changed = True
+    while changed:
+      changed = False
+      for cls in self.rules:
+        if cls in nullable:
+          continue
+        kind = rule_kind(cls)
+        specs = self.specs[cls]
+        if kind == 'switch':
+          r = any(self._nullable(s, nullable) for s in specs['specs'])
+        elif kind == 'sequence':
+          r = all(self._nullable(s, nullable) for s in specs['specs'])
+        elif kind == 'keyword':
+          r = '' in specs['specs']
+        elif kind in ('item_sequence', 'pair_or_item', 'item_optional_suffix', 'item_optional_prefix'):
+          r = self._nullable(specs['item'], nullable)
+        else:
+          r = False
+        if r:
+          nullable.add(cls)
+          changed = True
+    return nullable
+
+  def _first_of(self, spec, first):
+    if isinstance(spec, str):
+      return {spec} if spec else set()
+    return first[spec]
+
+  def _first_of_sequence(self, seq, first):
+    r = set()
+    for spec in seq:
+      r |= self._first_of(spec, first)
+      if not self._nullable(spec, self.nullable):
+        break
+    return r
+
+  def _compute_first(self):
+    first = {cls: set() for cls in self.rules}
+    changed = True
+    while changed:
+      changed = False
+      for cls in self.rules:
+        kind = rule_kind(cls)
+        specs = self.specs[cls]
+        if kind is None:
+          r = {cls}
+          for s in self.leading[cls]:
+            r |= self._first_of(s, first)
+        elif kind == 'keyword':
+          r = set(s for s in specs['specs'] if s)
+        elif kind == 'switch':
+          r = set()
+          for s in specs['specs']:
+            r |= self._first_of(s, first)
+        elif kind == 'sequence':
+          r = self._first_of_sequence(specs['specs'], first)
+        elif kind == 'item_optional_prefix':
+          r = self._first_of_sequence((specs['prefix'], specs['item']), first)
+          r |= self._first_of(specs['item'], first)
+        else:
+          r = set(self._first_of(specs['item'], first))
+        if not r <= first[cls]:
+          first[cls] |= r
+          changed = True
+    return {cls: frozenset(r) for cls, r in first.items()}
+
+  def first_of_sequence(self, seq):
+    """Return FIRST set of a sequence of specifications.
+    """
+    return frozenset(self._first_of_sequence(seq, self.first))
+
+  def _compute_follow(self):
+    follow = {cls: set() for cls in self.rules}
+
+    def add(spec, terminals):
+      if isinstance(spec, type) and spec in follow and not terminals <= follow[spec]:
+        follow[spec] |= terminals
+        return True
+      return False
+
+    changed = True
+    while changed:
+      changed = False
+      for cls in self.rules:
+        kind = rule_kind(cls)
+        specs = self.specs[cls]
+        tail = follow[cls]
+        if kind == 'switch':
+          for s in specs['specs']:
+            changed |= add(s, tail)
+        elif kind == 'sequence':
+          seq = specs['specs']
+          for i, s in enumerate(seq):
+            rest = seq[i + 1:]
+            f = set(self.first_of_sequence(rest))
+            if all(self._nullable(r, self.nullable) for r in rest):
+              f |= tail
+            changed |= add(s, f)
+        elif kind == 'item_sequence':
+          changed |= add(specs['item'], set(self.first[cls]) | tail)
+        elif kind == 'pair_or_item':
+          seps = set()
+          for sep in specs['separators']:
+            seps |= self._first_of(sep, self.first)
+            changed |= add(sep, set(self._first_of(specs['item'], self.first)))
+          changed |= add(specs['item'], seps | tail)
+        elif kind == 'item_optional_suffix':
+          changed |= add(specs['item'], set(self._first_of(specs['suffix'], self.first)) | tail)
+          changed |= add(specs['suffix'], tail)
+        elif kind == 'item_optional_prefix':
+          changed |= add(specs['prefix'], set(self._first_of(specs['item'], self.first)))
+          changed |= add(specs['item'], tail)
+    return {cls: frozenset(r) for cls, r in follow.items()}
+
+  def _compute_diagnostics(self):
+    diagnostics = []
+    for cls in self.rules:
+      kind = rule_kind(cls)
+      if kind not in ('switch', 'keyword'):
+        continue
+      alternatives = self.specs[cls]['specs']
+      for j, b in enumerate(alternatives):
+        for i, a in enumerate(alternatives[:j]):
+          if a == b:
+            diagnostics.append(Diagnostic('unreachable', cls, (i, j),
+                                          f'{cls.__name__}: alternative {_label(b)} duplicates alternative #{i}'))
+            break
+          if isinstance(a, str) and isinstance(b, str) and b.startswith(a):
+            diagnostics.append(Diagnostic('unreachable', cls, (i, j),
+                                          f'{cls.__name__}: alternative {_label(b)} is shadowed by {_label(a)}'))
+            break
+          if not isinstance(a, str) and self._nullable(a, self.nullable):
+            diagnostics.append(Diagnostic('unreachable', cls, (i, j),
+                                          f'{cls.__name__}: alternative {_label(b)} follows nullable {_label(a)}'))
+            break
+        else:
+          for i, a in enumerate(alternatives[:j]):
+            common = self._first_of(a, self.first) & self._first_of(b, self.first)
+            if common:
+              shared = ', '.join(sorted(map(_label, common)))
+              diagnostics.append(Diagnostic('overlap', cls, (i, j),
+                                            f'{cls.__name__}: alternatives {_label(a)} and {_label(b)} share FIRST {{{shared}}}'))
+    return diagnostics
+
+  def costly_rules(self):
+    """Return a list of pairs (grammar type, count of overlapping
+    alternative pairs) sorted by decreasing count. Each overlap is a
+    potential backtracking point.
+    """
+    counts = collections.Counter(d.rule for d in self.diagnostics if d.kind == 'overlap')
+    return counts.most_common()
+
+  def report(self):
+    lines = [d.message for d in self.diagnostics]
+    costly = self.costly_rules()
+    if costly:
+      lines.append('Rules with most overlapping alternatives:')
+      for cls, count in costly[:20]:
+        lines.append(f'  {cls.__name__}: {count}')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+  argv = sys.argv[1:] if argv is None else argv
+  analysis = GrammarAnalysis(*(argv or ['parseonly.cxx.grammar']))
+  print(analysis.report())
+
+
+if __name__ == '__main__':
+  main()
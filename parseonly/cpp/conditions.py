@@ -0,0 +1,319 @@
+"""
+Evaluating the constant expressions of #if and #elif directives.
+
+A condition is compiled into a Python closure that is applied to an
+Evaluation instance, the compiled closures are cached by the
+normalized text of conditions. The value of a condition is None when
+it cannot be evaluated, for instance, when it uses an undefined
+identifier or a function-like macro.
+"""
+import re
+
+
+_token = re.compile(r'''
+  (?P<space>\s+|@@@[<>]\d+@@@)
+ |(?P<number>\.?\d(?:[eEpP][+-]|[\w.'])*)
+ |(?P<char>(?:u8|[uUL])?'(?:[^'\\\n]|\\.)*')
+ |(?P<name>[A-Za-z_]\w*)
+ |(?P<op>&&|\|\||<<|>>|<=|>=|==|!=|[-+*/%&|^~!<>?:(),])
+''', re.X)
+
+_escapes = {'n': 10, 't': 9, 'v': 11, 'b': 8, 'r': 13, 'f': 12, 'a': 7,
+            '\\': 92, "'": 39, '"': 34, '?': 63, '0': 0}
+
+
+def tokenize(text):
+  """Return a list of the tokens of a condition, or None when text
+  contains characters that cannot appear in a condition.
+  """
+  tokens = []
+  i, n = 0, len(text)
+  while i < n:
+    m = _token.match(text, i)
+    if m is None:
+      return
+    if m.lastgroup != 'space':
+      tokens.append(m.group())
+    i = m.end()
+  return tokens
+
+
+def _number(token):
+  if token[0] == "'" or token[-1] == "'":
+    return _character(token)
+  s = token.replace("'", '').rstrip('uUlLzZ').lower()
+  try:
+    if s.startswith('0x'):
+      return int(s[2:], 16)
+    if s.startswith('0b'):
+      return int(s[2:], 2)
+    if s.startswith('0') and len(s) > 1:
+      return int(s[1:], 8)
+    return int(s)
+  except ValueError:
+    # floating point literals are not allowed in conditions
+    return
+
+
+def _character(token):
+  s = token[token.index("'") + 1:-1]
+  if len(s) == 1:
+    return ord(s)
+  if len(s) == 2 and s[0] == '\\':
+    return _escapes.get(s[1])
+  if s.startswith('\\x'):
+    return int(s[2:], 16)
+  if s.startswith('\\') and s[1:].isdigit():
+    return int(s[1:], 8)
+
+
+class Evaluation:
+  """The state of evaluating a condition against a table of macros.
+
+  The names of all macros that are looked up are recorded in names
+  (pairs of a name and its definition or None) so that a value can be
+  reused as long as these macros are not redefined.
+  """
+
+  def __init__(self, defines):
+    self.defines = defines
+    self.names = dict()
+    self._expanding = set()
+
+  def _lookup(self, name):
+    macro = self.defines.get(name)
+    self.names[name] = macro
+    return macro
+
+  def defined(self, name):
+    return int(self._lookup(name) is not None)
+
+  def value(self, name):
+    # The value of an object-like macro, other identifiers are not
+    # replaced by 0 but leave the condition unevaluated.
+    if name in ('true', 'false'):
+      return int(name == 'true')
+    macro = self._lookup(name)
+    if macro is None or macro.params is not None or name in self._expanding:
+      return
+    self._expanding.add(name)
+    try:
+      return compile_condition(' '.join(map(str, macro.body)))(self)
+    finally:
+      self._expanding.discard(name)
+
+
+def _unknown(ev):
+  return
+
+
+def _constant(value):
+  def constant(ev):
+    return value
+  return constant
+
+
+def _checked(op):
+  # C semantics of integer division, division by zero is not evaluated
+  def division(x, y):
+    if y == 0:
+      return
+    q = abs(x) // abs(y)
+    q = -q if (x < 0) != (y < 0) else q
+    return q if op == '/' else x - q * y
+  return division
+
+
+_binary_operations = [
+  {'|': lambda x, y: x | y},
+  {'^': lambda x, y: x ^ y},
+  {'&': lambda x, y: x & y},
+  {'==': lambda x, y: int(x == y), '!=': lambda x, y: int(x != y)},
+  {'<': lambda x, y: int(x < y), '>': lambda x, y: int(x > y),
+   '<=': lambda x, y: int(x <= y), '>=': lambda x, y: int(x >= y)},
+  {'<<': lambda x, y: x << y if y >= 0 else None, '>>': lambda x, y: x >> y if y >= 0 else None},
+  {'+': lambda x, y: x + y, '-': lambda x, y: x - y},
+  {'*': lambda x, y: x * y, '/': _checked('/'), '%': _checked('%')},
+]
+
+_unary_operations = {'+': lambda x: x, '-': lambda x: -x, '!': lambda x: int(not x), '~': lambda x: ~x}
+
+
+class _Compiler:
+  """Recursive descent compiler of condition tokens into closures.
+  """
+
+  def __init__(self, tokens):
+    self.tokens = tokens
+    self.index = 0
+
+  def peek(self):
+    if self.index < len(self.tokens):
+      return self.tokens[self.index]
+
+  def take(self, expected=None):
+    token = self.peek()
+    if token is None or (expected is not None and token != expected):
+      raise SyntaxError(f'expected {expected or "a token"}, got {token}')
+    self.index += 1
+    return token
+
+  def expression(self):
+    # comma-separated conditions evaluate to the last one
+    f = self.conditional()
+    while self.peek() == ',':
+      self.take()
+      f = self.conditional()
+    return f
+
+  def conditional(self):
+    cond = self.logical(0)
+    if self.peek() != '?':
+      return cond
+    self.take()
+    then = self.expression()
+    self.take(':')
+    other = self.conditional()
+
+    def conditional(ev):
+      c = cond(ev)
+      if c is None:
+        return
+      return then(ev) if c else other(ev)
+    return conditional
+
+  def logical(self, level):
+    # level 0 is ||, level 1 is &&, the operands are evaluated lazily
+    # so that `0 && X` is 0 even when X cannot be evaluated
+    if level == 2:
+      return self.binary(0)
+    op = ('||', '&&')[level]
+    f = self.logical(level + 1)
+    while self.peek() == op:
+      self.take()
+      f = self._logical(op, f, self.logical(level + 1))
+    return f
+
+  @staticmethod
+  def _logical(op, f, g):
+    short = op == '||'
+
+    def logical(ev):
+      x = f(ev)
+      if x is not None and bool(x) == short:
+        return int(short)
+      y = g(ev)
+      if y is not None and bool(y) == short:
+        return int(short)
+      if x is None or y is None:
+        return
+      return int(not short)
+    return logical
+
+  def binary(self, level):
+    if level == len(_binary_operations):
+      return self.unary()
+    operations = _binary_operations[level]
+    f = self.binary(level + 1)
+    while self.peek() in operations:
+      f = self._binary(operations[self.take()], f, self.binary(level + 1))
+    return f
+
+  @staticmethod
+  def _binary(operation, f, g):
+    def binary(ev):
+      x = f(ev)
+      if x is None:
+        return
+      y = g(ev)
+      if y is None:
+        return
+      return operation(x, y)
+    return binary
+
+  def unary(self):
+    op = self.peek()
+    if op in _unary_operations:
+      self.take()
+      operation, f = _unary_operations[op], self.unary()
+
+      def unary(ev):
+        x = f(ev)
+        return None if x is None else operation(x)
+      return unary
+    return self.primary()
+
+  def primary(self):
+    token = self.take()
+    if token == '(':
+      f = self.expression()
+      self.take(')')
+      return f
+    if token == 'defined':
+      if self.peek() == '(':
+        self.take()
+        name = self.take()
+        self.take(')')
+      else:
+        name = self.take()
+      if not _is_name(name):
+        raise SyntaxError(f'expected a macro name after defined, got {name}')
+      return lambda ev: ev.defined(name)
+    if _is_name(token):
+      if self.peek() == '(':
+        # a function-like macro or __has_include and alike
+        self._skip_arguments()
+        return _unknown
+      return lambda ev: ev.value(token)
+    value = _number(token)
+    if value is None:
+      raise SyntaxError(f'not a constant: {token}')
+    return _constant(value)
+
+  def _skip_arguments(self):
+    depth = 0
+    while True:
+      token = self.take()
+      if token == '(':
+        depth += 1
+      elif token == ')':
+        depth -= 1
+        if depth == 0:
+          return
+
+
+def _is_name(token):
+  return token[0].isalpha() or token[0] == '_'
+
+
+# pairs (normalized text, closure) shared by all contexts
+_compiled = dict()
+
+
+def normalize(text):
+  """Return the text of a condition with normalized whitespace and
+  comment labels removed, or None when text is not a condition.
+  """
+  tokens = tokenize(str(text))
+  return None if tokens is None else ' '.join(tokens)
+
+
+def compile_condition(text):
+  """Return a closure that takes an Evaluation instance and returns
+  the value of the condition in text or None when the value cannot
+  be determined.
+  """
+  f = _compiled.get(text)
+  if f is None:
+    tokens = tokenize(text)
+    f = _unknown
+    if tokens:
+      compiler = _Compiler(tokens)
+      try:
+        f = compiler.expression()
+        if compiler.peek() is not None:
+          f = _unknown
+      except SyntaxError:
+        f = _unknown
+    _compiled[text] = f
+  return f
@@ -2,7 +2,13 @@
 from ..grammar import grammar, word, switch, keyword, splitter, item_sequence, Context, Grammar, pair_or_item
 from ..cxx import grammar as cxx
 from ..cxx.grammar import (integer_literal, floating_point_literal, character_literal, user_defined_character_literal, string_literal, user_defined_string_literal)
-from . import utils
+import os
+import re
+import collections
+from . import utils, includes, macros, conditions
+from ..spanstr import spanstr, ropestr, lineindex
+from ..reader import iter_chunks
+from ..diagnostics import INFO, WARNING, ERROR
 
 def splitter_set_cpp_depth(mth):
 
@@ -191,7 +197,7 @@ class pp_import(grammar('pp_import', ['export', 'header-name-opt-tokens', 'pp-to
         return cls(e, n, t), rest_[2:]
 
   def evaluate(self, ctx):
-    print(f"TODO: evaluate {type(self).__name__}: {repr(str(self))}")
+    ctx.diagnostics.debug('TODO: evaluate {}: `{}`', type(self).__name__, self)
     return self
 
   def resolve(self, enable):
@@ -232,11 +238,50 @@ class sharp_include(grammar('sharp_include', ['pp_tokens'])):
           return cls(t), rest[1:]
 
   def evaluate(self, ctx):
-    content = ctx.apply_defines(self[0])
+    content = ctx.apply_defines(self[0], kind='include')
+    name, angled = includes.header_name(content)
+    if name is not None:
+      ctx.include(name, angled=angled, source=self)
+    return self._replace(pp_tokens=content).resolve(True)
+
+  def resolve(self, enable):
+    if isinstance(enable, (int, float)):
+      return text_line('')
+    return self
+
+  @property
+  def is_valid(self):
+    return True
 
-    if 0:
-      print(f'Warning: include `{content}` not evaluated')
+  @property
+  def is_invalid(self):
+    return False
 
+class sharp_include_next(grammar('sharp_include_next', ['pp_tokens'])):
+  """
+# include_next pp-tokens new-line
+  """
+  @property
+  def format(self):
+      tab = '\t' * self._attributes.get('cpp_depth', 0)
+      return f'#{tab}' + 'include_next {0}\n'
+
+  @splitter
+  @splitter_set_cpp_depth
+  def split(cls, ctx, line):
+    rest = line.lstrip(ctx.whitespace_characters)
+    if rest.startswith('#'):
+      d, rest = word.split(ctx, rest[1:].lstrip(ctx.whitespace_characters), require='include_next')
+      if d:
+        t, rest = pp_tokens.split(ctx, rest)
+        if t and rest.startswith('\n'):
+          return cls(t), rest[1:]
+
+  def evaluate(self, ctx):
+    content = ctx.apply_defines(self[0], kind='include')
+    name, angled = includes.header_name(content)
+    if name is not None:
+      ctx.include(name, angled=angled, next=True, source=self)
     return self._replace(pp_tokens=content).resolve(True)
 
   def resolve(self, enable):
@@ -372,10 +417,8 @@ GCC extension:
                   va_arg = args[0][-1]
                   args = args._replace(content=args[0][:-1])
                 lst, rest = replacement_list.split(ctx, rest[1:])
-                print(f'{lst.pp_tokens.pp_tokens=}')
                 if lst and rest.startswith('\n'):
                   lst = lst._replace(pp_tokens=pp_tokens(tuple((std_va_arg if t == va_arg else t) for t in lst.pp_tokens.pp_tokens)))
-                  print(f'{lst.pp_tokens.pp_tokens=}')
                   return cls(i.content, args, dots, lst), rest[1:]
             if rest.startswith(')'):
               lst, rest = replacement_list.split(ctx, rest[1:])
@@ -404,7 +447,7 @@ GCC extension:
     if self.replacement_list.pp_tokens:
       ctx.register_define(self.identifier, args, self.replacement_list.pp_tokens.pp_tokens)
     else:
-      print(f'FAILED TO REGISTER: {self=}')
+      ctx.diagnostics.warning('failed to register CPP macro `{}`', self.identifier)
     # Since this macro definition is registered, we'll remove the
     # directive. Notice that this preserves the newline count.
     return self.resolve(False)
@@ -483,7 +526,7 @@ class sharp_line(grammar('sharp_line')):
           return cls(t), rest[1:]
 
   def evaluate(self, ctx):
-    print(f"TODO: evaluate {type(self).__name__}: {repr(str(self))}")
+    ctx.diagnostics.debug('TODO: evaluate {}: `{}`', type(self).__name__, self)
     return self
 
   def resolve(self, enable):
@@ -521,7 +564,7 @@ class sharp_error(grammar('sharp_error')):
           return cls(t), rest[1:]
 
   def evaluate(self, ctx):
-    print(f"TODO: evaluate {type(self).__name__}: {repr(str(self))}")
+    ctx.diagnostics.debug('TODO: evaluate {}: `{}`', type(self).__name__, self)
     return self
 
   def resolve(self, enable):
@@ -559,7 +602,7 @@ class sharp_warning(grammar('sharp_warning')):
           return cls(t), rest[1:]
 
   def evaluate(self, ctx):
-    print(f"TODO: evaluate {type(self).__name__}: {repr(str(self))}")
+    ctx.diagnostics.debug('TODO: evaluate {}: `{}`', type(self).__name__, self)
     return self
 
   def resolve(self, enable):
@@ -597,7 +640,7 @@ class sharp_pragma(grammar('sharp_pragma')):
           return cls(t), rest[1:]
 
   def evaluate(self, ctx):
-    print(f"TODO: evaluate {type(self).__name__}: {repr(str(self))}")
+    ctx.diagnostics.debug('TODO: evaluate {}: `{}`', type(self).__name__, self)
     return self
 
   def resolve(self, enable):
@@ -639,9 +682,10 @@ class sharp_newline(grammar('sharp_newline')):
   def is_invalid(self):
     return False
 
-class control_line(switch(pp_import, sharp_include, sharp_define_macro, sharp_define_identifier, sharp_undef, sharp_line, sharp_error, sharp_warning, sharp_pragma, sharp_newline)):
+class control_line(switch(pp_import, sharp_include, sharp_include_next, sharp_define_macro, sharp_define_identifier, sharp_undef, sharp_line, sharp_error, sharp_warning, sharp_pragma, sharp_newline)):
   """
 # include pp-tokens new-line
+# include_next pp-tokens new-line
 pp-import
 # define  identifier                                replacement-list new-line
 # define  identifier lparen identifier-list? )      replacement-list new-line
@@ -685,35 +729,99 @@ def _if_group_split(cls, kinds, ctx, line):
             if n != -1:
               label = raw[n:k+3]
               raw = raw[:n].rstrip()
-              print(f'{label=}')
             else:
               assert 0, raw[-100:]  # unreachable
 
           
           rest = rest[i+1:].lstrip(ctx.whitespace_characters)
+          condition = conditions.normalize(raw)
 
           # rewrite `#if defined FOO` as `#if defined(FOO)`
           d, rest_ = word.split(ctx, raw, require='defined')
           rest_ = rest_.lstrip(ctx.whitespace_characters)
+          e = None
           if d and not rest_.startswith('('):
-            raw = f'{d}({rest_})'
+            name, tail = word.split(ctx, rest_)
+            if name and tail.strip() == '':
+              # keep the locations of `defined` and `FOO`
+              e, rest_ = cxx.postfix_expression_call(d, name), tail[len(tail):]
+            else:
+              raw = f'{d}({rest_})'
 
-          e, rest_ = cxx.constant_expression.split(ctx, raw)
+          if e is None:
+            e, rest_ = cxx.constant_expression.split(ctx, raw)
           if e:
             if rest_ == '':
-              g, rest = group.split(ctx, rest)
-              return cls(kind, e, label, g), rest
+              g, rest = _group_split(ctx, condition, rest)
+              return _with_condition(cls(kind, e, label, g), condition), rest
             assert rest_ == '', rest_
         assert 0, line
       else:
         e, rest = identifier.split(ctx, rest)
         label, rest = comment_label.split(ctx, rest)
         if e and rest.startswith('\n'):
+          condition = ('!' if kind.endswith('ndef') else '') + f'defined ( {e} )'
           with ctx.increase_cpp_depth():
-            g, rest = group.split(ctx, rest[1:])
-            return cls(kind, e, label, g), rest
+            g, rest = _group_split(ctx, condition, rest[1:])
+            return _with_condition(cls(kind, e, label, g), condition), rest
         assert 0, line
-  
+
+def _with_condition(item, condition):
+  # the normalized text of the condition of an #if-like directive, see
+  # CPPContext.evaluate_condition
+  item._attributes.update(condition=condition)
+  return item
+
+def _condition(item):
+  condition = item._attributes.get('condition')
+  return conditions.normalize(item.expression) if condition is None else condition
+
+def _group_split(ctx, condition, line):
+  # Split the group of an #if-like directive. When the condition is
+  # known to be false, the group is not tokenized but kept as raw text,
+  # see CPPContext.skip_inactive
+  if getattr(ctx, 'skip_inactive', False):
+    v = ctx.static_condition(condition)
+    if v is not None and not v:
+      i = utils.find_group_end(line)
+      if i != -1:
+        return (skipped_group(line[:i]) if i else None), line[i:]
+  return group.split(ctx, line)
+
+class skipped_group(grammar('skipped_group')):
+  """
+  The raw text of an inactive group that is not tokenized.
+  """
+  format = '{0}'
+
+  def split_group(self, ctx):
+    """Return the group of the raw text, used when the group turns out
+    to be active when rewriting (a preceding condition of the
+    if-section is unknown).
+    """
+    with ctx.uses_language('cpp'):
+      r, rest = group.split(ctx, self.content)
+    if rest != '':
+      raise RuntimeError(f'failed to CPP parse skipped group: {str(rest)[:80]!r}')
+    return r
+
+  def resolve(self, enable):
+    if isinstance(enable, (int, float)):
+      if not enable:
+        # to preserve line count
+        return group(tuple(text_line('') for _ in range(self.content.count('\n'))))
+      # emitting the raw text would be wrong, see split_group
+      raise RuntimeError('skipped group is active, it must be split before resolving')
+    return self
+
+  @property
+  def is_valid(self):
+    return True
+
+  @property
+  def is_invalid(self):
+    return False
+
 class if_group(grammar('if_group', ['kind', 'expression', 'comment-label', 'group'])):
   """
 # if      constant-expression comment-label? new-line group?
@@ -759,14 +867,14 @@ class if_group(grammar('if_group', ['kind', 'expression', 'comment-label', 'grou
 
   def evaluate(self, ctx):
     assert self.kind == 'if'
-    v = self.expression
-    if isinstance(v, Grammar):
-      v = v.evaluate(ctx)
+    v = ctx.evaluate_condition(_condition(self))
+    if v is None:
+      return self
     return self._replace(expression=v).resolve(v)
 
   def resolve(self, enable):
     if isinstance(enable, (bool, int)):
-      return group((text_line(''), (self.group and self.group.resolve(enable)) or None))
+      return group((text_line(''),) + ((self.group.resolve(enable),) if self.group else ()))
     return self
 
 class elif_group(grammar('elif_group', ['kind', 'expression', 'comment-label', 'group'])):
@@ -811,14 +919,14 @@ class elif_group(grammar('elif_group', ['kind', 'expression', 'comment-label', '
 
   def evaluate(self, ctx):
     assert self.kind == 'elif'
-    v = self.expression
-    if isinstance(v, Grammar):
-      v = v.evaluate(ctx)
+    v = ctx.evaluate_condition(_condition(self))
+    if v is None:
+      return self
     return self._replace(expression=v).resolve(v)
 
   def resolve(self, enable):
     if isinstance(enable, (bool, int)):
-      return group((text_line(''), self.group.resolve(enable)))
+      return group((text_line(''),) + ((self.group.resolve(enable),) if self.group else ()))
     return self
 
   
@@ -877,7 +985,7 @@ class else_group(grammar('else_group', ['comment-label', 'group'])):
 
   def resolve(self, enable):
     if isinstance(enable, (bool, int)):
-      return group((text_line(''), self.group.resolve(enable)))
+      return group((text_line(''),) + ((self.group.resolve(enable),) if self.group else ()))
     return self
 
   @property
@@ -936,31 +1044,44 @@ class if_section(grammar('if_section', ['if-group', 'elif-groups', 'else-group',
       if endif:
         return cls(ifg, elifg, elseg, endif), rest
 
-  def evaluate(self, ctx):
+  def rewrite(self, ctx):
+    # The conditions are evaluated in order and only the group of the
+    # first true condition is rewritten, so that the directives of
+    # inactive groups have no effect. After a condition that cannot be
+    # evaluated, all the remaining groups are rewritten and kept.
     ifg, elifg, elseg, endif = self
-    ifg = ifg.evaluate(ctx)
-    elifg = elifg and elifg.evaluate(ctx)
-    elseg = elseg and elseg.evaluate(ctx)
-    endif = endif.evaluate(ctx)
-    if ifg.is_valid:
-      return self._replace(if_group=ifg.resolve(True),
-                           elif_groups=elifg and elifg.resolve(False),
-                           else_group=elseg and elseg.resolve(False),
-                           endif_line=endif.resolve(False))
-    if ifg.is_invalid:
-      if elifg:
-        if elifg.is_valid:
-          return self._replace(if_group=ifg.resolve(False),
-                           elif_groups=elifg and elifg.resolve(True),
-                           else_group=elseg and elseg.resolve(False),
-                           endif_line=endif.resolve(False))
-        if elifg.is_invalid:
-          if elseg:
-            return self._replace(if_group=ifg.resolve(False),
-                                 elif_groups=elifg and elifg.resolve(False),
-                                 else_group=elseg and elseg.resolve(True),
-                                 endif_line=endif.resolve(False))
-    return self.resolve(True)
+    groups = [ifg, *(elifg.content if elifg else ()), *((elseg,) if elseg else ())]
+    resolved = []
+    names = set()
+    state = False  # True after a true condition, None after an unknown one
+    for g in groups:
+      if state is True:
+        enable = False
+      elif state is None or isinstance(g, else_group):
+        enable = True
+      else:
+        enable = ctx.evaluate_condition(_condition(g), names)
+        if enable is None:
+          state = None
+        elif enable:
+          state = True
+      if (enable is None or enable) and g.group is not None:
+        if isinstance(g.group, skipped_group):
+          # the group was found inactive when splitting by its own
+          # condition, but a preceding condition is unknown
+          g = g._replace(group=g.group.split_group(ctx))
+        if names:
+          # the decision is recorded before the dependencies of the group
+          ctx.record_dependencies('if_section', ifg, names)
+          names = set()
+        g = g._replace(group=g.group.rewrite(ctx))
+      resolved.append(g.resolve(enable is None or bool(enable)))
+    ctx.record_dependencies('if_section', ifg, names)
+    n = len(elifg.content) if elifg else 0
+    return self._replace(if_group=resolved[0],
+                         elif_groups=elifg and type(elifg)(tuple(resolved[1:n + 1])),
+                         else_group=elseg and resolved[-1],
+                         endif_line=endif.resolve(False))
 
   def resolve(self, enable):
     ifg, elifg, elseg, endif = self
@@ -1002,7 +1123,7 @@ class sharp_conditionally_supported_directive(grammar('sharp_conditionally_suppo
   def postprocess(cls, ctx, item, rest):
     head = item.content.pp_tokens[0]
     if isinstance(head, identifier) and head.content in {
-            'if', 'ifdef', 'ifndef', 'elif', 'elifdef', 'elifndef', 'else', 'endif', 'pragma', 'line', 'warning', 'error', 'undef', 'define', 'include'}:
+            'if', 'ifdef', 'ifndef', 'elif', 'elifdef', 'elifndef', 'else', 'endif', 'pragma', 'line', 'warning', 'error', 'undef', 'define', 'include', 'include_next'}:
       return
     return item, rest
 
@@ -1248,6 +1369,278 @@ class preprocessing_file(grammar('preprocessing_file')):
   def resolve(self, enable):
     return self._replace(content=self.content.resolve(enable))
 
+_no_hide = frozenset()
+_lparen = operator_or_punctuator('(')
+_rparen = operator_or_punctuator(')')
+_comma = operator_or_punctuator(',')
+_hash = preprocessing_operator('#')
+_hashhash = preprocessing_operator('##')
+_placemarker = placemarker(None)
+
+
+def _macro_arguments(name, stack):
+  # Pop a parenthesized argument list of the invocation of macro name
+  # from the work stack (the last item is `(`) and return a pair of
+  # arguments (lists of (token, hide set) pairs) and the hide set of
+  # the closing `)`.
+  stack.pop()
+  args = []
+  arg = []
+  depth = 0
+  while stack:
+    item = stack.pop()
+    t = item[0]
+    if t == _rparen:
+      if depth == 0:
+        args.append(arg)
+        return args, item[1]
+      depth -= 1
+    elif t == _lparen:
+      depth += 1
+    elif t == _comma and depth == 0:
+      args.append(arg)
+      arg = []
+      continue
+    arg.append(item)
+  args.append(arg)
+  text = ', '.join(' '.join(str(item[0]) for item in a) for a in args)
+  raise RuntimeError(f'no closing rparen found in the invocation of macro `{name}`: `{name}({text}`')
+
+
+def _adjust_arguments(args, params):
+  # Match arguments to parameters, the extra arguments of variadic
+  # macros are joined to the last argument.
+  if not params and args == [[]]:
+    return []
+  n = len(params)
+  if len(args) > n:
+    va_args = []
+    for a in args[n - 1:]:
+      if va_args:
+        va_args.append((_comma, _no_hide))
+      va_args.extend(a)
+    args = args[:n - 1] + [va_args]
+  return args + [[]] * (n - len(args))
+
+
+def _paste(x, y):
+  # Return the token from concatenating tokens x and y (`##`).
+  if isinstance(x, placemarker):
+    return y
+  if isinstance(y, placemarker):
+    return x
+  if isinstance(x, pp_identifier):
+    if isinstance(y, (pp_identifier, cxx.decimal_literal)):
+      return pp_identifier(x.content + y.content)
+  elif isinstance(x, cxx.decimal_literal):
+    if isinstance(y, pp_identifier):
+      # invalid that further macro application may resolve
+      return pp_identifier(x.content + y.content)
+    elif isinstance(y, cxx.decimal_literal):
+      return cxx.decimal_literal(x.content + y.content)
+  elif isinstance(x, (operator_or_punctuator, preprocessing_operator)):
+    if isinstance(y, (operator_or_punctuator, preprocessing_operator)):
+      return type(x)(x.content + y.content)
+  raise NotImplementedError(f'concat({type(x)}, {type(y)})')
+
+
+def _stringize(items):
+  # todo: preserve backslashes
+  return cxx.ordinary_string_literal_quotes(''.join([str(t).replace('"', '\\"') for t, hs in items if not isinstance(t, placemarker)]))
+
+
+def _expand_macros(items, defines):
+  """Return macro expansion of a list of (token, hide set) pairs as a
+  list of such pairs.
+
+  Implements the hide set algorithm of D. Prosser: a token that is
+  the name of a macro is not replaced when the name is in its hide
+  set, and the tokens of a replacement get the hide set of the
+  invocation extended with the macro name. The replacements are
+  pushed to the work stack of the remaining tokens so that these are
+  rescanned together with the rest of the input.
+  """
+  stack = items[::-1]
+  result = []
+  while stack:
+    item = stack.pop()
+    t, hs = item
+    if not isinstance(t, pp_identifier) or t.content not in defines or t.content in hs:
+      result.append(item)
+      continue
+    macro = defines[t.content]
+    if macro.params is None:
+      # object-like macro invocation
+      stack.extend(reversed(_instantiate(macro, (), hs | {t.content}, defines)))
+    elif stack and stack[-1][0] == _lparen:
+      # function-like macro invocation
+      args, rparen_hs = _macro_arguments(t.content, stack)
+      args = _adjust_arguments(args, macro.params)
+      stack.extend(reversed(_instantiate(macro, args, (hs & rparen_hs) | {t.content}, defines)))
+    else:
+      # function-like macro name without arguments is not an invocation
+      result.append(item)
+  return result
+
+
+# Opcodes of macro templates, see Macro:
+_TOKEN, _ARGUMENT, _RAW_ARGUMENT, _STRINGIZE, _PASTE, _VA_OPT = range(6)
+
+
+class Macro(collections.namedtuple('Macro', ['params', 'body', 'template', 'va_args'])):
+  """A macro definition compiled for expansion.
+
+  params is None for object-like macros, otherwise, a list of
+  parameter tokens. The template is a tuple of (opcode, value) pairs
+  computed from the replacement list body:
+
+    _TOKEN, token          - a replacement token
+    _ARGUMENT, k           - macro expanded argument of k-th parameter
+    _RAW_ARGUMENT, k       - unexpanded argument (an operand of `##`)
+    _STRINGIZE, k          - stringized unexpanded argument (`#`)
+    _PASTE, (opcode, value) - concatenate the last token with the
+                             first token of the operand (`##`)
+    _VA_OPT, template      - template of __VA_OPT__ content
+
+  va_args is the index of __VA_ARGS__ parameter or None.
+  """
+  __slots__ = ()
+
+  @classmethod
+  def compile(cls, params, body):
+    # the replacement tokens carry no source locations, otherwise, the
+    # nodes of expanded lines would cover the #define line
+    body = _without_locations(body)
+    index = {str(p.content): k for k, p in enumerate(params or ())}
+
+    def parameter(t):
+      return index.get(str(t.content)) if isinstance(t, pp_identifier) else None
+
+    def is_va_opt(tokens, j):
+      return isinstance(tokens[j], pp_identifier) and tokens[j].content == '__VA_OPT__' and j + 1 < len(tokens) and tokens[j + 1] == _lparen
+
+    def va_opt(tokens, j):
+      # Return the end of `__VA_OPT__ ( ... )` that starts at j and
+      # the template of its content.
+      depth = 0
+      for e in range(j + 1, len(tokens)):
+        if tokens[e] == _lparen:
+          depth += 1
+        elif tokens[e] == _rparen:
+          depth -= 1
+          if depth == 0:
+            break
+      else:
+        raise RuntimeError(f'no closing rparen found in __VA_OPT__: `{" ".join(map(str, tokens[j:]))}`')
+      return e + 1, (_VA_OPT, compile(tokens[j + 2:e]))
+
+    def operand(tokens, j):
+      # Return the end and the operation of an operand of `##`
+      k = parameter(tokens[j])
+      if k is not None:
+        return j + 1, (_RAW_ARGUMENT, k)
+      if is_va_opt(tokens, j):
+        return va_opt(tokens, j)
+      return j + 1, (_TOKEN, tokens[j])
+
+    def compile(tokens):
+      n = len(tokens)
+      template = []
+      j = 0
+      while j < n:
+        t = tokens[j]
+        if t == _hash and j + 1 < n and params is not None:
+          # Warning: hash not followed by parameter is illegal.
+          # However, here we will allow it.
+          k = parameter(tokens[j + 1])
+          if k is None:
+            template.append((_TOKEN, _stringize([(tokens[j + 1], _no_hide)])))
+          else:
+            template.append((_STRINGIZE, k))
+          j += 2
+        elif t == _hashhash and template and j + 1 < n:
+          j, op = operand(tokens, j + 1)
+          template.append((_PASTE, op))
+        elif j + 1 < n and tokens[j + 1] == _hashhash:
+          j, op = operand(tokens, j)
+          template.append(op)
+        elif parameter(t) is not None:
+          template.append((_ARGUMENT, parameter(t)))
+          j += 1
+        elif is_va_opt(tokens, j):
+          j, op = va_opt(tokens, j)
+          template.append(op)
+        elif isinstance(t, placemarker):
+          j += 1
+        else:
+          template.append((_TOKEN, t))
+          j += 1
+      return tuple(template)
+
+    return cls(params, body, compile(body), index.get('__VA_ARGS__'))
+
+
+def _without_locations(obj):
+  # Return obj with spanstr leaves replaced by str instances.
+  if isinstance(obj, (spanstr, ropestr)):
+    return str(obj)
+  if isinstance(obj, Grammar):
+    updates = dict()
+    for k, v in obj._asdict().items():
+      w = _without_locations(v)
+      if w is not v:
+        updates[k] = w
+    return obj._replace(**updates) if updates else obj
+  if isinstance(obj, (tuple, list)):
+    items = [_without_locations(item) for item in obj]
+    if any(a is not b for a, b in zip(items, obj)):
+      return type(obj)(items)
+  return obj
+
+
+def _instantiate(macro, args, hs, defines):
+  # Return the replacement of a macro invocation as a list of (token,
+  # hide set) pairs where hs is added to hide sets.
+  expanded = dict()
+  placemarker_item = (_placemarker, _no_hide)
+
+  def expanded_argument(k):
+    # arguments are macro expanded before substitution
+    if k not in expanded:
+      expanded[k] = _expand_macros(args[k], defines)
+    return expanded[k]
+
+  def emit(op, output):
+    code, value = op
+    if code == _TOKEN:
+      output.append((value, _no_hide))
+    elif code == _ARGUMENT:
+      output.extend(expanded_argument(value))
+    elif code == _RAW_ARGUMENT:
+      output.extend(args[value] or (placemarker_item,))
+    elif code == _STRINGIZE:
+      output.append((_stringize(args[value]), _no_hide))
+    elif code == _PASTE:
+      rhs = []
+      emit(value, rhs)
+      (x, xhs), (y, yhs) = output.pop(), rhs[0]
+      output.append((_paste(x, y), xhs & yhs))
+      output.extend(rhs[1:])
+    else:  # _VA_OPT
+      k = macro.va_args
+      start = len(output)
+      if k is not None and any(not isinstance(t, placemarker) for t, _ in expanded_argument(k)):
+        for op in value:
+          emit(op, output)
+      if len(output) == start:
+        output.append(placemarker_item)
+
+  output = []
+  for op in macro.template:
+    emit(op, output)
+  return [(t, (ths | hs) if ths else hs) for t, ths in output if not isinstance(t, placemarker)]
+
+
 class CPPContext(Context):
   """Implements CPP macro expansion support.
   """
@@ -1256,295 +1649,177 @@ class CPPContext(Context):
     if 'whitespace' not in kwargs:
         kwargs.update(whitespace=whitespace_without_newline)
     super().__init__(*args, **kwargs)
-    self.defines = dict() # pairs (define name, define value)
+    self.defines = macros.MacroTable() # pairs (define name, Macro instance)
     self.unevaluated_macros = set()
     self.smallest_matching_rest_length = 2**63
     self.smallest_non_matching_rest_length = 2**64
+    self.comments = None  # utils.CommentTable, see preprocess
+    self.filename = None  # the path of the main source file
+    self.include_paths = None  # includes.IncludePaths, see preprocess
+    self.include_stack = []  # pairs (path, index) of the files being included
+    self.included_files = []  # paths of the included files
+    self.unresolved_includes = set()
+    self.include_guards = dict()  # pairs (path, guard), see include_guard
+    self.header_cache = includes.default_header_cache
+    self.skip_inactive = False  # see preprocess
+    self.directive_macros = set()  # see static_condition
+    self.condition_values = dict()  # see evaluate_condition
+    self.dependencies = None  # macros.MacroDependencies, see preprocess
+
+  max_include_depth = 200
+
+  def include(self, name, angled=False, next=False, source=None):
+    """Preprocess the header file of #include directive within this
+    context so that its macro definitions become available. Return the
+    path of the header file or None when including is disabled (no
+    include_paths) or the header is not found.
+
+    When next is true, the search continues after the directory of the
+    including file as in #include_next.
+
+    source is the directive node that dependencies are recorded for.
+    """
+    if self.include_paths is None:
+      return
+    current, index = self.include_stack[-1] if self.include_stack else (self.filename, None)
+    start = None
+    if next and index is not None and index >= 0:
+      start = index + 1
+    current_dir = os.path.dirname(current) if current is not None else None
+    path, index = self.include_paths.resolve(name, angled=angled, current_dir=current_dir, start=start)
+    if path is None:
+      self.unresolved_includes.add(f'<{name}>' if angled else f'"{name}"')
+      return
+    guard = self.include_guards.get(path)
+    if guard is True:
+      return path
+    if guard is not None and guard in self.defines:
+      # multiple-include optimization: the content of the header
+      # would be skipped anyway
+      self.record_dependencies('include', source, {guard})
+      return path
+    if len(self.include_stack) >= self.max_include_depth:
+      self.diagnostics.warning('#include nested too deeply, skipping `{}`', path)
+      return
+    self.included_files.append(path)
+    tree, self.include_guards[path] = self.header_cache.get(path, _parse_header)
+    if tree is None:
+      self.diagnostics.warning('failed to CPP parse `{}`', path)
+    else:
+      self.include_stack.append((path, index))
+      try:
+        tree.rewrite(self)
+      finally:
+        self.include_stack.pop()
+    return path
+
+  def static_condition(self, condition):
+    """Return the value of the condition of an #if-like directive when
+    it is known while splitting, otherwise None.
+
+    The value is known when it does not depend on the macros that are
+    defined or undefined by the directives of the text (listed in
+    directive_macros) or of included files.
+    """
+    value, names = self._condition_value(condition)
+    if names and (self.include_paths is not None or not self.directive_macros.isdisjoint(name for name, _ in names)):
+      return
+    return value
+
+  def evaluate_condition(self, condition, names=None):
+    """Return the value of the normalized condition text of an #if-like
+    directive (see conditions.normalize), or None when the value cannot
+    be determined. The names of the macros that the value depends on
+    are added to the set names when specified.
+
+    The compiled conditions are shared by all contexts. The values are
+    cached per context and are reused until one of the macros that the
+    evaluation looked up is defined or undefined.
+    """
+    value, deps = self._condition_value(condition)
+    if names is not None:
+      names.update(name for name, macro in deps)
+    return value
+
+  def record_dependencies(self, kind, source, names):
+    """Record that the result of preprocessing source depends on the
+    macros of names when dependencies are tracked (see preprocess).
+    source is a node or a spanstr instance of the current file.
+    """
+    if self.dependencies is None or not names:
+      return
+    filename = self.include_stack[-1][0] if self.include_stack else self.filename
+    self.dependencies.add(kind, filename, _lineno(source), names)
+
+  def _condition_value(self, condition):
+    if condition is None:
+      return None, ()
+    entry = self.condition_values.get(condition)
+    if entry is not None:
+      value, names = entry
+      defines = self.defines
+      for name, macro in names:
+        if defines.get(name) is not macro:
+          break
+      else:
+        return entry
+    ev = conditions.Evaluation(self.defines)
+    value = conditions.compile_condition(condition)(ev)
+    entry = self.condition_values[condition] = value, tuple(ev.names.items())
+    return entry
+
+  def attached_comments(self, node):
+    """Return a list of comments that apply to node. Requires that
+    comments are collected into a side table, see preprocess.
+    """
+    span = node.source_span() if isinstance(node, Grammar) else getattr(node, 'span', None)
+    if self.comments is None or span is None:
+      return []
+    return self.comments.attached(*span)
     
   def unregister_define(self, name):
     if name in self.defines:
       self.defines.pop(name)
     else:
-      print(f'Warning: skipping to undefine of a non-defined CPP macro `{name}`')
+      self.diagnostics.warning('skipping to undefine of a non-defined CPP macro `{}`', name, source=name)
 
   def register_define(self, name, args, body):
     # args is None corresponds to `#define name body`
-    sargs = '' if args is None else ('(' + ', '.join(map(str, args)) + ')')
-    if name in self.defines:
-      print(f'Warning: overriding the definition of CPP macro `{name}{sargs}`')
-    else:
-      print(f'register CPP macro `{name}{sargs}`: `{" ".join(map(str, body))}`')
-    self.defines[name] = (args, body)
-
-  def apply_defines(self, pp_tokens, defines=None):
-    if defines is None:
-      defines = self.defines
-
-    tmp = placemarker(None)
-    va_opt = pp_identifier('__VA_OPT__')
-    va_arg = pp_identifier('__VA_ARGS__')
-    lparen = operator_or_punctuator('(')
-    comma = operator_or_punctuator(',')
-    rparen = operator_or_punctuator(')')
-    hashhash = preprocessing_operator('##')
-    hash = preprocessing_operator('#')
-
-    def get_arguments_list(seq, i, keep_comma=False):
-      """Return a list of tokens enclosed in parenthesis and separated by commas:
-
-      ['(', x, a, ',', ..., ')', y, ...] -> [(x, a), ...], seq.index(y, i)
-      """
-      nn = len(seq)
-      assert seq[i] == lparen, (seq[i], lparen)
-      save_i = i
-      i += 1
-      if seq[i] == rparen:
-        return [], i + 1
-      lst = []      
-      stack = []
-      arg = []
-      while i < nn:
-        t = seq[i]
-        if stack and t == stack[-1]:
-          stack.pop()
-        elif not stack and t == rparen:
-          lst.append(tuple(arg))
-          arg = None  # mark that closing rparen is found
-          i += 1
-          break
-        elif t == lparen:
-          stack.append(rparen)
-        elif not stack and t == comma:
-          if keep_comma:
-            arg.append(t)
-          lst.append(tuple(arg))
-          arg = []  # clean up for the next argument
-          i += 1
-          continue
-        arg.append(t)
-        i += 1
+    severity = WARNING if name in self.defines else INFO
+    if self.diagnostics.enabled(severity):
+      sargs = '' if args is None else ('(' + ', '.join(map(str, args)) + ')')
+      if severity == WARNING:
+        self.diagnostics.warning('overriding the definition of CPP macro `{}{}`', name, sargs, source=name)
       else:
-        raise RuntimeError(f'no closing rparen found: `{" ".join(map(str, seq[save_i:500]))}`')
-      assert arg is None  # sanity check
-
-      return lst, i
-
-    def adjust_arguments(lst, params):
-      """Adjust arguments list to parameters
-      """
-      if len(lst) == len(params):
-        return lst
-      if len(lst) > len(params):
-        n = len(params)
-        va_args = []
-        for a in lst[n - 1:]:
-          if va_args:
-            va_args.append(comma)
-          va_args.extend(a)
-        lst = lst[:n-1] + [tuple(va_args)]
-
-      if len(lst) <= len(params):
-        lst = lst + ([()] * (len(params) - len(lst)))
-      else:
-        print(f'{lst=} {params=}')
-        assert 0  # unreachable, nof parameters is less that nof arguments
-      return lst
-
-    def concat(x, y):
-      # TODO: this is likely incomplete
-      if isinstance(x, placemarker):
-        return y
-      if isinstance(y, placemarker):
-        return x
-      if isinstance(x, pp_identifier):
-        if isinstance(y, pp_identifier):
-          return pp_identifier(x.content + y.content)
-        elif isinstance(y, cxx.decimal_literal):
-          return pp_identifier(x.content + y.content)
-      elif isinstance(x, cxx.decimal_literal):
-        if isinstance(y, pp_identifier):
-          # invalid that further macro application may resolve
-          return pp_identifier(x.content + y.content)
-        elif isinstance(y, cxx.decimal_literal):
-          return cxx.decimal_literal(x.content + y.content)
-      elif isinstance(x, preprocessing_operator) or isinstance(y, preprocessing_operator):
-        assert 0  # unreachable
-      elif type(x) is tuple:
-        if type(y) is tuple:
-          r = concat(x[-1], y[0])
-          if type(r) is not tuple:
-            r = r,
-          return x[:-1] + r + y[1:]
-      raise NotImplementedError(f'concat({type(x)}, {type(y)})')
-
-    def replace(seq, params, args):
-      """
-      Replace all occurances of parameters with the corresponding argument values.
-      """
-      new_seq = []
-      for t1 in seq:
-        try:
-          k = params.index(t1)
-        except ValueError:
-          new_seq.append(t1)
-          continue
-        new_seq.extend(args[k])
-      return tuple(new_seq)
-  
-    def expand(tokens):
-      new_tokens = []
-      skip_k = 0
-      for k, t1 in enumerate(tokens):
-        if k < skip_k:
-          continue
-        if isinstance(t1, pp_identifier) and t1.content in defines:
-          params1, repl1 = defines[t1.content]
-          if params1 is None:
-            new_tokens.extend(repl1)
-          else:
-            if k + 1 >= len(tokens):
-              new_tokens.append(t1)
-              continue
-            args1, skip_k = get_arguments_list(tokens, k + 1)
-            args1 = adjust_arguments(args1, params1)
-            new_tokens.extend(replace(repl1, params1, args1))
-        else:
-          new_tokens.append(t1)
-      return tuple(new_tokens)
+        self.diagnostics.info('register CPP macro `{}{}`: `{}`', name, sargs, ' '.join(map(str, body)))
+    self.defines[name] = Macro.compile(args, body)
 
-    def token_is_parameter(t, params):
-      try:
-        params.index(t)
-      except ValueError:
-        return False
-      return True
-        
-    def as_pp_tokens(a, params, args):
-      try:
-        k = params.index(a)
-      except ValueError:
-        return (a,)
-      return args[k] or (tmp,)
-
-    def stringize(seq):
-      # todo: preserve backslashes
-      return cxx.ordinary_string_literal_quotes(''.join([str(item).replace('"', '\\"') for item in seq if item != tmp]))
-
-    def concat_with_expand(seq1, seq2):
-      return concat(expand(seq1[:-1]) + (seq1[-1],),  (seq2[0],) + expand(seq2[1:]))
-
-    def worker(seq, defines):
-
-      count = 0
-      new_seq = []
-      i = 0
-      while i < len(seq):
-        t = seq[i]
-        i += 1
-        if not isinstance(t, pp_identifier) or t.content not in defines:
-          new_seq.append(t)
-          continue
-
-        params, repl_lst = defines[t.content]
-        count += 1
-        if params is None:
-          # object-like macro invocation
-          repl_lst = [(do_not_replace(item) if item == t else item) for item in repl_lst if not isinstance(item, placemarker)]
-          new_seq.extend(repl_lst)
-          continue
-
-        # function-like macro invocation
-        nofargs = len(params)
-        # Collect arguments to function-like macro call. If macros
-        # parameter list ends with `,...`, collect the last arguments
-        # into a single sequence that corresponds to __VA_ARGS__
-        # parameter:
-        assert seq[i] == lparen, seq[:i+1]
-        args, i = get_arguments_list(seq, i)
-        args = adjust_arguments(args, params)
-
-        # Scan replacement list for parameters and apply concat and
-        # stringizing to parameter values. Arguments to parameters
-        # that don't participate in concat/stringizing operations,
-        # will be expanded.
-        lst = []
-        skip_j = 0
-        keep_va_opt = True
-        for j, r in enumerate(repl_lst):
-          if j < skip_j:
-            # skip tokens consumed by `#` or `##` operatos
-            pass
-          elif isinstance(r, do_not_replace):
-            lst.append(r)
-          elif r == hashhash:
-            # Concat prev and next token provided that one of these is
-            # a parameter
-            #  `P`  `##` `P` -> `AA`
-            #  `P` `##` `T` -> `AT`
-            #  `T`  `##` `P` -> `TA`
-            #  `T`  `##` `T` -> `TT`
-            # where `A` is argument to in parameter's `P` position. `A` is not expanded.
-            a1, a2 = lst.pop(), repl_lst[j + 1]
-            lst.extend(concat_with_expand(as_pp_tokens(a1, params, args), as_pp_tokens(a2, params, args)))
-            skip_j = j + 2
-          elif r == hash:
-            # stringize parameters:
-            #   `#` `P1` `P2` -> `"` `A1` `"` `E2`
-            # where `A` is argument to parameter `P` and `E` is expanded argument.
-            a = repl_lst[j + 1]
-            # Warning: hash not followed by parameter is
-            # illegal. However, here we will allow it.
-            lst.append(stringize(expand(as_pp_tokens(a, params, args))))
-            skip_j = j + 2
-          elif r == va_arg:
-            e = expand(as_pp_tokens(r, params, args))
-            keep_va_opt = bool([itm for itm in e if not isinstance(itm, placemarker)])
-            lst.extend(e)
-          elif token_is_parameter(r, params):
-            #  `P` -> `A`
-            lst.extend(expand(as_pp_tokens(r, params, args)))
-          else:
-            lst.append(r)
-
-        # Resolve __VA_OPT__ and remaining concat in replacement list.
-        j = 0
-        m = len(lst)
-        new_lst = []
-        while j < m:
-          r = lst[j]
-          j += 1
-          if r == va_opt:
-            assert lst[j] == lparen
-            va_opt_args, j = get_arguments_list(lst, j, keep_comma=True)
-            if keep_va_opt:
-              new_lst.extend(sum(va_opt_args, ()))
-          elif r == hashhash:
-            rl = new_lst[-1]
-            rr = lst[j]
-            new_lst[-1] = concat(rl, rr)
-            j += 1
-          else:
-            assert r != hash  # all hash ops ought to be resolved here
-            new_lst.append(r)
+  def apply_defines(self, pp_tokens, defines=None, kind='text_line'):
+    """Return pp_tokens with macros replaced, see _expand_macros.
 
-        new_seq.extend([(do_not_replace(item) if item == t else item) for item in new_lst if not isinstance(item, placemarker)])
-
-      return new_seq, count
-  
+    When dependencies are tracked, the names of all macros that are
+    looked up are recorded with kind.
+    """
+    if defines is None:
+      defines = self.defines
+    if self.dependencies is not None:
+      names = set()
+      r = self._apply_defines(pp_tokens, macros.RecordingView(defines, names))
+      self.record_dependencies(kind, pp_tokens, names)
+      return r
+    return self._apply_defines(pp_tokens, defines)
+
+  def _apply_defines(self, pp_tokens, defines):
     seq = pp_tokens.pp_tokens
-    mx = 500  # that should be plenty
-    while mx > 0:
-      seq_prev = seq
-      seq, count = worker(seq, defines)
-      if count == 0:
-        seq = seq_prev
+    for t in seq:
+      if isinstance(t, pp_identifier) and t.content in defines:
         break
-      mx -= 1
-
-    if seq is pp_tokens.pp_tokens:
+    else:
       return pp_tokens
-    seq = [(item.content if isinstance(item, do_not_replace) else item) for item in seq]
-    return pp_tokens._replace(pp_tokens=tuple(seq))
+    new_seq = tuple(t for t, hs in _expand_macros([(t, _no_hide) for t in seq], defines))
+    if new_seq == seq:
+      return pp_tokens
+    return pp_tokens._replace(pp_tokens=new_seq)
 
   def rewrite(self, original, new):
     if isinstance(new, Grammar) and 0:
@@ -1553,23 +1828,21 @@ class CPPContext(Context):
 
     if isinstance(new, (sharp_define_identifier, sharp_define_macro, sharp_undef,
                         text_line, text_lines,
-                        sharp_include,
-                        if_group, elif_group,
-                        if_section)):
+                        sharp_include, sharp_include_next)):
       new = new.evaluate(self)
 
-    if isinstance(new, (str, int, float, bool)):
+    if isinstance(new, (str, spanstr, ropestr, int, float, bool)):
       pass
     elif isinstance(new, cxx.postfix_expression_call):
-      if isinstance(new.postfix_expression, str):
+      if isinstance(new.postfix_expression, (str, spanstr, ropestr)):
         d = new.postfix_expression
       else:
         d = new.postfix_expression.content
       if d == 'defined':
-        name = new.expression_list if isinstance(new.expression_list, str) else new.expression_list.content
-        if isinstance(name, str):
+        name = new.expression_list if isinstance(new.expression_list, (str, spanstr, ropestr)) else new.expression_list.content
+        if isinstance(name, (str, spanstr, ropestr)):
           return name in self.defines
-      print(f'failed to evaluate `{new}`: unknown symbol `{d}`')
+      self.diagnostics.warning('failed to evaluate `{}`: unknown symbol `{}`', new, d)
     else:
       pass
       # print(type(new))
@@ -1584,44 +1857,285 @@ class CPPContext(Context):
     return super().splitter_postprocess_rest(attrs, item, rest)
 
 
-def preprocess(text):
+def _lineno(node):
+  # Return the line number of the first located string of node
+  if isinstance(node, spanstr):
+    return node.lineno
+  if isinstance(node, tuple):
+    for item in node:
+      lineno = _lineno(item)
+      if lineno is not None:
+        return lineno
+
+def _parse_header(path):
+  # Return a pair of the unevaluated tree and the include guard of a
+  # header file, the tree is evaluated separately in each including
+  # context.
+  tree = _split_header(path)
+  return tree, (None if tree is None else include_guard(tree))
+
+def _split_header(path):
+  # Return the tree of a header file for rewriting it in the context
+  # of the including file.
+  ctx = CPPContext()
+  parts = utils.iter_group_parts(utils.iter_logical_lines(iter_chunks(path)))  # Stages 1-3
+  r, rest, text = _split_parts(ctx, parts, locations=True)
+  if rest != '':
+    return
+  return r
+
+_module_line = re.compile(r'^[ \t]*(?:export[ \t]+)?module\b', re.M)
+
+def _split_parts(ctx, parts, locations=False):
+  # Split the parts of utils.iter_group_parts as a preprocessing file
+  # one part at a time, returns a triple (preprocessing_file, rest,
+  # text) where text is the last split part that rest is a tail of.
+  # When locations is true, the parts are split as spanstr instances
+  # that report the line numbers of the whole text, their offsets are
+  # relative to the part.
+  lineno = 1
+  group_parts = []
+  for text in parts:
+    if not group_parts and _module_line.search(text):
+      # module-file that can be split only as a whole
+      text = text + ''.join(parts)
+    if locations:
+      text = spanstr(text, newlines=lineindex(text, lineno))
+      lineno += text.count('\n')
+    ctx.smallest_matching_rest_length = 2**63
+    with ctx.uses_language('cpp'):
+      if not group_parts:
+        r, rest = preprocessing_file.split(ctx, text)
+        if rest != '' or not isinstance(r.content, group):
+          return r, rest, text
+        group_parts.extend(r.content.group)
+      else:
+        g, rest = group.split(ctx, text)
+        if g is not None:
+          group_parts.extend(g.group)
+        if rest != '':
+          return preprocessing_file(group(tuple(group_parts))), rest, text
+    # the splitting results of the finished parts are not needed anymore
+    ctx.splitter_cache.clear()
+  if not group_parts:
+    with ctx.uses_language('cpp'):
+      return preprocessing_file.split(ctx, '') + ('',)
+  return preprocessing_file(group(tuple(group_parts))), '', ''
+
+
+# comment labels of blank lines, the tokens of labels are separated
+# by whitespace in the string of text_lines:
+_blank_text = re.compile(r'(?:@@@[<>]\d+@@@)*')
+
+def _non_blank_parts(g):
+  return [p for p in g.group if not (isinstance(p, text_lines) and _blank_text.fullmatch(''.join(str(p).split())))]
+
+def include_guard(tree):
+  """Return the include guard of a header file tree as returned by
+  preprocessing_file.split: True when the header contains `#pragma
+  once`, the name of the guard macro X when the header has the form
+
+    #ifndef X      // or #if !defined(X)
+    #define X
+    ...
+    #endif
+
+  where only blank lines and comments are outside of the if-section,
+  and None otherwise.
+  """
+  if tree.content is None:
+    return
+  parts = _non_blank_parts(tree.content)
+  for p in parts:
+    if isinstance(p, sharp_pragma) and p.content is not None and p.content.pp_tokens and str(p.content.pp_tokens[0]) == 'once':
+      return True
+  if len(parts) != 1 or not isinstance(parts[0], if_section):
+    return
+  ifg, elifg, elseg, endif = parts[0]
+  e = ifg.expression
+  if elifg or elseg or ifg.kind != 'if' or ifg.group is None:
+    return
+  if not (isinstance(e, cxx.unary_operator_expression) and str(e.uop) == '!'
+          and isinstance(e.cast_expression, cxx.postfix_expression_call)
+          and str(e.cast_expression.postfix_expression) == 'defined'):
+    return
+  name = str(e.cast_expression.expression_list)
+  body = _non_blank_parts(ifg.group)
+  if body and isinstance(body[0], sharp_define_identifier) and str(body[0].identifier) == name:
+    return name
+
+
+def _define_macros(table, source):
+  # Register the macros of #define and #undef directives in source
+  # into table.
+  ctx = CPPContext()
+  ctx.defines = table
+  with ctx.uses_language('cpp'):
+    r, rest = preprocessing_file.split(ctx, spanstr(source))
+  assert rest == '', rest
+  r.rewrite(ctx)
+
+_profile_tables = dict()
+
+def macro_table(profile=None, options=()):
+  """Return a macros.MacroTable that contains the predefined macros of
+  the profile ('gcc' or 'clang', see macros.profiles) and the macros
+  of -D and -U options, applied in order.
+
+  The profile tables are created once per process and forked for each
+  call.
+  """
+  table = _profile_tables.get(profile)
+  if table is None:
+    table = macros.MacroTable()
+    if profile is not None:
+      _define_macros(table, macros.profiles[profile])
+    _profile_tables[profile] = table
+  table = table.fork()
+  source = macros.options_source(options)
+  if source:
+    _define_macros(table, source)
+  return table
+
+
+def preprocess(text, jobs=None, comments='labels', include_paths=None, filename=None, header_cache=None, defines=None, skip_inactive=False,
+               diagnostics=None, track_dependencies=False, locations=False):
   """Return a tree of CPP procession result.
 
   The count of newline characters is preserved.
-  """
-  text = utils.remove_backslashes(text)  # Stage 2
-  text, ctext = utils.reference_comments(text)  # Stage 3, with comment reference hooks
 
-  ctx = CPPContext(trace=not True)
+  When jobs is specified and is not 1, the text is split in parallel
+  using jobs worker processes, see parallel.split_preprocessing_file.
+
+  comments specifies how comments are kept: 'labels' injects comment
+  labels into the text (see utils.reference_comments), 'table'
+  collects comments into a side table (see utils.collect_comments)
+  that is available as the comments attribute of the context, see
+  CPPContext.attached_comments.
+
+  text can be also an iterable of text chunks, for instance, an open
+  file or reader.iter_chunks(path). With comment labels, the chunks
+  are processed by the streaming front-end utils.iter_logical_lines
+  and the top-level group parts of the text (see
+  utils.iter_group_parts) are split as soon as they are read, so that
+  the whole text is not held in memory. The text is joined when the
+  splitting needs it as a whole: with locations, track_dependencies,
+  skip_inactive, or jobs other than 1.
+
+  include_paths is an includes.IncludePaths instance or a list of
+  directories (as in -I) that enables following #include directives,
+  the macros of included files are defined in the context and the
+  paths of the files are stored in ctx.included_files. filename is
+  the path of text that is used for resolving "..." includes.
+
+  The trees of included files are cached in header_cache, an
+  includes.HeaderCache instance, by default, in a cache that is shared
+  by all preprocess calls of the process.
+
+  defines is a macros.MacroTable of the initially defined macros (see
+  macro_table), the table is forked and hence not modified.
+
+  When skip_inactive is true, the groups of if-sections that conditions
+  are known to be false already while splitting (see
+  CPPContext.static_condition) are not tokenized, only the directive
+  lines of such groups are scanned for finding the end of the group.
+  This applies only when jobs is 1 or None.
+
+  Warnings and errors are reported to diagnostics, a
+  diagnostics.Diagnostics instance, by default, to a new instance that
+  is available as the diagnostics attribute of the context.
+
+  When track_dependencies is true, the names of the macros that the
+  if-section decisions and macro expansions depend on are recorded in
+  a macros.MacroDependencies instance that is available as the
+  dependencies attribute of the context. Use its invalidated method or
+  macros.invalidated_files to find what is affected by changing -D
+  and -U options, see macros.changed_macros.
+
+  When locations is true, the text is split as a spanstr so that the
+  nodes of the tree report the lines and columns of the input (see
+  Grammar.location) and diagnostics report line numbers. Splitting a
+  spanstr is about 1.5 times slower than splitting a str, hence
+  locations are kept only when requested or when needed by
+  comments='table' or track_dependencies. The torope method of the
+  result returns the preprocessed text as a ropestr that maps the
+  offsets of the text to the source locations, see ropestr.location.
+  """
+  if comments not in ('labels', 'table'):
+    raise ValueError(f'invalid comments mode: {comments!r}')
+  ctx = CPPContext(trace=not True, diagnostics=diagnostics)
+  if include_paths is not None and not isinstance(include_paths, includes.IncludePaths):
+    include_paths = includes.IncludePaths(angled=include_paths)
+  ctx.include_paths = include_paths
+  ctx.filename = filename
+  if track_dependencies:
+    ctx.dependencies = macros.MacroDependencies()
+  if header_cache is not None:
+    ctx.header_cache = header_cache
+  if defines is not None:
+    ctx.defines = defines.fork()
+
+  parts = None
+  if not isinstance(text, (str, spanstr, ropestr)):
+    if comments == 'labels':
+      # Stages 1-3 in a single pass over the chunks
+      pieces = utils.iter_logical_lines(text)
+      if locations or track_dependencies or skip_inactive or (jobs is not None and jobs != 1):
+        text = ''.join(pieces)
+      else:
+        # the top-level group parts are split as soon as they are read
+        parts = utils.iter_group_parts(pieces)
+    else:
+      text, ctx.comments = utils.collect_comments(utils.remove_backslashes(''.join(text)))
+  else:
+    text = utils.remove_backslashes(text)  # Stage 2
+    if comments == 'table':
+      text, ctx.comments = utils.collect_comments(text)  # Stage 3
+    else:
+      text, ctext = utils.reference_comments(text)  # Stage 3, with comment reference hooks
+
+  if parts is None:
+    # The stages above preserve the count of newline characters, so
+    # that the nodes of the tree report the line numbers of the input
+    if locations or comments == 'table' or track_dependencies:
+      text = spanstr(str(text))
+    else:
+      text = str(text)
+  if skip_inactive:
+    ctx.skip_inactive = True
+    ctx.directive_macros = utils.directive_macro_names(text)
 
-  with ctx.uses_language('cpp'):
-    r, rest = preprocessing_file.split(ctx, text)
+  if parts is not None:
+    r, rest, text = _split_parts(ctx, parts)
+  elif jobs is not None and jobs != 1:
+    from ..parallel import split_preprocessing_file
+    r, rest = split_preprocessing_file(text, jobs=jobs)
+  else:
+    with ctx.uses_language('cpp'):
+      r, rest = preprocessing_file.split(ctx, text)
 
 
   if rest != '':
-    print(text)
-    print(f'{ctx.smallest_non_matching_rest_length=}')
-    print(f'{ctx.smallest_matching_rest_length=}')
-    i = len(text) - ctx.smallest_matching_rest_length
-    last_matching_line = text[:i]
-    k = last_matching_line.rindex('\n') + 1
-    last_matching_line = last_matching_line[k:]
-    next_non_matching_line = text[i:].lstrip()
-    k = next_non_matching_line.find('\n')
-    if k == -1:
-      k = len(next_non_matching_line)
-    next_non_matching_line = next_non_matching_line[:k]
-    print(f'{last_matching_line=}')
-    print(f'{next_non_matching_line=}')
-
-    print('FAILED TO CPP PARSE')
+    if ctx.diagnostics.enabled(ERROR):
+      i = len(text) - min(ctx.smallest_matching_rest_length, len(text))
+      k = text.rfind('\n', 0, i) + 1
+      last_matching_line = text[k:i]
+      next_non_matching_line = text[i:].lstrip()
+      k = next_non_matching_line.find('\n')
+      if k != -1:
+        next_non_matching_line = next_non_matching_line[:k]
+      ctx.diagnostics.error('failed to CPP parse after the line {!r}', str(last_matching_line), source=next_non_matching_line)
     return
 
   r = r.rewrite(ctx)
   r._ctx = ctx
 
-  if ctx.unevaluated_macros:
-    print('CPP preprocessor discover the following undefined CPP macros:')
-    print('  ', ', '.join(ctx.unevaluated_macros))
+  if ctx.diagnostics.enabled(WARNING):
+    if ctx.unevaluated_macros:
+      ctx.diagnostics.warning('CPP preprocessor discover the following undefined CPP macros: {}',
+                              ', '.join(map(str, ctx.unevaluated_macros)))
+    if ctx.unresolved_includes:
+      ctx.diagnostics.warning('CPP preprocessor could not find the following included files: {}',
+                              ', '.join(sorted(ctx.unresolved_includes)))
 
   return r
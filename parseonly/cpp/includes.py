@@ -0,0 +1,196 @@
+"""
+Resolving the header names of #include directives to files.
+"""
+import os
+import collections
+
+
+class FileSystemCache:
+  """Memoized directory listings and file checks.
+
+  A file is looked up from the listing of its directory, so that
+  checking many header names in the same directory costs a single
+  listdir call. The cache is not invalidated, use clear when files
+  are created or removed.
+  """
+
+  def __init__(self):
+    self._listdir = dict()
+    self._isfile = dict()
+
+  def listdir(self, path):
+    """Return a set of names in the directory path, the set is empty
+    when path is not a readable directory.
+    """
+    names = self._listdir.get(path)
+    if names is None:
+      try:
+        names = frozenset(os.listdir(path or '.'))
+      except OSError:
+        names = frozenset()
+      self._listdir[path] = names
+    return names
+
+  def isfile(self, path):
+    r = self._isfile.get(path)
+    if r is None:
+      head, tail = os.path.split(path)
+      r = tail in self.listdir(head) and os.path.isfile(path)
+      self._isfile[path] = r
+    return r
+
+  def clear(self):
+    self._listdir.clear()
+    self._isfile.clear()
+
+
+# shared by all include paths in the process:
+default_cache = FileSystemCache()
+
+
+class IncludePaths:
+  """Search paths of header files.
+
+  The directories are searched in the order
+
+    quote   - only for "..." includes (as in -iquote)
+    angled  - for all includes (as in -I)
+    system  - for all includes (as in -isystem and -idirafter)
+
+  A "..." include is first searched from the directory of the
+  including file.
+  """
+
+  def __init__(self, quote=(), angled=(), system=(), cache=None):
+    self.quote = list(quote)
+    self.angled = list(angled)
+    self.system = list(system)
+    self.cache = default_cache if cache is None else cache
+    self._resolved = dict()
+
+  @classmethod
+  def from_options(cls, args, cache=None):
+    """Return include paths from compiler options -I, -iquote,
+    -isystem and -idirafter, other options are ignored. The option
+    value can be attached to the option or be the next argument.
+    """
+    quote, angled, system, after = [], [], [], []
+    lists = {'-I': angled, '-iquote': quote, '-isystem': system, '-idirafter': after}
+    args = iter(args)
+    for arg in args:
+      for option, lst in lists.items():
+        if arg == option:
+          lst.append(next(args))
+          break
+        if arg.startswith(option):
+          lst.append(arg[len(option):])
+          break
+    return cls(quote=quote, angled=angled, system=system + after, cache=cache)
+
+  @property
+  def dirs(self):
+    """The list of all search directories.
+    """
+    return self.quote + self.angled + self.system
+
+  def resolve(self, name, angled=False, current_dir=None, start=None):
+    """Return a pair (path, index) of the header file and the index of
+    its directory in dirs, or (None, None) when the header is not
+    found. The index of a header that is found from current_dir is -1.
+
+    The search starts from the directory at start when specified, this
+    is used for #include_next.
+    """
+    key = name, angled, current_dir, start
+    r = self._resolved.get(key)
+    if r is None:
+      r = self._resolved[key] = self._resolve(name, angled, current_dir, start)
+    return r
+
+  def _resolve(self, name, angled, current_dir, start):
+    if os.path.isabs(name):
+      return (name, -1) if self.cache.isfile(name) else (None, None)
+    if start is None:
+      if not angled and current_dir is not None:
+        path = os.path.join(current_dir, name)
+        if self.cache.isfile(path):
+          return path, -1
+      start = len(self.quote) if angled else 0
+    dirs = self.dirs
+    for index in range(start, len(dirs)):
+      path = os.path.join(dirs[index], name)
+      if self.cache.isfile(path):
+        return path, index
+    return None, None
+
+
+class HeaderCache:
+  """A bounded cache of parsed header files.
+
+  Entries are keyed by the path, the modification time and the size
+  of a file so that a modified file is parsed again. The least
+  recently used entries are dropped when the count of entries
+  exceeds maxsize.
+
+  A cache is not shared between processes. It is picklable, so that
+  a copy can be sent to worker processes, see parallel.parse_many.
+  """
+
+  def __init__(self, maxsize=256):
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self._entries = collections.OrderedDict()
+    self._keys = dict()  # pairs (path, key)
+
+  def get(self, path, parse):
+    """Return parse(path), the result is reused when the file has not
+    changed since the previous call.
+    """
+    try:
+      st = os.stat(path)
+    except OSError:
+      return parse(path)
+    key = path, st.st_mtime_ns, st.st_size
+    if key in self._entries:
+      self.hits += 1
+      self._entries.move_to_end(key)
+      return self._entries[key]
+    self.misses += 1
+    r = parse(path)
+    old = self._keys.pop(path, None)
+    if old is not None:
+      del self._entries[old]
+    self._entries[key] = r
+    self._keys[path] = key
+    while len(self._entries) > self.maxsize:
+      old, _ = self._entries.popitem(last=False)
+      del self._keys[old[0]]
+    return r
+
+  def __len__(self):
+    return len(self._entries)
+
+  def clear(self):
+    self._entries.clear()
+    self._keys.clear()
+
+
+# shared by all preprocess calls in the process, see
+# CPPContext.header_cache and parallel.parse_many:
+default_header_cache = HeaderCache()
+
+
+def header_name(pp_tokens):
+  """Return a pair (name, angled) from the pp-tokens of an #include
+  directive after macro replacement, or (None, None) when the tokens
+  do not form a header name.
+  """
+  tokens = pp_tokens.pp_tokens
+  s = str(tokens[0]) if len(tokens) == 1 else ''.join(map(str, tokens))
+  if len(s) > 2:
+    if s[0] == '"' and s[-1] == '"':
+      return s[1:-1], False
+    if s[0] == '<' and s[-1] == '>':
+      return s[1:-1], True
+  return None, None
@@ -0,0 +1,275 @@
+"""
+Macro tables, predefined macros, and the macro dependencies of
+preprocessing results.
+"""
+import collections
+import collections.abc
+
+
+_missing = object()
+_undefined = object()  # marks a macro that is undefined in a table layer
+
+
+class MacroTable(collections.abc.MutableMapping):
+  """A mapping of macro names to definitions that can be forked in
+  constant time.
+
+  A table consists of its own layer of definitions and a shared
+  parent table that is not modified anymore. Forking moves the own
+  layer of a table to a new parent that is shared by the table and
+  its fork, so that both can be modified independently. Lookups go
+  through the layers from the own layer down to the base table and
+  stop at the first hit, the dicts of the layers are never copied for
+  lookups. When the chain of parents is longer than max_depth, the
+  layers above the base table are merged into one layer, the base
+  table, typically a large profile table, stays shared.
+  """
+
+  max_depth = 8
+
+  def __init__(self, items=(), parent=None):
+    self._local = dict(items)
+    self._parent = parent
+    self._depth = 0 if parent is None else parent._depth + 1
+    self._layers = (self._local,) + (() if parent is None else parent._layers)
+
+  def fork(self):
+    """Return a copy of the table.
+    """
+    if self._local:
+      parent = MacroTable(parent=self._parent)
+      parent._local = self._local
+      parent._layers = (parent._local,) + parent._layers[1:]
+      if parent._depth >= self.max_depth:
+        base = parent
+        while base._parent is not None:
+          base = base._parent
+        merged = dict()
+        for layer in reversed(parent._layers[:-1]):
+          merged.update(layer)
+        parent = MacroTable(merged, parent=base)
+      self._parent = parent
+      self._local = dict()
+      self._depth = parent._depth + 1
+      self._layers = (self._local,) + parent._layers
+    return MacroTable(parent=self._parent)
+
+  def __getitem__(self, name):
+    for layer in self._layers:
+      value = layer.get(name, _missing)
+      if value is not _missing:
+        if value is _undefined:
+          break
+        return value
+    raise KeyError(name)
+
+  def __contains__(self, name):
+    for layer in self._layers:
+      value = layer.get(name, _missing)
+      if value is not _missing:
+        return value is not _undefined
+    return False
+
+  def get(self, name, default=None):
+    for layer in self._layers:
+      value = layer.get(name, _missing)
+      if value is not _missing:
+        return default if value is _undefined else value
+    return default
+
+  def __setitem__(self, name, value):
+    self._local[name] = value
+
+  def __delitem__(self, name):
+    if name not in self:
+      raise KeyError(name)
+    if self._parent is not None and name in self._parent:
+      self._local[name] = _undefined
+    else:
+      del self._local[name]
+
+  def __iter__(self):
+    seen = set()
+    for layer in self._layers:
+      for name, value in layer.items():
+        if name not in seen:
+          seen.add(name)
+          if value is not _undefined:
+            yield name
+
+  def __len__(self):
+    return sum(1 for _ in self)
+
+  def __repr__(self):
+    return f'{type(self).__name__}({dict(self.items())!r})'
+
+
+# Predefined macros of compilers for x86_64 Linux in C++17 mode:
+_common_predefines = '''\
+#define __cplusplus 201703L
+#define __STDC__ 1
+#define __STDC_HOSTED__ 1
+#define __linux__ 1
+#define __unix__ 1
+#define __x86_64__ 1
+#define __LP64__ 1
+#define __CHAR_BIT__ 8
+#define __SIZEOF_SHORT__ 2
+#define __SIZEOF_INT__ 4
+#define __SIZEOF_LONG__ 8
+#define __SIZEOF_LONG_LONG__ 8
+#define __SIZEOF_POINTER__ 8
+#define __SIZEOF_FLOAT__ 4
+#define __SIZEOF_DOUBLE__ 8
+#define __SIZEOF_SIZE_T__ 8
+#define __SCHAR_MAX__ 0x7f
+#define __SHRT_MAX__ 0x7fff
+#define __INT_MAX__ 0x7fffffff
+#define __LONG_MAX__ 0x7fffffffffffffffL
+#define __LONG_LONG_MAX__ 0x7fffffffffffffffLL
+#define __ORDER_LITTLE_ENDIAN__ 1234
+#define __ORDER_BIG_ENDIAN__ 4321
+#define __BYTE_ORDER__ __ORDER_LITTLE_ENDIAN__
+#define __EXCEPTIONS 1
+#define __GXX_RTTI 1
+'''
+
+profiles = {
+  'gcc': _common_predefines + '''\
+#define __GNUC__ 13
+#define __GNUC_MINOR__ 2
+#define __GNUC_PATCHLEVEL__ 0
+#define __GNUG__ 13
+''',
+  'clang': _common_predefines + '''\
+#define __clang__ 1
+#define __clang_major__ 17
+#define __clang_minor__ 0
+#define __clang_patchlevel__ 0
+#define __GNUC__ 4
+#define __GNUC_MINOR__ 2
+#define __GNUC_PATCHLEVEL__ 1
+#define __GNUG__ 4
+''',
+}
+
+
+def _iter_options(args):
+  # Iterator of triples (option, name, body) of -D and -U options, the
+  # body of -U options is None.
+  args = iter(args)
+  for arg in args:
+    if arg in ('-D', '-U'):
+      option, value = arg, next(args)
+    elif arg.startswith(('-D', '-U')):
+      option, value = arg[:2], arg[2:]
+    else:
+      continue
+    if option == '-U':
+      yield option, value, None
+    else:
+      name, eq, body = value.partition('=')
+      yield option, name, (body if eq else '1')
+
+
+def options_source(args):
+  """Return the source of #define and #undef directives corresponding
+  to compiler options -D and -U in args, other options are ignored.
+  The option value can be attached to the option or be the next
+  argument.
+
+  -DNAME defines NAME as 1, -DNAME=VALUE defines NAME as VALUE, and
+  -UNAME undefines NAME.
+  """
+  lines = []
+  for option, name, body in _iter_options(args):
+    if option == '-U':
+      lines.append(f'#undef {name}\n')
+    else:
+      lines.append(f'#define {name} {body}\n')
+  return ''.join(lines)
+
+
+def changed_macros(old_args, new_args):
+  """Return a set of macro names that the -D and -U options of
+  old_args and new_args define differently.
+
+  The name of a function-like macro is the part of its option before
+  `(`. A name that is only undefined in one of the option lists counts
+  as changed, since it may be predefined.
+  """
+  def definitions(args):
+    d = dict()
+    for option, name, body in _iter_options(args):
+      name, paren, params = name.partition('(')
+      d[name] = None if body is None else (paren + params, body)
+    return d
+  old, new = definitions(old_args), definitions(new_args)
+  return {name for name in old.keys() | new.keys() if old.get(name, _missing) != new.get(name, _missing)}
+
+
+class RecordingView:
+  """A read-only view of a macro table that records the names that are
+  looked up, including the names that are not defined.
+  """
+
+  def __init__(self, table, names):
+    self.table = table
+    self.names = names
+
+  def __contains__(self, name):
+    self.names.add(str(name))
+    return name in self.table
+
+  def __getitem__(self, name):
+    self.names.add(str(name))
+    return self.table[name]
+
+  def get(self, name, default=None):
+    self.names.add(str(name))
+    return self.table.get(name, default)
+
+
+Dependency = collections.namedtuple('Dependency', ['kind', 'filename', 'lineno', 'names'])
+
+
+class MacroDependencies:
+  """Records of the macro names that the results of preprocessing
+  depend on.
+
+  A record is added for each decision of an if-section ('if_section'),
+  each macro expansion of text lines ('text_line') and #include
+  directives ('include'), and each #include that is skipped because
+  its include guard macro is defined ('include'). filename is the file
+  of the record, None for the main text, and lineno is the line of the
+  record in that file.
+  """
+
+  def __init__(self):
+    self.records = []  # Dependency instances
+
+  def add(self, kind, filename, lineno, names):
+    self.records.append(Dependency(kind, filename, lineno, frozenset(names)))
+
+  @property
+  def names(self):
+    """The set of all macro names that the records depend on.
+    """
+    return frozenset().union(*(r.names for r in self.records))
+
+  def invalidated(self, names):
+    """Return a list of the records that depend on any of names, for
+    instance, on changed_macros(old_args, new_args).
+    """
+    names = set(names)
+    return [r for r in self.records if not r.names.isdisjoint(names)]
+
+
+def invalidated_files(dependencies, names):
+  """Return a sorted list of the keys of dependencies, a mapping of
+  file names and MacroDependencies instances, that need to be
+  preprocessed again after the macros of names have changed. The
+  records of a file include the records of its included files.
+  """
+  names = set(names)
+  return sorted(key for key, deps in dependencies.items() if not names.isdisjoint(deps.names))
@@ -1,3 +1,12 @@
+import re
+import array
+import bisect
+import collections
+
+
+# backslash followed by a newline, or by whitespace till the end of a
+# line, or a lone backslash:
+_backslash = re.compile(r'\\(?:(\n)|[^\S\n]+(?=\n))?')
 
 def remove_backslashes(text):
   """Return text with backslashes followed by white space till the end
@@ -10,56 +19,91 @@ def remove_backslashes(text):
   performed by preserving the number of new lines. This is different
   from the Stage 2 but it will produce still legal input to Stage 3.
   """
-  n = len(text)
-  stext = [' '] * n
+  text = str(text)
   if text.startswith('\ufeff'):
-    stest[0] = ''
-    i = 1
-  else:
-    i = 0
-  count = 0  # to preserve newline count
-  while i < n:
-    if text[i] == '\\':
-      k = text.find('\n', i)
-      if k == -1:  # end of text
-        stext[i] = ''
-        i += 1
-      elif k == i + 1:
-        # backslash followed by new line is removed
-        count += 1
-        stext[i] = stext[k] = ''
-        i = k + 1
-      elif text[i + 1:k].isspace():
-        # remove backslash and any whitespace but keep newline 
-        stext[i:k] = [''] * (k - i)
-        i = k
-      else:
-        # just remove backslash
-        stext[i] = ''
-        i += 1
-    elif text[i] == '\n':
-      stext[i] = text[i] + ('\n' * count)
-      r = text[i] + ('\n' * count)
+    text = text[1:]
+  if '\\' not in text:
+    return text
+  text, count = _splice(text)
+  return text + '\n' * count
+
+def _splice(text, count=0):
+  # Return spliced text and the count of spliced newlines that are not
+  # restored yet. count is the number of pending newlines from the
+  # preceding text.
+  pieces = []
+  pos = 0
+  for m in _backslash.finditer(text):
+    start = m.start()
+    if count:
+      # spliced newlines are restored after the end of logical line
+      k = text.find('\n', pos, start)
+      if k != -1:
+        pieces.append(text[pos:k + 1])
+        pieces.append('\n' * count)
+        count = 0
+        pos = k + 1
+    pieces.append(text[pos:start])
+    if m.group(1):
+      count += 1
+    pos = m.end()
+  if count:
+    k = text.find('\n', pos)
+    if k != -1:
+      pieces.append(text[pos:k + 1])
+      pieces.append('\n' * count)
       count = 0
-      i += 1
+      pos = k + 1
+  pieces.append(text[pos:])
+  return ''.join(pieces), count
+
+# The start of a comment or of a string/character literal:
+_comment_or_quote = re.compile(r'//|/\*|["\']')
+# The rest of a string/character literal including the closing quote:
+_literal_rest = {'"': re.compile(r'(?:[^"\\]|\\.)*"', re.S),
+                 "'": re.compile(r"(?:[^'\\]|\\.)*'", re.S)}
+_non_whitespace = re.compile(r'\S')
+_non_newline = re.compile(r'[^\n]')
+
+def _literal_end(text, i):
+  # Return the end of the literal that starts with a quote at i. An
+  # unterminated literal extends to the end of text.
+  m = _literal_rest[text[i]].match(text, i + 1)
+  return len(text) if m is None else m.end()
+
+def _iter_comments(text):
+  # Iterator of (start, k, token) of comments in text, token is '//'
+  # or '/*' and k is the offset of the terminating newline or `*/`,
+  # respectively, or len(text) when the comment is not terminated.
+  n = len(text)
+  pos = 0
+  while True:
+    m = _comment_or_quote.search(text, pos)
+    if m is None:
+      return
+    i = m.start()
+    token = m.group()
+    if token == '//':
+      k = text.find('\n', i)
+      if k == -1:
+        k = n
+      yield i, k, token
+      pos = k + 1
+    elif token == '/*':
+      k = text.find('*/', i)
+      if k == -1:
+        k = n
+      yield i, k, token
+      pos = k + 2
     else:
-      k = text.find('\\', i)
-      m = text.find('\n', i)
-      if m != -1 and m < k:
-        stext[i:m] = text[i:m]
-        i = m
-      elif k == -1:
-        if count == 0:
-          stext[i:] = text[i:]
-          break
-        else:
-          stext[i] = text[i]
-          i += 1
-      else:
-        stext[i:k] = text[i:k]
-        i = k
+      pos = _literal_end(text, i)
 
-  return ''.join(stext)
+def _comment_direction(text, i, token):
+  # '>' when only whitespace precedes the comment on its line
+  m = text.rfind('\n', 0, i)
+  if m == -1:
+    return '>' if token == '/*' and text[:i].isspace() else '<'
+  return '>' if text[m:i].isspace() else '<'
 
 def reference_comments(text, label_format='@@@{direction}{count}@@@'):
   """Reference C++ comments in source text.
@@ -82,83 +126,173 @@ def reference_comments(text, label_format='@@@{direction}{count}@@@'):
 
   The newline counts of text and stext are equal.
   """
-  n = len(text)
-  stext = [' '] * n
   cdict = dict()
-  string_sequence = None
-  i = 0
-  slash_counts = 0
-  comment_count = 0
-  while i < n:
-    if string_sequence:
-      if text[i] == '\\':
-        slash_counts += 1
-      elif text[i] == string_sequence and slash_counts % 2 == 0:
-        string_sequence = None
-        slash_counts = 0
+  stext = _CommentReferencer(label_format, cdict).feed(str(text), final=True)
+  return stext, cdict
+
+
+class _CommentReferencer:
+  # reference_comments applied to consecutive pieces of text where
+  # each piece but the last one ends with a newline. Literals and
+  # block comments that continue in the next piece are carried over.
+
+  def __init__(self, label_format, cdict):
+    self.label_format = label_format
+    self.cdict = cdict
+    self.count = 0
+    self.quote = None    # the quote of a continuing literal
+    self.comment = None  # label and pieces of a continuing block comment
+    self.started = False  # some text has been seen
+    self.newline = False  # a newline has been seen
+    self.blank = True     # only whitespace follows the last newline
+
+  def _advance(self, raw):
+    if raw:
+      self.started = True
+      k = raw.rfind('\n')
+      if k == -1:
+        self.blank = self.blank and raw.isspace()
       else:
-        slash_counts = 0
-      stext[i] = text[i]
-      i += 1
+        self.newline = True
+        self.blank = k + 1 == len(raw) or raw[k + 1:].isspace()
+
+  def _label(self, token):
+    # same as _comment_direction but using the state of seen text
+    if self.newline:
+      direction = '>' if self.blank else '<'
     else:
-      if text[i:i+2] == '//':
-        m = text.rfind('\n', 0, i)
-        if m == -1:
-          m = len(text)
-        d = '>' if text[m:i].isspace() else '<'
-        comment_count += 1
-        label = label_format.format(direction=d, count=comment_count)
+      direction = '>' if token == '/*' and self.started and self.blank else '<'
+    self.count += 1
+    return self.label_format.format(direction=direction, count=self.count)
+
+  def _close_literal(self, text, start, i, stext):
+    # Return the end of the literal that continues at i in text.
+    m = _literal_rest[self.quote].match(text, i)
+    if m is None:
+      end = len(text)
+    else:
+      end = m.end()
+      self.quote = None
+    stext.append(text[start:end])
+    self._advance(text[start:end])
+    return end
+
+  def _close_comment(self, text, start, final, stext):
+    # Return the end of the block comment that continues at start in
+    # text.
+    label, pieces = self.comment
+    k = text.find('*/', start)
+    if k == -1:
+      if not final:
+        pieces.append(text[start:])
+        self._advance(text[start:])
+        return len(text)
+      k = end = len(text)
+    else:
+      end = k + 2
+    pieces.append(text[start:k])
+    raw = ''.join(pieces)
+    self.cdict[label] = raw[2:]
+    c = self.cdict[label].count('\n')
+    m = min(len(label) + c, len(raw))
+    stext.append(label + '\n' * c + ' ' * max(end - k + len(raw) - max(m, 2), 0))
+    self._advance(text[start:end])
+    self.comment = None
+    return end
+
+  def feed(self, text, final=False):
+    """Return the referenced text of the next piece.
+    """
+    n = len(text)
+    stext = []
+    pos = 0
+    if self.comment is not None:
+      pos = self._close_comment(text, 0, final, stext)
+    elif self.quote is not None:
+      pos = self._close_literal(text, 0, 0, stext)
+    while self.comment is None and self.quote is None:
+      m = _comment_or_quote.search(text, pos)
+      if m is None:
+        stext.append(text[pos:])
+        self._advance(text[pos:])
+        break
+      i = m.start()
+      stext.append(text[pos:i])
+      self._advance(text[pos:i])
+      token = m.group()
+      if token == '//':
         k = text.find('\n', i)
         if k == -1:
-          k = len(text)
-        cdict[label] = text[i + 2:k]
+          k = n
+        label = self._label(token)
+        self.cdict[label] = text[i + 2:k]
+        stext.append(label + ' ' * (k - i - min(len(label), k - i)))
         if k < n:
-          stext[k] = text[k]  # newline
-        m = min(len(label), k - i)
-        stext[i:i + m] = [''] * m
-        stext[i] = label
-        i = k + 1
-        continue
-      elif text[i:i+2] == '/*':
-        m = text.rfind('\n', 0, i)
-        if m == -1:
-          d = '>' if text[:i].isspace() else '<'
-        else:
-          d = '>' if text[m:i].isspace() else '<'
-        comment_count += 1
-        label = label_format.format(direction=d, count=comment_count)
-        k = text.find('*/', i)
-        if k == -1:
-          k = len(text)
-        cdict[label] = text[i + 2:k]
-        c = cdict[label].count('\n')
-        m = min(len(label) + c, k - i)
-        stext[i:i + m] = [''] * (m)
-        stext[i] = label
-        stext[i + 1] = '\n' * c
-        i = k + 2
-        continue
-      elif text[i] == '"':
-        string_sequence = '"'
-        slash_counts = 0
-      elif text[i] == "'":
-        string_sequence = "'"
-        slash_counts = 0
-      stext[i] = text[i]
-      i += 1
-  
-  stext = ''.join(stext)
-  # sanity test: preserving the newline count enables computing the
-  # source line numbers correctly.
-  c1 = text.count('\n')
-  c2 = stext.count('\n')
-  if c1 != c2:
-    import difflib
-    s1 = text.splitlines(keepends=True)
-    s2 = stext.splitlines(keepends=True)
-    print(''.join(difflib.context_diff(s1, s2, fromfile='input', tofile='output')))
-    print('FIXME: the newline count of input and output differ: expected {c1} newlines, the output has {c2}')
-  return stext, cdict
+          stext.append('\n')
+        self._advance(text[i:k + 1])
+        pos = k + 1
+      elif token == '/*':
+        self.comment = self._label(token), []
+        pos = self._close_comment(text, i, final, stext)
+      else:
+        self.quote = token
+        pos = self._close_literal(text, i, i + 1, stext)
+    return ''.join(stext)
+
+
+def iter_logical_lines(chunks, label_format='@@@{direction}{count}@@@', cdict=None):
+  """Iterator of source text pieces after translation phases 1-3.
+
+  chunks is an iterable of source text parts of any size, for
+  instance, fixed-size blocks read from a file (see
+  reader.iter_chunks). The BOM is removed, lines are spliced as in
+  remove_backslashes and comments are referenced as in
+  reference_comments in a single pass, so that only the unfinished
+  lines, literals and comments are held in memory. The comments are
+  stored in cdict when specified.
+
+  The pieces are yielded as soon as the lines that contain them are
+  consumed, only a block comment that continues on the next lines
+  delays its line. The concatenation of the pieces is equal to
+
+    reference_comments(remove_backslashes(''.join(chunks)), label_format)[0]
+  """
+  if cdict is None:
+    cdict = dict()
+  referencer = _CommentReferencer(label_format, cdict)
+  first = True
+  rest = []    # raw text after the last newline
+  tail = ''    # spliced text after the last newline
+  count = 0    # spliced newlines that are not restored yet
+  for chunk in chunks:
+    if first and chunk:
+      if chunk.startswith('\ufeff'):
+        chunk = chunk[1:]
+      first = False
+    k = chunk.rfind('\n')
+    if k == -1:
+      rest.append(chunk)
+      continue
+    rest.append(chunk[:k + 1])
+    text = ''.join(rest)
+    rest = [chunk[k + 1:]]
+    if count or '\\' in text:
+      # the raw text ends with a newline, so that it is safe to splice
+      text, count = _splice(text, count)
+    text = tail + text
+    # a spliced newline may leave the last logical line unfinished
+    k = text.rfind('\n')
+    tail = text[k + 1:]
+    text = referencer.feed(text[:k + 1])
+    if text:
+      yield text
+  text = ''.join(rest)
+  if count or '\\' in text:
+    text, count = _splice(text, count)
+  text = referencer.feed(tail + text + '\n' * count, final=True)
+  if text:
+    yield text
+
 
 def separate_comments(text):
   """Separate C++ comments from source text.
@@ -179,52 +313,260 @@ def separate_comments(text):
   This operation corresponds to Stage 3 of lex translation phases.
   """
   n = len(text)
-  stext = [' '] * n
-  ctext = [' '] * n
-  string_sequence = None
-  i = 0
-  slash_counts = 0
-  while i < n:
-    if string_sequence:
-      if text[i] == '\\':
-        slash_counts += 1
-      elif text[i] == string_sequence and slash_counts % 2 == 0:
-        string_sequence = None
-        slash_counts = 0
-      else:
-        slash_counts = 0
-      stext[i] = text[i]
-      i += 1
+  stext = []
+  ctext = []
+  pos = 0
+  while pos < n:
+    m = _comment_or_quote.search(text, pos)
+    i = n if m is None else m.start()
+    # outside of comments and literals, ctext shares the whitespace
+    stext.append(text[pos:i])
+    ctext.append(_non_whitespace.sub(' ', text[pos:i]))
+    if m is None:
+      break
+    token = m.group()
+    if token == '//':
+      k = text.find('\n', i)
+      k = n if k == -1 else k + 1
+      ctext.append(text[i:k])
+      stext.append(' ' * (k - i - 1) + '\n' if text[k - 1] == '\n' else ' ' * (k - i))
+    elif token == '/*':
+      k = text.find('*/', i)
+      k = n if k == -1 else k + 2
+      ctext.append(text[i:k])
+      stext.append(' ' * (k - i))
     else:
-      if text[i:i+2] == '//':
-        k = text.find('\n', i)
-        if k == -1:  # end of text
-          ctext[i:] = text[i:]
-          break
-        else:
-          ctext[i:k + 1] = text[i:k + 1]
-          stext[k] = text[k]
-        i = k + 1
+      k = _literal_end(text, i)
+      stext.append(text[i:k])
+      ctext.append(' ' * (k - i))
+    pos = k
+  return ''.join(stext), ''.join(ctext)
+
+
+Comment = collections.namedtuple('Comment', ['start', 'end', 'direction', 'text'])
+
+class CommentTable:
+  """Holds comments of a source text, see collect_comments.
+
+  Comment start and end offsets are stored in arrays that are sorted
+  so that the comments of a span of the text are found by bisection.
+  direction is '>' or '<' when the comment applies to right or left
+  tokens, respectively, as in reference_comments. text is the content
+  of a comment without comment delimiters.
+  """
+
+  def __init__(self, text=''):
+    self.text = text  # the source text with comments blanked
+    self.starts = array.array('q')
+    self.ends = array.array('q')
+    self.directions = []
+    self.texts = []
+
+  def append(self, start, end, direction, text):
+    self.starts.append(start)
+    self.ends.append(end)
+    self.directions.append(direction)
+    self.texts.append(text)
+
+  def __len__(self):
+    return len(self.starts)
+
+  def __getitem__(self, index):
+    return Comment(self.starts[index], self.ends[index], self.directions[index], self.texts[index])
+
+  def __iter__(self):
+    for index in range(len(self)):
+      yield self[index]
+
+  def within(self, start, end):
+    """Return a list of comments that are inside the span [start, end).
+    """
+    i = bisect.bisect_left(self.starts, start)
+    j = bisect.bisect_left(self.starts, end)
+    return [self[k] for k in range(i, j) if self.ends[k] <= end]
+
+  def leading(self, start):
+    """Return a list of right-applying comments that precede offset
+    start with only whitespace in between.
+    """
+    lst = []
+    k = bisect.bisect_right(self.ends, start) - 1
+    pos = start
+    while k >= 0 and self.directions[k] == '>' and self.text[self.ends[k]:pos].strip() == '':
+      lst.append(self[k])
+      pos = self.starts[k]
+      k -= 1
+    lst.reverse()
+    return lst
+
+  def trailing(self, end):
+    """Return a list of left-applying comments that follow offset end
+    on the same line with only whitespace in between.
+    """
+    lst = []
+    k = bisect.bisect_left(self.starts, end)
+    pos = end
+    while k < len(self) and self.directions[k] == '<':
+      gap = self.text[pos:self.starts[k]]
+      if gap.strip() or '\n' in gap:
+        break
+      lst.append(self[k])
+      pos = self.ends[k]
+      k += 1
+    return lst
+
+  def attached(self, start, end):
+    """Return a list of comments that apply to the span [start, end).
+    """
+    return self.leading(start) + self.within(start, end) + self.trailing(end)
+
+
+def collect_comments(text):
+  """Remove C++ comments from source text into a side table.
+
+  Return a pair (stext, comments) where stext is text with comments
+  replaced by spaces and comments is CommentTable instance. Newlines
+  in block comments are kept, so stext has the same length and
+  newline locations as text.
+
+  This is an alternative to reference_comments that does not inject
+  labels into the text.
+  """
+  n = len(text)
+  stext = []
+  comments = CommentTable()
+  pos = 0
+  for i, k, token in _iter_comments(text):
+    stext.append(text[pos:i])
+    end = k if token == '//' else min(k + 2, n)
+    comments.append(i, end, _comment_direction(text, i, token), text[i + 2:k])
+    stext.append(_non_newline.sub(' ', text[i:end]))
+    pos = end
+  stext.append(text[pos:])
+  comments.text = ''.join(stext)
+  return comments.text, comments
+
+
+# A line containing a preprocessing directive, possibly preceded by
+# comment labels, see reference_comments:
+_directive_line = re.compile(r'^[ \t]*(?:@@@[<>]\d+@@@[ \t]*)*#[ \t]*(\w*)[^\n]*\n', re.M)
+
+def find_group_boundaries(text):
+  """Return a list of offsets in text where the top-level group of a
+  preprocessing file can be split into independently parseable
+  parts.
+
+  A boundary is placed right after a directive line that is not
+  inside an if-section, for example, after `#define` lines and after
+  `#endif` lines that close a top-level if-section. Such boundaries
+  never split if-sections nor sequences of text lines. If the
+  directives of if-sections are unbalanced, an empty list is
+  returned.
+  """
+  offsets = []
+  depth = 0
+  n = len(text)
+  for m in _directive_line.finditer(str(text)):
+    kind = m.group(1)
+    if kind in ('if', 'ifdef', 'ifndef'):
+      depth += 1
+      continue
+    if kind == 'endif':
+      depth -= 1
+      if depth < 0:
+        return []
+    elif kind in ('elif', 'elifdef', 'elifndef', 'else'):
+      continue
+    if depth == 0 and m.end() < n:
+      offsets.append(m.end())
+  if depth != 0:
+    return []
+  return offsets
+
+
+def iter_group_parts(pieces):
+  """Iterator of the parts of a preprocessing file text that is given
+  as an iterable of text pieces, for instance, the pieces of
+  iter_logical_lines.
+
+  The parts end at the boundaries of find_group_boundaries so that
+  each part can be split as a group independently, the last part
+  holds the rest of the text. A part is yielded as soon as the piece
+  that completes it is consumed, so that only the text of the current
+  part is held in memory. When the directives of if-sections are
+  unbalanced, the rest of the text is yielded as a single part.
+  """
+  buffer = ''
+  scanned = 0  # the start of the first line that is not scanned yet
+  depth = 0
+  for piece in pieces:
+    buffer += piece
+    if depth < 0:
+      continue
+    end = 0
+    for m in _directive_line.finditer(buffer, scanned):
+      kind = m.group(1)
+      if kind in ('if', 'ifdef', 'ifndef'):
+        depth += 1
         continue
-      elif text[i:i+2] == '/*':
-        k = text.find('*/', i)
-        if k == -1:  # end of text
-          ctext[i:] = text[i:]
+      if kind == 'endif':
+        depth -= 1
+        if depth < 0:
           break
-        else:
-          ctext[i:k + 2] = text[i:k + 2]
-        i = k + 3
+      elif kind in ('elif', 'elifdef', 'elifndef', 'else'):
         continue
-      elif text[i] == '"':
-        string_sequence = '"'
-        slash_counts = 0
-      elif text[i] == "'":
-        string_sequence = "'"
-        slash_counts = 0
-      stext[i] = text[i]
-      if text[i].isspace():
-        ctext[i] = text[i]
-      i += 1
-  return ''.join(stext), ''.join(ctext)
+      if depth == 0:
+        end = m.end()
+    # the last line may be continued in the next piece
+    scanned = buffer.rfind('\n') + 1
+    if end:
+      yield buffer[:end]
+      buffer = buffer[end:]
+      scanned -= end
+  if buffer:
+    yield buffer
+
+
+_directive_prefix = re.compile(r'[ \t]*(?:@@@[<>]\d+@@@[ \t]*)*')
+_directive_name = re.compile(r'[ \t]*(\w*)')
+
+def find_group_end(text):
+  """Return the offset of the #elif, #else, or #endif directive line
+  that ends the group at the start of text, or -1 when the group is
+  not terminated.
+
+  Only the lines starting with `#` are inspected, the rest of text is
+  not tokenized nor copied when text is a spanstr instance. Nested
+  if-sections are skipped.
+  """
+  depth = 0
+  i = 0
+  n = len(text)
+  while True:
+    j = text.find('#', i)
+    if j == -1:
+      return -1
+    start = text.rfind('\n', 0, j) + 1
+    end = text.find('\n', j)
+    if end == -1:
+      end = n
+    if start == j or _directive_prefix.fullmatch(str(text[start:j])):
+      kind = _directive_name.match(str(text[j + 1:min(end, j + 32)])).group(1)
+      if kind in ('if', 'ifdef', 'ifndef'):
+        depth += 1
+      elif kind == 'endif':
+        if depth == 0:
+          return start
+        depth -= 1
+      elif kind in ('elif', 'elifdef', 'elifndef', 'else') and depth == 0:
+        return start
+    i = end + 1
 
 
+_macro_directive = re.compile(r'^[ \t]*(?:@@@[<>]\d+@@@[ \t]*)*#[ \t]*(?:define|undef)[ \t]+(\w+)', re.M)
+
+def directive_macro_names(text):
+  """Return a set of macro names that are defined or undefined by the
+  #define and #undef directives of text.
+  """
+  return set(_macro_directive.findall(str(text)))
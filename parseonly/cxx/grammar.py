@@ -1,6 +1,7 @@
 import re
 from ..grammar import grammar, Context, splitter, word, item_sequence, pair_or_item, item_optional_prefix, item_optional_suffix, switch, keyword, sequence
 from .. import utils
+from ..spanstr import spanstr, concat
 
 # A set of all C++ keywords
 keyword_identifiers = {"alignas", "alignof", "and", "and_eq", "asm",
@@ -118,6 +119,7 @@ N O P Q R S T U V W X Y Z _
 0 1 2 3 4 5 6 7 8 9
   """
 
+  _grammar_leading = (word,)
   @splitter
   def split(cls, ctx, line):
     return word.split(ctx, line, discard=keyword_and_special_identifiers)
@@ -140,12 +142,14 @@ class class_key(keyword('class_key', 'class', 'struct', 'union')):
 
 @splitter
 def any_integer_literal_split(cls, ctx, line):
+  # characters are scanned as str instances, see spanstr.charat
+  charat = line.charat if isinstance(line, spanstr) else str(line).__getitem__
   for p in cls._prefixes:
     if line.startswith(p):
       i = len(p)
-      if cls._required_digits and (i >= len(line) or str(line[i]) not in cls._required_digits):
+      if cls._required_digits and (i >= len(line) or charat(i) not in cls._required_digits):
         continue
-      while i < len(line) and str(line[i]) in cls._digits:
+      while i < len(line) and charat(i) in cls._digits:
         i += 1
       return cls(line[:i]), line[i:]
 
@@ -179,7 +183,7 @@ class octal_literal(grammar('octal_literal',
   0  1  2  3  4  5  6  7
   """
   def evaluate(self, ctx):
-    return int(self.content.replace("'", ''), 8)
+    return int(str(self.content).replace("'", ''), 8)
   
 class decimal_literal(grammar('decimal_literal',
                                members=dict(
@@ -192,7 +196,7 @@ class decimal_literal(grammar('decimal_literal',
   decimal-literal '? digit
   """
   def evaluate(self, ctx):
-    return int(self.content.replace("'", ''))
+    return int(str(self.content).replace("'", ''))
 
   
 class hexadecimal_literal(grammar('hexadecimal_literal',
@@ -619,7 +623,7 @@ class c_char_sequence(item_sequence('c_char_sequence', c_char)):
   @classmethod
   def postprocess(cls, ctx, item, rest):
     if item is not None:
-      return cls(''.join(item.content)), rest
+      return cls(concat(item.content)), rest
     return item, rest
 
 class s_char_sequence(item_sequence('s_char_sequence', s_char)):
@@ -631,7 +635,7 @@ class s_char_sequence(item_sequence('s_char_sequence', s_char)):
   @classmethod
   def postprocess(cls, ctx, item, rest):
     if item is not None:
-      return cls(''.join(item.content)), rest
+      return cls(concat(item.content)), rest
     return item, rest
 
 class character_literal(grammar('character_literal', ['encoding_prefix', 'c_char_sequence'])):
@@ -712,7 +716,7 @@ class ordinary_string_literal_quotes(grammar('ordinary_string_literal_quotes')):
     if rest.startswith('"'):
       item2, rest = cls.split(ctx, rest)
       if item2:
-        return cls(''.join(item.content + item2.content)), rest
+        return cls(concat(item.content + item2.content)), rest
     return item, rest
 
 class ordinary_string_literal_raw(grammar('ordinary_string_literal_raw')):
@@ -1783,6 +1787,7 @@ class nested_name_specifier(grammar('nested_name_specifier')):
         lst.append(c)
     return '::'.join(lst) + '::'
 
+  _grammar_leading = ('::', lambda: computed_type_specifier, namespace_name, type_name)
   @splitter
   def split(cls, ctx, line):
     if line.startswith('::'):
@@ -1870,6 +1875,7 @@ class primary_expression(switch('primary_expression',
 
 class simple_type_specifier_type_name(grammar('simple_type_specifier_type_name', ['nested_name_specifier', 'type_name'])):
   format = '{0} {1}'
+  _grammar_leading = (nested_name_specifier, type_name)
   @splitter
   def split(cls, ctx, line):
     if not ctx.supports_language('c++'):
@@ -1884,6 +1890,7 @@ class simple_type_specifier_template_name(grammar('simple_type_specifier_templat
   nested-name-specifier? template-name
   """
   format = '{0} {1}'
+  _grammar_leading = (nested_name_specifier, template_name)
   @splitter
   def split(cls, ctx, line):
     spec, rest = nested_name_specifier.split(ctx, line)
@@ -1893,6 +1900,7 @@ class simple_type_specifier_template_name(grammar('simple_type_specifier_templat
 
 class simple_type_specifier_template_id(grammar('simple_type_specifier_template_id', ['nested_name_specifier', 'simple_template_id'])):
   format = '{0}template {1}'
+  _grammar_leading = (nested_name_specifier,)
   @splitter
   def split(cls, ctx, line):
     spec, rest = nested_name_specifier.split(ctx, line)
@@ -1909,6 +1917,7 @@ class decltype_specifier(grammar('decltype_specifier')):
   """
   format = 'decltype({0})'
 
+  _grammar_leading = ('decltype',)
   @splitter
   def split(cls, ctx, line):
     w, rest = word.split(ctx, line, require='decltype')
@@ -1946,6 +1955,7 @@ class placeholder_type_specifier_auto(grammar('placeholder_type_specifier_auto',
   auto
   """
   format = 'auto'
+  _grammar_leading = ('auto',)
   @splitter
   def split(cls, ctx, line):
     auto, rest = word.split(ctx, line, require='auto')
@@ -1957,6 +1967,7 @@ class placeholder_type_specifier_decltype_auto(grammar('placeholder_type_specifi
   decltype(auto)
   """
   format = 'decltype(auto)'
+  _grammar_leading = ('decltype',)
   @splitter
   def split(cls, ctx, line):
     decltype, rest = word.split(ctx, line, require='decltype')
@@ -1983,6 +1994,7 @@ class type_constraint_template_arguments(grammar('type_constraint_template_argum
   nested-name-specifier? concept-name < template-argument-list? >
   """
   format = '{0} {1} <{2}>'
+  _grammar_leading = (nested_name_specifier, concept_name)
   @splitter
   def split(cls, ctx, line):
     s, rest = nested_name_specifier.split(ctx, line)
@@ -2003,6 +2015,7 @@ class type_constraint_simple(grammar('type_constraint_simple', ['nested_name_spe
   nested-name-specifier? concept-name
   """
   format = '{0} {1}'
+  _grammar_leading = (nested_name_specifier, concept_name)
   @splitter
   def split(cls, ctx, line):
     s, rest = nested_name_specifier.split(ctx, line)
@@ -2072,6 +2085,7 @@ class keyword_type_specifier(grammar('keyword_type_specifier')):
     ('double',),
     ('void',),
   ]
+  _grammar_leading = tuple(sorted({t[0] for t in keyword_types}))
     
   @splitter
   def split(cls, ctx, line):
@@ -3255,7 +3269,7 @@ class translation_unit(grammar('translation_unit', ['global-module-fragment', 'm
     pf, rest = private_module_fragment.split(ctx, rest)
 
     if rest:
-      utils.report_unexpected_block_end(cls, head_lines, rest)
-      raise RuntimeError(f'unexpected return when parsing {cls.__name__} (see output above)')
+      utils.report_unexpected_block_end(ctx, cls, head_lines, rest)
+      raise RuntimeError(f'unexpected return when parsing {cls.__name__} (see ctx.diagnostics)')
     if (gf or pf and m) or not (gf or pf or m):
       return cls(gf, m, s, pf), rest
@@ -0,0 +1,97 @@
+"""
+Collecting diagnostics of parsing processes.
+"""
+import collections
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100  # a level that disables all diagnostics
+
+severity_names = {DEBUG: 'debug', INFO: 'info', WARNING: 'warning', ERROR: 'error'}
+
+
+def snippet(text, size=200):
+  """Return text as a str that is shortened to about size characters
+  by removing its middle part. Only the kept parts of text are copied.
+  """
+  if len(text) <= size:
+    return str(text)
+  k = size // 2
+  return f'{text[:k]} ...... <SNIP {len(text) - 2 * k} CHARACTERS> ...... {text[len(text) - k:]}'
+
+
+class Diagnostic(collections.namedtuple('Diagnostic', ['severity', 'message', 'lineno', 'snippet'])):
+  """A message with its severity, the line number of the source (or
+  None), and a bounded snippet of the source (or None).
+  """
+
+  def __str__(self):
+    location = '' if self.lineno is None else f'line {self.lineno}: '
+    s = f'{severity_names.get(self.severity, self.severity)}: {location}{self.message}'
+    return f'{s}\n{self.snippet}' if self.snippet else s
+
+
+class Diagnostics:
+  """A sink of diagnostics with severity level, counters and a bounded
+  list of records.
+
+  Diagnostics with a severity below level are discarded without
+  formatting the message. The message is a format string that is
+  formatted with args only when the diagnostic is recorded, hence call
+  sites pass the values as args instead of f-strings. Call sites on
+  hot paths check enabled(severity) before computing the args.
+
+  At most max_records diagnostics are kept in records, the rest are
+  only counted. When stream is specified, recorded diagnostics are
+  also written to the stream, for instance, sys.stdout.
+  """
+
+  def __init__(self, level=WARNING, max_records=1000, snippet_size=200, stream=None):
+    self.level = level
+    self.max_records = max_records
+    self.snippet_size = snippet_size
+    self.stream = stream
+    self.counts = collections.Counter()  # pairs (severity, count)
+    self.records = []  # Diagnostic instances
+
+  def enabled(self, severity):
+    return severity >= self.level
+
+  def report(self, severity, message, *args, source=None):
+    """Record a diagnostic. source is the spanstr instance (or str) of
+    the source that the diagnostic is about, it is used for the line
+    number and snippet of the diagnostic.
+    """
+    if severity < self.level:
+      return
+    self.counts[severity] += 1
+    if len(self.records) >= self.max_records:
+      return
+    if args:
+      message = message.format(*args)
+    lineno = getattr(source, 'lineno', None)
+    d = Diagnostic(severity, message, lineno, None if source is None else snippet(source, self.snippet_size))
+    self.records.append(d)
+    if self.stream is not None:
+      self.stream.write(f'{d}\n')
+
+  def debug(self, message, *args, source=None):
+    self.report(DEBUG, message, *args, source=source)
+
+  def info(self, message, *args, source=None):
+    self.report(INFO, message, *args, source=source)
+
+  def warning(self, message, *args, source=None):
+    self.report(WARNING, message, *args, source=source)
+
+  def error(self, message, *args, source=None):
+    self.report(ERROR, message, *args, source=source)
+
+  def __len__(self):
+    return sum(self.counts.values())
+
+  def clear(self):
+    self.counts.clear()
+    self.records.clear()
@@ -2,9 +2,13 @@
 Utilities for describing grammar.
 """
 import sys
+import string
 import contextlib
 import collections
 
+from .spanstr import spanstr, ropestr, concat
+from .diagnostics import Diagnostics
+
 class _REQUIRED(object):
   """A singleton object representing a required argument in namedtuple
   subclasses.
@@ -39,7 +43,7 @@ class Context:
   """
   def __init__(self, source=None, debug=False, enable_debug_rerun=False,
                whitespace = ' \t\v\r\f\n',
-               trace=False):
+               trace=False, diagnostics=None):
     # TODO: move this out
     sys.setrecursionlimit(5000)
 
@@ -49,7 +53,9 @@ class Context:
 
     self._unique_counter = 0
 
-    self.detect_recurrence = dict()  # holds pairs (cls name, line)
+    # Re-entry guard and left-recursion support, see splitter:
+    self.recursion_guard = dict()  # holds pairs ((cls, offset), seed)
+    self.seed_hits = 0  # number of uses of left-recursive seeds in progress
     self.enable_abstract_declarator = False
 
     # Language standard/dialect-version
@@ -68,6 +74,9 @@ class Context:
     # Cache of splitting results:
     self.splitter_cache = dict()  # holds pairs (key, cls.split(ctx, line))
 
+    # Sink of warnings and errors, see diagnostics.Diagnostics:
+    self.diagnostics = Diagnostics() if diagnostics is None else diagnostics
+
   @property
   def tab(self):
     return ' ' * self.split_depth
@@ -168,7 +177,7 @@ class Context:
   def splitter_postprocess_rest(self, attrs, item, rest):
     """Extract suffix attributes from splitter line and apply to item.
     """
-    if isinstance(item, str):
+    if isinstance(item, (str, spanstr, ropestr)):
       return item, rest
     whitespace = getattr(type(item), "whitespace_characters", self.whitespace_characters)
     if whitespace:
@@ -227,14 +236,28 @@ def splitter_cache(mth):
     if r is not MISSING_KEY:
       return r
 
+    hits = ctx.seed_hits
     r = mth(cls, ctx, line, *args, **kwargs)
 
-    if type(r) is tuple and len(r) == 2 and r[0] is not None:
+    if type(r) is tuple and len(r) == 2 and r[0] is not None and ctx.seed_hits == hits:
+      # results that used a left-recursive seed still being grown are
+      # intermediate and are not cached
       ctx.splitter_cache[key] = r
     return r
 
   return wrapper_splitter_cache
 
+class _Seed:
+  """Holds the result of a split that is in progress at a given offset.
+  """
+  __slots__ = ('line', 'result', 'detected', 'hits')
+
+  def __init__(self, line):
+    self.line = line
+    self.result = (None, line)
+    self.detected = False
+    self.hits = 0
+
 def splitter(mth):
   """Decorator of a classmethod split that a grammar specification type
   may define.
@@ -257,30 +280,23 @@ def splitter(mth):
     message about unimplemented grammar specification support.
   - Anything else will raise a ValueError about unexpected return value.
 
-  """
-
-  @splitter_cache
-  @splitter_trace
-  @splitter_process_line_and_rest
-  def wrapper(cls, ctx, line, *args, **kwargs):
-    # sanity checks:
-    assert isinstance(ctx, Context)
-    assert line is not None
-
-    if ctx.stop:
-      return None, line
-
-    last_line = ctx.detect_recurrence.get(cls.__name__)
-    if last_line is not None and last_line == line:
-      return None, line
-    ctx.detect_recurrence[cls.__name__] = line
+  A split that calls itself with the same line, directly or
+  indirectly, receives the result of the split that is in progress:
+  `(None, line)` by default. When the grammar specification type
+  defines `left_recursive = True`, the split is repeated with the
+  previous result as the seed until the match does not grow anymore
+  (Warth et al, Packrat Parsers Can Support Left Recursion, 2008).
+  This allows writing left-recursive rules such as
 
-    r = mth(cls, ctx, line, *args, **kwargs)
+    expr: expr - term | term
 
-    ctx.detect_recurrence.pop(cls.__name__, None)
+  directly. Since a line is always the tail of the parser input, the
+  position of a split is identified by the length of the line.
+  """
 
+  def process(cls, ctx, line, r):
     if r is UNEXPECTED:
-      print(f'{cls.__name__} unexpected mismatch')
+      ctx.diagnostics.debug('{} unexpected mismatch', cls.__name__, source=line)
       return (None, line)
     
     if r is None:
@@ -288,7 +304,7 @@ def splitter(mth):
       return (None, line)
 
     if r is NotImplemented:
-      print(f'{cls.__name__} match not implemented')
+      ctx.diagnostics.debug('{} match not implemented', cls.__name__, source=line)
       return (None, line)
 
     if not (type(r) is tuple and len(r) == 2):
@@ -306,16 +322,109 @@ def splitter(mth):
 
     return r
 
+  @splitter_cache
+  @splitter_trace
+  @splitter_process_line_and_rest
+  def wrapper(cls, ctx, line, *args, **kwargs):
+    # sanity checks:
+    assert isinstance(ctx, Context)
+    assert line is not None
+
+    if ctx.stop:
+      return None, line
+
+    key = (cls, len(line))
+    previous = ctx.recursion_guard.get(key)
+    if previous is not None and (previous.line is line or previous.line == line):
+      previous.detected = True
+      if cls.left_recursive:
+        previous.hits += 1
+        ctx.seed_hits += 1
+      return previous.result
+
+    # a different line of the same length may be split while the
+    # previous one is in progress, its seed is restored below
+    seed = ctx.recursion_guard[key] = _Seed(line)
+    try:
+      r = process(cls, ctx, line, mth(cls, ctx, line, *args, **kwargs))
+      if cls.left_recursive and seed.detected:
+        # grow the seed
+        while r[0] is not None:
+          seed.result = r
+          r2 = process(cls, ctx, line, mth(cls, ctx, line, *args, **kwargs))
+          if r2[0] is None or len(r2[1]) >= len(r[1]):
+            break
+          r = r2
+    finally:
+      if previous is None:
+        del ctx.recursion_guard[key]
+      else:
+        ctx.recursion_guard[key] = previous
+      # the grown result is final, only uses of other seeds in
+      # progress keep the callers from caching their results
+      ctx.seed_hits -= seed.hits
+    return r
+
   return classmethod(wrapper)
 
 
 class Grammar:
 
   _join_separator = ' '
+
+  # When True, splitter supports left recursion by seed growing:
+  left_recursive = False
   
   def __eq__(self, other):
     return type(self) is type(other) and tuple(self) == tuple(other)
 
+  def __getstate__(self):
+    # the parsing context of a tree (see cpp.preprocess) holds splitter
+    # caches that are not worth sending to other processes
+    state = getattr(self, '__dict__', None)
+    if state and '_ctx' in state:
+      state = {k: v for k, v in state.items() if k != '_ctx'}
+    return state or None
+
+  def location(self):
+    """Return a triple (offset, lineno, column) of the first source
+    text in the node, or None when the node does not contain spanstr
+    instances.
+    """
+    def first(obj):
+      if isinstance(obj, spanstr):
+        return obj
+      if isinstance(obj, ropestr):
+        obj = tuple(obj.pieces())
+      if isinstance(obj, (tuple, list)):
+        for item in obj:
+          s = first(item)
+          if s is not None:
+            return s
+
+    s = first(self)
+    if s is not None:
+      return s.span[0], s.lineno, s.start
+
+  def source_span(self):
+    """Return a pair (begin, end) of source text offsets covered by the
+    node, or None when the node does not contain spanstr instances.
+    """
+    begin = end = None
+    stack = [self]
+    while stack:
+      obj = stack.pop()
+      if isinstance(obj, spanstr):
+        b, e = obj.span
+        begin = b if begin is None else min(begin, b)
+        end = e if end is None else max(end, e)
+      elif isinstance(obj, ropestr):
+        stack.extend(obj.pieces())
+      elif isinstance(obj, (tuple, list)):
+        stack.extend(obj)
+    if begin is not None:
+      return begin, end
+
   def __str__(self):
     fmt = getattr(self, 'format', None)
 
@@ -340,13 +449,64 @@ class Grammar:
       return fmt.format(*lst)
     return ' '.join([str(v) for k, v in self._asdict().items() if v is not None])
 
+  def torope(self):
+    """Return the text of the node, equal to str(self), as a
+    concatenation of its spanstr leaves (see spanstr.concat) so that
+    the offsets of the text can be mapped back to source locations,
+    see ropestr.location.
+    """
+    return concat(self._pieces())
+
+  def _pieces(self):
+    # mirrors __str__, returns a list of str, spanstr, and ropestr pieces
+    def pieces(obj):
+      if isinstance(obj, Grammar):
+        return obj._pieces()
+      if isinstance(obj, (str, spanstr, ropestr)):
+        return [obj]
+      return [str(obj)]
+
+    def join(sep, items):
+      lst = []
+      for i, item in enumerate(items):
+        if i:
+          lst.append(sep)
+        lst.extend(pieces(item))
+      return lst
+
+    fmt = getattr(self, 'format', None)
+
+    if self._fields == ('content',) or self._fields == (type(self).__name__,):
+      if isinstance(self[0], list):
+        return join(', ', self[0])
+      elif type(self[0]) is tuple:
+        return join(self._join_separator, self[0])
+      if fmt is None:
+        fmt = '{0}'
+
+    if fmt is not None:
+      lst = []
+      for i in range(len(self._fields)):
+        p = [] if self[i] is None else pieces(self[i])
+        lst.append(p)
+        if not any(map(len, p)):
+          fmt = fmt.replace(f'{{{i}}} ', '').replace(f' {{{i}}}', '').replace(f'{{{i}}}', '')
+      result = []
+      for literal, field, spec, conversion in string.Formatter().parse(fmt):
+        if literal:
+          result.append(literal)
+        if field is not None:
+          result.extend(lst[int(field)])
+      return result
+    return join(' ', [v for v in self if v is not None])
+
   def tostring(self, tab=''):
 
     def worker(obj, tab=''):
       if isinstance(obj, str):
         return tab + repr(obj)
-      #elif isinstance(obj, spanstr):
-      #  return obj.tostring(with_location=True)
+      elif isinstance(obj, spanstr):
+        return tab + obj.tostring(with_location=True)
       elif type(obj) is tuple:
         s = ',\n'.join([worker(item, tab=tab + ' ') for item in obj])
         if len(obj) == 1:
@@ -503,7 +663,7 @@ def item_sequence(*args, **kwargs):
 
   return grammar(name, [field],
                  members=dict(
-                     _join_separator = join_separator,
+                     _join_separator = join_separator, _grammar_kind='item_sequence',
                      _item=item, split=splitter(item_sequence_split)))
 
 def pair_or_item(*args):
@@ -541,7 +701,7 @@ def pair_or_item(*args):
       return left, rest
 
   return grammar(name, ['content'],
-                 members=dict(_item=item, _separators=separators,
+                 members=dict(_item=item, _separators=separators, _grammar_kind='pair_or_item',
                               split=splitter(pair_or_item_split)))
 
 def item_optional_suffix(item, suffix):
@@ -563,7 +723,8 @@ def item_optional_suffix(item, suffix):
         return cls(i, t), rest
       return i, rest
   return grammar(name, ['content', 'suffix'],
-                 members=dict(_item=item, _suffix=suffix, split=item_optional_suffix_split))
+                 members=dict(_item=item, _suffix=suffix, _grammar_kind='item_optional_suffix',
+                              split=item_optional_suffix_split))
 
 def item_optional_prefix(item, prefix):
   """
@@ -584,7 +745,7 @@ def item_optional_prefix(item, prefix):
         return cls(t, i), rest
       return i, rest
   return grammar(name, ['prefix', 'content'],
-                    members=dict(_item=item, _prefix=prefix,
+                    members=dict(_item=item, _prefix=prefix, _grammar_kind='item_optional_prefix',
                                  split=item_optional_prefix_split))
 
 def switch(*args, **kwargs):
@@ -610,7 +771,7 @@ def switch(*args, **kwargs):
       if item is not None:
         return item, rest
 
-  return grammar(name, ['unused'], members=dict(_grammar_specs=specs, split=switch_split,
+  return grammar(name, ['unused'], members=dict(_grammar_specs=specs, split=switch_split, _grammar_kind='switch',
                                                 _require_language=require_language))
 
 
@@ -636,7 +797,7 @@ def sequence(*args):
     return cls(tuple(lst)), rest
       
   return grammar(name, ['content'],
-                 members=dict(_grammar_specs=specs, split=sequence_split,))
+                 members=dict(_grammar_specs=specs, split=sequence_split, _grammar_kind='sequence'))
 
 def keyword(*args):
   """
@@ -657,7 +818,7 @@ def keyword(*args):
       if item is not None:
         return cls(item), rest
 
-  return grammar(name, ['unused'], members=dict(_grammar_specs=specs, split=keyword_split))
+  return grammar(name, ['unused'], members=dict(_grammar_specs=specs, split=keyword_split, _grammar_kind='keyword'))
   
 class word(grammar('word')):
   """Matches
@@ -682,12 +843,15 @@ class word(grammar('word')):
     """
     # TODO: use re for faster processing
     if line and cls.startswith_identifier0(line):
-      word, rest = line, line[len(line):]
-      for i in range(1, len(line)):
-        if not cls.startswith_identifier(line[i]):
-          word = line[:i]
-          rest = line[i:]
+      # scan str characters, slicing a spanstr per character is slow
+      chars = line.iterchars() if isinstance(line, spanstr) else iter(line)
+      next(chars)
+      i = 1
+      for c in chars:
+        if not cls.startswith_identifier(c):
           break
+        i += 1
+      word, rest = line[:i], line[i:]
       if strip:
         rest = rest.lstrip(ctx.whitespace_characters)
       if isinstance(require, str):
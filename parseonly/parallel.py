@@ -0,0 +1,248 @@
+"""
+Parsing sources in parallel worker processes.
+"""
+import os
+import re
+import pickle
+import concurrent.futures
+
+from .reader import iter_filenames, read_source
+
+
+def default_parse(text):
+  """Return cpp.preprocess(text), the default parse function of
+  parse_many and aio.
+  """
+  from .cpp import preprocess
+  return preprocess(text)
+
+
+def _picklable_error(exc):
+  try:
+    pickle.dumps(exc)
+  except Exception:
+    return RuntimeError(f'{type(exc).__name__}: {exc}')
+  return exc
+
+
+def parse_path(parse, path):
+  """Read and parse a source file. Used in worker processes and
+  executors. The parsing context of a tree is kept in the current
+  process but it is not pickled, see Grammar.__getstate__.
+  """
+  return parse(read_source(path))
+
+
+def _parse_chunk(parse, chunk):
+  """Parse a chunk of (index, filename, path) triples and return a
+  list of (index, filename, result, error) quadruples.
+
+  An exception raised while parsing a file is returned as the error
+  of that file so that the rest of the chunk is still parsed.
+  """
+  results = []
+  for index, filename, path in chunk:
+    try:
+      results.append((index, filename, parse_path(parse, path), None))
+    except Exception as msg:
+      results.append((index, filename, None, _picklable_error(msg)))
+  return results
+
+
+def make_chunks(items, chunk_bytes=1 << 18):
+  """Return a list of chunks of (index, filename, path) triples.
+
+  items is a sequence of (filename, path) pairs. The items are sorted
+  by file size so that the largest files are scheduled first. Files
+  smaller than chunk_bytes are grouped together into chunks with a
+  total size of about chunk_bytes.
+  """
+  sized = []
+  for index, (filename, path) in enumerate(items):
+    try:
+      size = os.path.getsize(path)
+    except OSError:
+      size = 0
+    sized.append((size, index, filename, path))
+  sized.sort(key=lambda item: item[0], reverse=True)
+
+  chunks = []
+  chunk = []
+  total = 0
+  for size, index, filename, path in sized:
+    chunk.append((index, filename, path))
+    total += size
+    if total >= chunk_bytes:
+      chunks.append(chunk)
+      chunk = []
+      total = 0
+  if chunk:
+    chunks.append(chunk)
+  return chunks
+
+
+def _iter_items(paths, file_exts, root_path):
+  if isinstance(paths, (str, os.PathLike)):
+    paths = [paths]
+  for path in paths:
+    yield from iter_filenames(os.fspath(path), file_exts=file_exts, root_path=root_path)
+
+
+def parse_many(paths, jobs=None, parse=None, ordered=False, chunk_bytes=1 << 18,
+               file_exts=None, root_path=None, executor=None, header_cache=None):
+  """Iterator of triples (filename, result, error) from parsing source
+  files in a process pool.
+
+  paths is a file or directory path, or a sequence of such paths.
+  Directories are walked as in reader.iter_sources.
+
+  parse is a picklable function that is applied to the content of a
+  file, by default, cpp.preprocess is used. When parsing a file
+  raises an exception, the triple contains the exception as error and
+  None as the result.
+
+  The largest files are submitted first and small files are submitted
+  in chunks of about chunk_bytes bytes. Results are yielded as soon as
+  they are available, or in the order of paths when ordered is true.
+
+  jobs is the number of worker processes, by default, the number of
+  CPUs. When jobs is 1, files are parsed in the current process.
+  executor, when specified, is a concurrent.futures executor to be
+  used instead of creating a process pool.
+
+  Header trees are cached per process (see
+  cpp.includes.default_header_cache), the headers parsed in one worker
+  process are not available to the other workers. header_cache, an
+  includes.HeaderCache instance, is copied to each worker of the
+  created process pool as its default header cache, for instance,
+  includes.default_header_cache of the current process after parsing
+  the common headers once. It is not used when files are parsed in the
+  current process or with the given executor.
+  """
+  if parse is None:
+    parse = default_parse
+  chunks = make_chunks(list(_iter_items(paths, file_exts, root_path)), chunk_bytes=chunk_bytes)
+
+  if executor is None and jobs == 1:
+    results_iter = (_parse_chunk(parse, chunk) for chunk in chunks)
+  else:
+    results_iter = _iter_pool_results(parse, chunks, jobs, executor, header_cache)
+
+  if not ordered:
+    for results in results_iter:
+      for index, filename, result, error in results:
+        yield filename, result, error
+    return
+
+  pending = dict()
+  next_index = 0
+  for results in results_iter:
+    for index, filename, result, error in results:
+      pending[index] = filename, result, error
+    while next_index in pending:
+      yield pending.pop(next_index)
+      next_index += 1
+
+
+def _init_worker(header_cache):
+  """Install the default header cache of a worker process, see
+  parse_many.
+  """
+  from .cpp import includes
+  includes.default_header_cache = header_cache
+
+
+def _iter_pool_results(parse, chunks, jobs, executor, header_cache=None):
+  own_executor = executor is None
+  if own_executor:
+    if header_cache is None:
+      executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+    else:
+      executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                                        initargs=(header_cache,))
+  futures = dict()
+  try:
+    for chunk in chunks:
+      futures[executor.submit(_parse_chunk, parse, chunk)] = chunk
+    for future in concurrent.futures.as_completed(futures):
+      try:
+        results = future.result()
+      except Exception as msg:
+        # e.g. a worker died or a result could not be pickled
+        results = [(index, filename, None, msg) for index, filename, path in futures[future]]
+      yield results
+  finally:
+    # reached also when the consumer stops iterating early
+    for future in futures:
+      future.cancel()
+    if own_executor:
+      executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _split_group(text):
+  """Split text as a group of a preprocessing file. Used in worker
+  processes.
+  """
+  from .cpp import grammar as cpp
+  ctx = cpp.CPPContext()
+  with ctx.uses_language('cpp'):
+    return cpp.group.split(ctx, text)
+
+
+def select_boundaries(offsets, size, count, min_chunk_size=0):
+  """Return a subset of sorted offsets that splits a text of given size
+  into at most count chunks of roughly equal size that are not
+  smaller than min_chunk_size.
+  """
+  step = max(min_chunk_size, size // max(count, 1), 1)
+  selected = []
+  last = 0
+  for offset in offsets:
+    if offset - last >= step and size - offset >= min_chunk_size:
+      selected.append(offset)
+      last = offset
+  return selected
+
+
+def split_preprocessing_file(text, jobs=None, min_chunk_size=1 << 16, executor=None):
+  """Split text as a preprocessing file using worker processes. Returns
+  a pair (preprocessing_file, rest) as preprocessing_file.split does.
+
+  The text is cut into chunks at safe top-level boundaries (see
+  cpp.utils.find_group_boundaries) that are parsed in parallel and the
+  resulting groups are stitched into a single group. When text is a
+  spanstr instance, the chunks are spanstr slices and hence the spans
+  of the stitched tree are relative to the original storage.
+  """
+  from .cpp import grammar as cpp, utils
+  if jobs is None:
+    jobs = os.cpu_count() or 1
+  offsets = select_boundaries(utils.find_group_boundaries(text), len(text), 4 * jobs, min_chunk_size=min_chunk_size)
+
+  if not offsets or re.search(r'^[ \t]*(?:export[ \t]+)?module\b', str(text), re.M):
+    # nothing to parallelize or module-file that can be parsed only
+    # as a whole
+    ctx = cpp.CPPContext()
+    with ctx.uses_language('cpp'):
+      return cpp.preprocessing_file.split(ctx, text)
+
+  bounds = list(zip([0] + offsets, offsets + [len(text)]))
+  chunks = [text[start:end] for start, end in bounds]
+
+  own_executor = executor is None
+  if own_executor:
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+  try:
+    results = list(executor.map(_split_group, chunks))
+  finally:
+    if own_executor:
+      executor.shutdown(wait=True, cancel_futures=True)
+
+  parts = []
+  for (start, end), (g, rest) in zip(bounds, results):
+    if g is not None:
+      parts.extend(g.group)
+    if rest != '':
+      # report failure as if the whole text was split
+      return cpp.preprocessing_file(cpp.group(tuple(parts))), text[end - len(rest):]
+  return cpp.preprocessing_file(cpp.group(tuple(parts))), text[len(text):]
@@ -1,28 +1,88 @@
-
 import os
+import mmap
 
-from .spanstr import spanstr
+from .spanstr import spanstr, asciistorage
 
-def iter_sources(source, file_exts=None, root_path=None, dtype=str):
-  """Iterator of pairs (filename, content) from the given path.
+def iter_filenames(source, file_exts=None, root_path=None):
+  """Iterator of pairs (filename, path) from the given path.
 
   Filenames are return relative to root_path. Only filenames that
-  extensions are in file_exts (when specified) are returned.
-
-  Content parts are spanstr instances that wrap the content of files.
+  extensions are in file_exts (when specified) are returned. Files
+  are not opened.
   """
   if root_path is None:
     root_path = os.getcwd()
 
   if os.path.isfile(source):
-    filename = os.path.relpath(source, root_path)
-    content = open(source, 'r', encoding='utf-8-sig').read()
-    yield filename, dtype(content)
+    yield os.path.relpath(source, root_path), source
   elif os.path.isdir(source):
     for dirpath, dnames, fnames in os.walk(source):
       for f in fnames:
         if file_exts is None or os.path.splitext(f)[1] in file_exts:
           fn = os.path.join(dirpath, f)
-          yield from iter_sources(fn, file_exts=file_exts, root_path=root_path, dtype=dtype)
+          yield os.path.relpath(fn, root_path), fn
+
+def read_source(path, dtype=str):
+  """Return the content of a source file.
+  """
+  with open(path, 'r', encoding='utf-8-sig') as f:
+    return dtype(f.read())
+
+def iter_chunks(path, chunk_size=1 << 16):
+  """Iterator of the content of a source file in chunks of chunk_size
+  characters.
+
+  The BOM is not removed, see cpp.utils.iter_logical_lines.
+  """
+  with open(path, 'r', encoding='utf-8') as f:
+    while True:
+      chunk = f.read(chunk_size)
+      if not chunk:
+        return
+      yield chunk
+
+def _is_mappable(buf, chunk_size=1 << 20):
+  # non-ASCII characters would change offsets and carriage returns
+  # are translated when reading text
+  for i in range(0, len(buf), chunk_size):
+    chunk = buf[i:i + chunk_size]
+    if not chunk.isascii() or b'\r' in chunk:
+      return False
+  return True
+
+def map_source(path):
+  """Return the content of a source file as a spanstr instance.
+
+  Pure ASCII files with Unix line endings are memory-mapped and only
+  those parts of the file are decoded that are used as strings. Other
+  files are read as in read_source.
+  """
+  with open(path, 'rb') as f:
+    try:
+      buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+      # empty file
+      return spanstr('')
+  if _is_mappable(buf):
+    return spanstr(asciistorage(buf))
+  buf.close()
+  return read_source(path, dtype=spanstr)
+
+def iter_sources(source, file_exts=None, root_path=None, dtype=str, use_mmap=False):
+  """Iterator of pairs (filename, content) from the given path.
+
+  Filenames are return relative to root_path. Only filenames that
+  extensions are in file_exts (when specified) are returned.
+
+  Content parts are spanstr instances that wrap the content of files.
+  When use_mmap is true, files are memory-mapped (see map_source) and
+  dtype is ignored.
+  """
+  if os.path.isfile(source) or os.path.isdir(source):
+    for filename, path in iter_filenames(source, file_exts=file_exts, root_path=root_path):
+      if use_mmap:
+        yield filename, map_source(path)
+      else:
+        yield filename, read_source(path, dtype=dtype)
   else:
     yield '<string>', spanstr(source)
@@ -1,9 +1,163 @@
 
+import re
+import array
+import bisect
+import functools
+
+
+class lineindex:
+    """Holds offsets of newline characters in a storage object.
+
+    The offsets are computed on the first use and are shared between
+    all spanstr instances that are slices of the same storage.
+
+    lineno is the line number of the start of the storage, for
+    instance, when the storage holds a part of a file.
+    """
+    def __init__(self, storage, lineno=1):
+        self.storage = storage
+        self.first_lineno = lineno
+        self._offsets = None
+
+    @property
+    def offsets(self):
+        if self._offsets is None:
+            if isinstance(self.storage, asciistorage):
+                matches = re.finditer(b'\n', self.storage.buffer)
+            else:
+                matches = re.finditer('\n', self.storage)
+            self._offsets = array.array('q', (m.start() for m in matches))
+        return self._offsets
+
+    def lineno(self, offset):
+        """Return line number of the character at offset.
+        """
+        return bisect.bisect_left(self.offsets, offset) + self.first_lineno
+
+    def column(self, offset):
+        """Return column number (1-based) of the character at offset.
+        """
+        offsets = self.offsets
+        k = bisect.bisect_left(offsets, offset)
+        if k == 0:
+            return offset + 1
+        return offset - offsets[k - 1]
+
+
+class asciistorage:
+    """Provides a storage of pure ASCII text held in a bytes-like object
+    such as mmap.
+
+    Character offsets are byte offsets so that spanstr can use
+    asciistorage as a str storage. Only the sliced parts of the buffer
+    are decoded.
+    """
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def __reduce__(self):
+        return type(self), (bytes(self.buffer),)
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def __str__(self):
+        return self.buffer[:].decode('ascii')
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.buffer[key].decode('ascii')
+        return chr(self.buffer[key])
+
+    def __add__(self, other):
+        return str(self) + other
+
+    @staticmethod
+    def _encode(s):
+        try:
+            return s.encode('ascii')
+        except UnicodeEncodeError:
+            return None
+
+    def startswith(self, prefix, start, end):
+        if isinstance(prefix, tuple):
+            return any(self.startswith(p, start, end) for p in prefix)
+        p = self._encode(prefix)
+        return p is not None and end - start >= len(p) and self.buffer[start:start + len(p)] == p
+
+    def endswith(self, suffix, start, end):
+        if isinstance(suffix, tuple):
+            return any(self.endswith(s, start, end) for s in suffix)
+        p = self._encode(suffix)
+        return p is not None and end - start >= len(p) and self.buffer[end - len(p):end] == p
+
+    def find(self, sub, start, end):
+        p = self._encode(sub)
+        if p is None or start > end:
+            return -1
+        return self.buffer.find(p, start, end)
+
+    def rfind(self, sub, start, end):
+        p = self._encode(sub)
+        if p is None or start > end:
+            return -1
+        return self.buffer.rfind(p, start, end)
+
+    def count(self, sub, start, end):
+        p = self._encode(sub)
+        if p is None or start > end:
+            return 0
+        return self.buffer[start:end].count(p)
+
+
+@functools.lru_cache(maxsize=64)
+def _strip_pattern(chars, binary=False):
+    if binary:
+        # str.isspace is true also for the ASCII separators \x1c-\x1f
+        if chars is None:
+            return re.compile(rb'[ \t\n\r\x0b\x0c\x1c-\x1f]*')
+        chars = chars.encode('ascii', 'ignore')
+        return re.compile(b'[' + re.escape(chars) + b']*' if chars else b'')
+    if chars is None:
+        return re.compile(r'\s*')
+    return re.compile('[' + re.escape(chars) + ']*' if chars else '')
+
+
+def concat(items):
+    """Return the concatenation of items.
+
+    Neighboring slices of the same storage are merged. When the result
+    is a single spanstr, it is returned, when items contain spanstr
+    instances, the result is ropestr instance, otherwise, str instance.
+    """
+    pieces = []
+    for item in items:
+        if isinstance(item, ropestr):
+            pieces.extend(item.pieces())
+            continue
+        if not isinstance(item, spanstr):
+            item = str(item)
+        if not item:
+            continue
+        last = pieces[-1] if pieces else None
+        if (isinstance(item, spanstr) and isinstance(last, spanstr)
+                and last.storage is item.storage and last._end == item._begin):
+            pieces[-1] = last._new(last._begin, item._end)
+        else:
+            pieces.append(item)
+    if len(pieces) == 1 and isinstance(pieces[0], spanstr):
+        return pieces[0]
+    if any(isinstance(piece, spanstr) for piece in pieces):
+        return ropestr.frompieces(pieces)
+    return ''.join(pieces)
+
+
 class spanstr:
     """Provides a string that is a slice of a storage object.
 
     The storage object is typically str instance but could be any
-    bytes-like object.
+    object that implements the str slicing and search methods used
+    here, see asciistorage.
 
     spanstr preserves the character location information with respect
     to the start of the storage object after slicing operations.
@@ -13,16 +167,34 @@ class spanstr:
 
       x + y
 
-    is succesful only when x and y are neighboring substrings of the
-    storage object, or when x is the ending substring of the storage
-    object in which case the result has x storage extended with y
-    content.
+    is spanstr only when x and y are neighboring substrings of the
+    storage object. Otherwise, the result is ropestr instance that
+    keeps the locations of spanstr pieces.
     """
-    def __init__(self, storage, span=None):
+    __slots__ = ('storage', '_begin', '_end', 'newlines', '_hash')
+
+    def __init__(self, storage, span=None, newlines=None):
         if span is None:
-            span = (0, len(storage))
-        self.span = span
+            self._begin, self._end = 0, len(storage)
+        else:
+            self._begin, self._end = span
         self.storage = storage
+        self.newlines = lineindex(storage) if newlines is None else newlines
+        self._hash = None
+
+    def _new(self, begin, end):
+        # slices share storage and its line index
+        new = object.__new__(type(self))
+        new.storage = self.storage
+        new._begin = begin
+        new._end = end
+        new.newlines = self.newlines
+        new._hash = None
+        return new
+
+    @property
+    def span(self):
+        return self._begin, self._end
 
     def __str__(self):
         return str(self.data)
@@ -32,18 +204,15 @@ class spanstr:
 
     @property
     def lineno(self):
-        return self.storage[:self.span[0]].count('\n') + 1
+        return self.newlines.lineno(self._begin)
 
     @property
     def start(self):
-        i = self.storage[:self.span[0]].rfind('\n')
-        if i == -1:
-            return self.span[0] + 1
-        return self.span[0] - i
+        return self.newlines.column(self._begin)
 
     @property
     def end(self):
-        return self.start + self.span[1] - self.span[0]
+        return self.start + self._end - self._begin
 
     def tostring(self, with_location=True, compress=-1):
         s = str(self)
@@ -55,23 +224,50 @@ class spanstr:
     
     @property
     def data(self):
-        return self.storage[slice(*self.span)]
+        return self.storage[self._begin:self._end]
+
+    def _bounds(self, start, end):
+        # map start/end arguments of str methods to storage offsets
+        b, e = self._begin, self._end
+        if start is None and end is None:
+            return b, e
+        n = e - b
+        start = 0 if start is None else (max(start + n, 0) if start < 0 else start)
+        end = n if end is None else (max(end + n, 0) if end < 0 else min(end, n))
+        if start > n:
+            # an empty range that is not found even by an empty string
+            return e + 1, e
+        return b + start, b + end
+
+    def _offset(self, index):
+        return index if index == -1 else index - self._begin
     
     def capitalize(self): return type(self)(self.storage.capitalize(), self.span)
     def casefold(self): return type(self)(self.storage.casefold(), self.span)
     def center(self, *args, **kwargs):
         raise RuntimeError(f'{type(self).__name__}.center is not supported')
-    def count(self, *args, **kwargs): return self.data.count(*args, **kwargs)
+    def count(self, sub, start=None, end=None):
+        return self.storage.count(str(sub), *self._bounds(start, end))
     def encode(self, *args, **kwargs): return type(self)(self.storage.encode(*args, **kwargs), self.span)
-    def endswith(self, *args, **kwargs): return self.data.endswith(*args, **kwargs)
+    def endswith(self, suffix, start=None, end=None):
+        if isinstance(suffix, spanstr):
+            suffix = str(suffix)
+        elif isinstance(suffix, tuple):
+            suffix = tuple(map(str, suffix))
+        return self.storage.endswith(suffix, *self._bounds(start, end))
     def expandtabs(self, *args, **kwargs):
         raise RuntimeError(f'{type(self).__name__}.expandtabs is not supported')
-    def find(self, *args, **kwargs): return self.data.find(*args, **kwargs)
+    def find(self, sub, start=None, end=None):
+        return self._offset(self.storage.find(str(sub), *self._bounds(start, end)))
     def format(self, *args, **kwargs):
         raise RuntimeError(f'{type(self).__name__}.format is not supported')
     def format_map(self, *args, **kwargs):
         raise RuntimeError(f'{type(self).__name__}.format_map is not supported')
-    def index(self, *args, **kwargs): return self.data.index(*args, **kwargs)
+    def index(self, sub, start=None, end=None):
+        i = self.find(sub, start, end)
+        if i == -1:
+            raise ValueError('substring not found')
+        return i
     def isalnum(self, *args, **kwargs): return self.data.isalnum(*args, **kwargs)
     def isalpha(self, *args, **kwargs): return self.data.isalpha(*args, **kwargs)
     def isascii(self, *args, **kwargs): return self.data.isascii(*args, **kwargs)
@@ -90,73 +286,89 @@ class spanstr:
     def ljust(self, *args, **kwargs):
         raise RuntimeError(f'{type(self).__name__}.ljust is not supported')
     def lower(self, *args, **kwargs): return type(self)(self.storage.lower(*args, **kwargs), self.span)
-    def lstrip(self, *args, **kwargs):
-        d = self.data
-        s = d.lstrip(*args, **kwargs)
-        return type(self)(self.storage, span=(self.span[0] + (len(d) - len(s)), self.span[1]))
+    def lstrip(self, chars=None):
+        b, e = self._begin, self._end
+        storage = self.storage
+        if isinstance(storage, asciistorage):
+            i = _strip_pattern(chars, True).match(storage.buffer, b, e).end()
+        else:
+            i = _strip_pattern(chars).match(storage, b, e).end()
+        return self if i == b else self._new(i, e)
     def maketrans(self, *args, **kwargs):
         raise RuntimeError(f'{type(self).__name__}.maketrans is not supported')
     def partition(self, *args, **kwargs):
         t = self.data.partition(*args, **kwargs)
-        l1, l2, l3 = map(len(t))
+        l1, l2, l3 = map(len, t)
         return (
-            type(self)(self.storage, span=(self.span[0], self.span[0] + l1)),
-            type(self)(self.storage, span=(self.span[0] + l1, self.span[0] + l1 + l2)),
-            type(self)(self.storage, span=(self.span[0] + l1 + l2, self.span[1])),
+            self._new(self._begin, self._begin + l1),
+            self._new(self._begin + l1, self._begin + l1 + l2),
+            self._new(self._begin + l1 + l2, self._end),
             )
-    def removeprefix(self, *args, **kwargs):
-        r = self.data.removeprefix(*args, **kwargs)
-        return type(self)(self.storage, span=(self.span[0] + (len(self.data) - len(r)), self.span[1]))
-    def removesuffix(self, *args, **kwargs):
-        r = self.data.removesuffix(*args, **kwargs)
-        return type(self)(self.storage, span=(self.span[0], self.span[1] - (len(self.data) - len(r))))
+    def removeprefix(self, prefix):
+        if prefix and self.startswith(prefix):
+            return self._new(self._begin + len(prefix), self._end)
+        return self
+    def removesuffix(self, suffix):
+        if suffix and self.endswith(suffix):
+            return self._new(self._begin, self._end - len(suffix))
+        return self
     def replace(self, *args, **kwargs):
         raise RuntimeError(f'{type(self).__name__}.replace is not supported')
-    def rfind(self, *args, **kwargs): return self.data.rfind(*args, **kwargs)
-    def rindex(self, *args, **kwargs): return self.data.rindex(*args, **kwargs)
+    def rfind(self, sub, start=None, end=None):
+        return self._offset(self.storage.rfind(str(sub), *self._bounds(start, end)))
+    def rindex(self, sub, start=None, end=None):
+        i = self.rfind(sub, start, end)
+        if i == -1:
+            raise ValueError('substring not found')
+        return i
     def rjust(self, *args, **kwargs):
         raise RuntimeError(f'{type(self).__name__}.rjust is not supported')
     def rpartition(self, *args, **kwargs):
         t = self.data.rpartition(*args, **kwargs)
-        l1, l2, l3 = map(len(t))
+        l1, l2, l3 = map(len, t)
         return (
-            type(self)(self.storage, span=(self.span[0], self.span[0] + l1)),
-            type(self)(self.storage, span=(self.span[0] + l1, self.span[0] + l1 + l2)),
-            type(self)(self.storage, span=(self.span[0] + l1 + l2, self.span[1])),
+            self._new(self._begin, self._begin + l1),
+            self._new(self._begin + l1, self._begin + l1 + l2),
+            self._new(self._begin + l1 + l2, self._end),
             )
-    def rstrip(self, *args, **kwargs):
-        d = self.data
-        s = d.rstrip(*args, **kwargs)
-        return type(self)(self.storage, span=(self.span[0], self.span[1] - (len(d) - len(s))))
+    def rstrip(self, chars=None):
+        b, e = self._begin, self._end
+        storage = self.storage
+        if chars is None:
+            while e > b and storage[e - 1].isspace():
+                e -= 1
+        else:
+            while e > b and storage[e - 1] in chars:
+                e -= 1
+        return self if e == self._end else self._new(b, e)
     def split(self, sep=None, maxsplit=-1):
         d = self.data
+        b = self._begin
         lst = []
+        pos = 0
         for s in d.split(sep=sep, maxsplit=maxsplit):
-            if not lst:
-                start = d.find(s, 0)
-                lst.append(type(self)(self.storage, span=(start, start + len(s))))
-            else:
-                start = d.find(s, lst[-1].span[1])
-                lst.append(type(self)(self.storage, span=(start, start + len(s))))
+            start = pos if sep is not None else d.find(s, pos)
+            lst.append(self._new(b + start, b + start + len(s)))
+            pos = start + len(s) + (len(sep) if sep is not None else 0)
         return lst
     def splitlines(self, keepends=False):
         d = self.data
+        b = self._begin
         lst = []
-        for s in d.splitlines(keepends=keepends):
-            if not lst:
-                start = d.find(s, 0)
-                lst.append(type(self)(self.storage, span=(start, start + len(s))))
-            else:
-                start = d.find(s, lst[-1].span[1])
-                lst.append(type(self)(self.storage, span=(start, start + len(s))))
+        pos = 0
+        for s, t in zip(d.splitlines(keepends=keepends), d.splitlines(keepends=True)):
+            lst.append(self._new(b + pos, b + pos + len(s)))
+            pos += len(t)
         return lst
 
-    def startswith(self, *args, **kwargs): return self.data.startswith(*args, **kwargs)
+    def startswith(self, prefix, start=None, end=None):
+        if isinstance(prefix, spanstr):
+            prefix = str(prefix)
+        elif isinstance(prefix, tuple):
+            prefix = tuple(map(str, prefix))
+        return self.storage.startswith(prefix, *self._bounds(start, end))
     def strip(self, chars=None):
-        d = self.data
-        s = d.strip(chars)
-        start = d.find(s)
-        return type(self)(self.storage, span=(self.span[0] + start, self.span[0] + start + len(s)))
+        return self.lstrip(chars).rstrip(chars)
 
     def swapcase(self, *args, **kwargs): return type(self)(self.storage.swapcase(*args, **kwargs), self.span)
     def title(self, *args, **kwargs): return type(self)(self.storage.title(*args, **kwargs), self.span)
@@ -170,46 +382,324 @@ class spanstr:
     def __le__(self, other): return self.data <= other
     def __gt__(self, other): return self.data > other
     def __ge__(self, other): return self.data >= other
-    def __eq__(self, other): return self.data == other
-    def __ne__(self, other): return self.data != other
-    def __bool__(self): return bool(self.data)
-    def __hash__(self): return hash(self.data)
-    def __len__(self): return len(self.data)
+    def __eq__(self, other):
+        b, e = self._begin, self._end
+        if isinstance(other, spanstr):
+            if other.storage is self.storage and other._begin == b and other._end == e:
+                return True
+            other = str(other)
+        elif not isinstance(other, str):
+            return self.data == other
+        return len(other) == e - b and self.storage.startswith(other, b, e)
+    def __ne__(self, other): return not self.__eq__(other)
+    def __bool__(self): return self._end > self._begin
+    def __hash__(self):
+        # equal to the hash of the corresponding str so that spanstr
+        # instances can be used as str keys in dicts and sets
+        if self._hash is None:
+            self._hash = hash(self.data)
+        return self._hash
+    def __len__(self): return self._end - self._begin
 
     def __getitem__(self, key):
         if isinstance(key, int):
-            while key < 0:
-                key += len(self)
-            if key >= len(self):
+            n = self._end - self._begin
+            if key < 0:
+                key += n
+            if not 0 <= key < n:
                 raise IndexError('span string index out of range')
-            return type(self)(self.storage, span=(self.span[0] + key, self.span[0] + key +1))
+            return self._new(self._begin + key, self._begin + key +1)
         elif isinstance(key, slice):
             start, stop, step = key.indices(len(self))
             if step != 1:
                 # support requires introducing step/stride to span
                 raise RuntimeError(f'{type(self).__name__}.__getitem__ on slice with step(={step}) != 1 is not supported')
-            return type(self)(self.storage, span=(self.span[0] + start, self.span[0] + stop))
+            return self._new(self._begin + start, self._begin + stop)
         else:
             raise TypeError(type(key))
 
     def __iter__(self):
-        for i in range(len(self)):
-            yield self[i]
+        for i in range(self._begin, self._end):
+            yield self._new(i, i + 1)
+
+    def charat(self, index):
+        """Return the character at index as str instance.
+
+        Use charat instead of indexing when the location of the
+        character is not needed.
+        """
+        n = self._end - self._begin
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError('span string index out of range')
+        return self.storage[self._begin + index]
+
+    def iterchars(self):
+        """Iterator of characters as str instances. The span is not
+        copied, so that a scan that stops early takes time proportional
+        to the count of scanned characters.
+        """
+        return map(self.storage.__getitem__, range(self._begin, self._end))
+
     def __reversed__(self):
         raise RuntimeError(f'{type(self).__name__}.__reverse__ is not supported')
     def __contains__(self, item):
-        return item in self.data
+        return self.storage.find(str(item), self._begin, self._end) != -1
 
     def __add__(self, other):
-        if type(other) is type(self) and self.storage == other.storage:
-          if self.span[1] == other.span[0]:
-              return type(self)(self.storage, span=(self.span[0], other.span[1]))
-        elif self.span[0] == 0 and self.span[1] == len(self.storage):
-          return type(self)(self.storage + other)
+        if isinstance(other, spanstr):
+            if (self.storage is other.storage or self.storage == other.storage) and self._end == other._begin:
+                return self._new(self._begin, other._end)
+        elif not isinstance(other, (str, ropestr)):
+            return NotImplemented
+        if not other:
+            return self
+        return ropestr(self, other)
+
+    def __radd__(self, other):
+        if isinstance(other, str):
+            return ropestr(other, self) if other else self
         return NotImplemented
 
-    def __iadd__(self, other):
-        if type(other) is type(self) and self.storage == other.storage:
-          if self.span[1] == other.span[0]:
-            return type(self)(self.storage, span=(self.span[0], other.span[1]))
+
+class ropestr:
+    """Provides a string that is a concatenation of pieces, each piece
+    being a spanstr or str instance.
+
+    Concatenation of ropestr instances takes constant time and slicing
+    takes time proportional to the number of pieces in the slice, the
+    pieces are not copied. Characters of spanstr pieces can be mapped
+    back to their locations in the source, see origin.
+
+    ropestr is the result of concatenating spanstr instances that are
+    not neighbors in the same storage (see spanstr.__add__ and concat),
+    for instance, the content of concatenated string literals or the
+    preprocessed text (see Grammar.torope). Only the str methods
+    defined below are supported.
+    """
+    __slots__ = ('left', 'right', '_len', '_str', '_hash')
+
+    def __init__(self, left, right=''):
+        self.left = left
+        self.right = right
+        self._len = len(left) + len(right)
+        self._str = None
+        self._hash = None
+
+    @classmethod
+    def frompieces(cls, pieces):
+        """Return a balanced ropestr from a list of pieces.
+        """
+        pieces = [p for p in pieces if len(p)]
+        if not pieces:
+            return cls('')
+        if len(pieces) == 1:
+            p = pieces[0]
+            return p if isinstance(p, cls) else cls(p)
+
+        def build(lo, hi):
+            if hi - lo == 1:
+                return pieces[lo]
+            mid = (lo + hi) // 2
+            return cls(build(lo, mid), build(mid, hi))
+
+        return build(0, len(pieces))
+
+    def pieces(self):
+        """Iterator of non-empty spanstr and str pieces.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, ropestr):
+                stack.append(node.right)
+                stack.append(node.left)
+            elif len(node):
+                yield node
+
+    def _pieces_in(self, start, stop):
+        # yield (piece, piece_start, piece_stop) for pieces that overlap
+        # [start, stop), skipping subtrees outside of the range
+        stack = [(self, 0)]
+        while stack:
+            node, offset = stack.pop()
+            n = len(node)
+            if offset >= stop or offset + n <= start or not n:
+                continue
+            if isinstance(node, ropestr):
+                stack.append((node.right, offset + len(node.left)))
+                stack.append((node.left, offset))
+            else:
+                yield node, max(start - offset, 0), min(stop - offset, n)
+
+    def origin(self, index):
+        """Return spanstr of the character at index or None when the
+        character does not originate from a spanstr piece.
+        """
+        n = self._len
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError('rope string index out of range')
+        for piece, i, j in self._pieces_in(index, index + 1):
+            if isinstance(piece, spanstr):
+                return piece[i]
+            return None
+
+    def location(self, index):
+        """Return a triple (offset, lineno, column) of the character at
+        index in its source, or None when the character does not
+        originate from a spanstr piece.
+        """
+        s = self.origin(index)
+        if s is not None:
+            return s.span[0], s.lineno, s.start
+
+    def __str__(self):
+        if self._str is None:
+            self._str = ''.join(map(str, self.pieces()))
+        return self._str
+
+    def __repr__(self):
+        return f'{type(self).__name__}({str(self)!r}, pieces={len(list(self.pieces()))})'
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(str(self))
+        return self._hash
+
+    def __eq__(self, other):
+        if isinstance(other, (ropestr, spanstr)):
+            other = str(other)
+        elif not isinstance(other, str):
+            return NotImplemented
+        return self._len == len(other) and str(self) == other
+
+    def __ne__(self, other):
+        r = self.__eq__(other)
+        return r if r is NotImplemented else not r
+
+    def __add__(self, other):
+        if isinstance(other, (str, spanstr, ropestr)):
+            return type(self)(self, other) if len(other) else self
         return NotImplemented
+
+    def __radd__(self, other):
+        if isinstance(other, (str, spanstr)):
+            return type(self)(other, self) if len(other) else self
+        return NotImplemented
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            n = self._len
+            if key < 0:
+                key += n
+            if not 0 <= key < n:
+                raise IndexError('rope string index out of range')
+            for piece, i, j in self._pieces_in(key, key + 1):
+                return piece[i]
+        elif isinstance(key, slice):
+            start, stop, step = key.indices(self._len)
+            if step != 1:
+                raise RuntimeError(f'{type(self).__name__}.__getitem__ on slice with step(={step}) != 1 is not supported')
+            pieces = [piece[i:j] for piece, i, j in self._pieces_in(start, stop)]
+            if len(pieces) == 1 and isinstance(pieces[0], spanstr):
+                return pieces[0]
+            return self.frompieces(pieces)
+        raise TypeError(type(key))
+
+    def __iter__(self):
+        for piece in self.pieces():
+            yield from piece
+
+    def lstrip(self, chars=None):
+        s = str(self)
+        return self[len(s) - len(s.lstrip(chars)):]
+
+    def rstrip(self, chars=None):
+        return self[:len(str(self).rstrip(chars))]
+
+    def strip(self, chars=None):
+        return self.lstrip(chars).rstrip(chars)
+
+    def __contains__(self, item):
+        return str(item) in str(self)
+
+    # str methods that do not produce strings are applied to the str
+    # value, the methods that produce strings return slices or
+    # piecewise results that keep the locations of spanstr pieces:
+    def count(self, *args): return str(self).count(*args)
+    def endswith(self, suffix, *args):
+        suffix = tuple(map(str, suffix)) if isinstance(suffix, tuple) else str(suffix)
+        return str(self).endswith(suffix, *args)
+    def find(self, sub, *args): return str(self).find(str(sub), *args)
+    def index(self, sub, *args): return str(self).index(str(sub), *args)
+    def rfind(self, sub, *args): return str(self).rfind(str(sub), *args)
+    def rindex(self, sub, *args): return str(self).rindex(str(sub), *args)
+    def startswith(self, prefix, *args):
+        prefix = tuple(map(str, prefix)) if isinstance(prefix, tuple) else str(prefix)
+        return str(self).startswith(prefix, *args)
+    def isalnum(self): return str(self).isalnum()
+    def isalpha(self): return str(self).isalpha()
+    def isascii(self): return str(self).isascii()
+    def isdecimal(self): return str(self).isdecimal()
+    def isdigit(self): return str(self).isdigit()
+    def isidentifier(self): return str(self).isidentifier()
+    def islower(self): return str(self).islower()
+    def isnumeric(self): return str(self).isnumeric()
+    def isprintable(self): return str(self).isprintable()
+    def isspace(self): return str(self).isspace()
+    def istitle(self): return str(self).istitle()
+    def isupper(self): return str(self).isupper()
+    def encode(self, *args, **kwargs): return str(self).encode(*args, **kwargs)
+
+    def _piecewise(self, name):
+        return self.frompieces([getattr(piece, name)() for piece in self.pieces()])
+    def lower(self): return self._piecewise('lower')
+    def upper(self): return self._piecewise('upper')
+    def casefold(self): return self._piecewise('casefold')
+    def swapcase(self): return self._piecewise('swapcase')
+
+    def partition(self, sep):
+        i = self.find(sep)
+        if i == -1:
+            return self, '', ''
+        j = i + len(sep)
+        return self[:i], self[i:j], self[j:]
+    def rpartition(self, sep):
+        i = self.rfind(sep)
+        if i == -1:
+            return '', '', self
+        j = i + len(sep)
+        return self[:i], self[i:j], self[j:]
+    def removeprefix(self, prefix):
+        return self[len(prefix):] if prefix and self.startswith(prefix) else self
+    def removesuffix(self, suffix):
+        return self[:self._len - len(suffix)] if suffix and self.endswith(suffix) else self
+    def split(self, sep=None, maxsplit=-1):
+        d = str(self)
+        lst = []
+        pos = 0
+        for s in d.split(sep=sep, maxsplit=maxsplit):
+            start = pos if sep is not None else d.find(s, pos)
+            lst.append(self[start:start + len(s)])
+            pos = start + len(s) + (len(sep) if sep is not None else 0)
+        return lst
+    def splitlines(self, keepends=False):
+        d = str(self)
+        lst = []
+        pos = 0
+        for s, t in zip(d.splitlines(keepends=keepends), d.splitlines(keepends=True)):
+            lst.append(self[pos:pos + len(s)])
+            pos += len(t)
+        return lst
+
+    def replace(self, *args, **kwargs):
+        raise RuntimeError(f'{type(self).__name__}.replace is not supported')
@@ -0,0 +1,42 @@
+import asyncio
+import contextlib
+
+import pytest
+
+from parseonly import aio
+
+
+def test_parse_file(tmp_path):
+  path = tmp_path / 'a.h'
+  path.write_text('#define A 1\nint x = A;\n')
+  tree = asyncio.run(aio.parse_file(path))
+  assert str(tree) == '\nint x = 1 ;\n'
+  assert 'A' in tree._ctx.defines
+
+  assert asyncio.run(aio.parse_file(path, parse=len)) == 23
+
+
+def test_parse_tree(tmp_path):
+  for i in range(5):
+    (tmp_path / f'f{i}.h').write_text(str(i))
+  (tmp_path / 'bad.h').write_text('abc')
+
+  async def collect(**kwargs):
+    return {fn: r async for fn, r in aio.parse_tree(tmp_path, file_exts=['.h'], root_path=tmp_path, parse=int, **kwargs)}
+
+  results = asyncio.run(collect(concurrency=2, return_exceptions=True))
+  assert sorted(results) == ['bad.h'] + [f'f{i}.h' for i in range(5)]
+  assert results['f3.h'] == 3
+  assert isinstance(results['bad.h'], ValueError)
+
+  with pytest.raises(ValueError):
+    asyncio.run(collect())
+
+  async def first():
+    async with contextlib.aclosing(aio.parse_tree(tmp_path, root_path=tmp_path, parse=len, concurrency=1)) as it:
+      async for fn, r in it:
+        return fn, r
+
+  # the files are walked in no particular order
+  fn, r = asyncio.run(first())
+  assert fn in results and r == len((tmp_path / fn).read_text())
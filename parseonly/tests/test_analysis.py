@@ -0,0 +1,58 @@
+from parseonly import grammar as g
+from parseonly.analysis import GrammarAnalysis, leading_specs
+
+
+class number(g.grammar('number')):
+  @g.splitter
+  def split(cls, ctx, line):
+    if line[:1].isdigit():
+      return cls(line[:1]), line[1:]
+
+class call(g.grammar('call')):
+  _grammar_leading = (g.word,)
+
+  @g.splitter
+  def split(cls, ctx, line):
+    w, rest = g.word.split(ctx, line)
+    if w and rest.startswith('('):
+      return cls(w), rest[1:]
+
+class operand(g.switch('operand', 'x', 'xy', number, call, g.word)):
+  pass
+
+class sign(g.keyword('sign', '+', '-')):
+  pass
+
+class signed(g.item_optional_prefix(operand, sign)):
+  pass
+
+class operands(g.pair_or_item('operands', ',', signed)):
+  pass
+
+class statement(g.sequence('statement', operands, ';')):
+  pass
+
+
+def test_grammar_analysis():
+  assert leading_specs(call) == {g.word} and leading_specs(number) == set()
+
+  a = GrammarAnalysis(statement)
+  assert set(a.rules) == {statement, operands, signed, sign, operand, number, call, g.word}
+  assert a.nullable == set()
+  assert a.first[sign] == {'+', '-'}
+  assert a.first[signed] == {'+', '-', 'x', 'xy', number, call, g.word}
+  assert a.first[statement] == a.first[signed]
+  assert a.follow[operands] == {';'}
+  assert a.follow[signed] == {',', ';'}
+  assert a.follow[operand] == {',', ';'}
+
+  messages = [d.message for d in a.diagnostics]
+  assert "operand: alternative 'xy' is shadowed by 'x'" in messages
+  assert 'operand: alternatives call and word share FIRST {word}' in messages
+  assert a.costly_rules() == [(operand, 1)]
+
+
+def test_grammar_analysis_cxx():
+  from parseonly.cxx import grammar as cxx
+  a = GrammarAnalysis(cxx)
+  assert cxx.simple_type_specifier in dict(a.costly_rules())
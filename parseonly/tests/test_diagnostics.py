@@ -0,0 +1,33 @@
+import io
+from parseonly.diagnostics import Diagnostics, snippet, INFO, WARNING, ERROR, OFF
+from parseonly.spanstr import spanstr
+from parseonly.cpp import grammar as cpp
+
+
+class NoFormat:
+  def __format__(self, spec):
+    raise AssertionError('formatted a disabled diagnostic')
+
+
+def test_diagnostics():
+  d = Diagnostics(max_records=2)
+  d.info('{}', NoFormat())
+  assert len(d) == 0 and d.records == []
+  text = spanstr('a\nbcd\n')
+  d.warning('unexpected `{}`', 'b', source=text[2:3])
+  d.error('x')
+  d.error('y')
+  assert dict(d.counts) == {WARNING: 1, ERROR: 2} and len(d.records) == 2
+  assert str(d.records[0]) == 'warning: line 2: unexpected `b`\nb'
+  assert snippet('0123456789', 4) == '01 ...... <SNIP 6 CHARACTERS> ...... 89'
+
+  stream = io.StringIO()
+  r = cpp.preprocess('#define A 1\n#define A 2\n', diagnostics=Diagnostics(level=INFO, stream=stream), locations=True)
+  assert stream.getvalue() == 'info: register CPP macro `A`: `1`\nwarning: line 2: overriding the definition of CPP macro `A`\nA\n'
+  d = Diagnostics(level=OFF)
+  cpp.preprocess('#define A 1\n#define A 2\n', diagnostics=d)
+  assert len(d) == 0
+
+  d = Diagnostics()
+  assert cpp.preprocess('#if 1\nint x;\n', diagnostics=d) is None
+  assert d.counts[ERROR] == 1 and d.records[0].message.startswith('failed to CPP parse')
@@ -53,6 +53,11 @@ def test_word():
   assert w == 'there'
   assert rest == '!'
 
+  w, rest = g.word.split(ctx, g.spanstr('x Hello_1 there!')[2:])
+  assert w.tostring() == "'Hello_1'@1:3..10" and rest.tostring() == "'there!'@1:11..17"
+  w, rest = g.word.split(ctx, g.spanstr('ab'))
+  assert w == 'ab' and rest == ''
+
   w, rest = g.word.split(ctx, line, require='Hello')
   assert w == 'Hello'
 
@@ -175,3 +180,61 @@ def test_sequence():
   m, rest = full_sentence.split(ctx, 'hi there!')
   assert rest == '!', rest
   assert m.content == ('hi', 'there')
+
+
+def test_left_recursion():
+
+  class difference(g.grammar('difference', ['left', 'right'])):
+    """
+    difference - word
+    word
+    """
+    left_recursive = True
+    format = '({0} - {1})'
+
+    @g.splitter
+    def split(cls, ctx, line):
+      d, rest = difference.split(ctx, line)
+      if d and rest.startswith('-'):
+        w, rest = g.word.split(ctx, rest[1:].lstrip())
+        if w:
+          return cls(d, w), rest
+      return g.word.split(ctx, line)
+
+  ctx = g.Context()
+  d, rest = difference.split(ctx, 'a - b - c!')
+  assert str(d) == '((a - b) - c)'
+  assert rest == '!'
+
+  d, rest = difference.split(ctx, 'a!')
+  assert d == 'a'
+
+  class nonleft(g.grammar('nonleft', ['left', 'right'])):
+    @g.splitter
+    def split(cls, ctx, line):
+      d, rest = nonleft.split(ctx, line)
+      if d:
+        return cls(d, None), rest
+      return g.word.split(ctx, line)
+
+  d, rest = nonleft.split(ctx, 'a - b')
+  assert d == 'a'
+
+  # results that do not use a seed in progress are cached
+  ctx = g.Context()
+  d, rest = difference.split(ctx, 'x - y!')
+  assert str(d) == '(x - y)' and ctx.seed_hits == 0
+  assert ('word', 'y!') in ctx.splitter_cache and ('difference', 'x - y!') in ctx.splitter_cache
+
+  class reentry(g.grammar('reentry', ['content'])):
+    @g.splitter
+    def split(cls, ctx, line):
+      if line.startswith('x'):
+        # re-entry on a different line of the same length
+        cls.split(ctx, 'yyy')
+        return cls(line[:1]), line[1:]
+
+  ctx = g.Context()
+  r, rest = reentry.split(ctx, 'xab')
+  assert r == reentry('x') and rest == 'ab'
+  assert not ctx.recursion_guard
@@ -1,3 +1,5 @@
+import pytest
+import os
 from parseonly.grammar import Context
 from parseonly.cpp import grammar as cpp
 from parseonly.cxx import grammar as cxx
@@ -296,6 +298,31 @@ char p[] = join(x, y);
 char p [ ] = "x ## y" ;
 '''
 
+def test_preprocess_hide_sets():
+  text = '''
+#define foo foo
+#define a b
+#define b a
+#define AA BB
+#define BB AA
+#define CAT(x, y) x ## y
+#define f(a) a*g
+#define g(a) f(a)
+#define hash_hash # ## #
+foo a b CAT(A,A) CAT(B,B)
+f(2)(9) hash_hash
+'''
+  assert str(cpp.preprocess(text)) == '\n' * 10 + 'foo a b AA BB 2 * 9 * g ##\n'
+
+def test_macro_template():
+  r = cpp.preprocess('#define F(x, ...) #x x ## 1 x __VA_OPT__(, __VA_ARGS__)\nF(a, b)\n')
+  assert str(r) == '\n"a" a1 a , b\n'
+  macro = r._ctx.defines['F']
+  assert macro.template[:4] == ((cpp._STRINGIZE, 0), (cpp._RAW_ARGUMENT, 0), (cpp._PASTE, (cpp._TOKEN, cxx.decimal_literal('1'))), (cpp._ARGUMENT, 0))
+  assert macro.template[4][0] == cpp._VA_OPT and macro.va_args == 1
+  with pytest.raises(RuntimeError, match=r'invocation of macro `F`: `F\(b, \( c d \) ;`'):
+    cpp.preprocess('#define F(x, y) x\nint a = F(b, (c d);\n')
+
 def test_preprocess_ex08():
   text = '''
 #define t(x,y,z) x ## y ## z
@@ -362,3 +389,261 @@ str(1)
 
 "1" "1" "123"
 '''
+
+def test_locations():
+  from parseonly.spanstr import spanstr
+  ctx = cpp.CPPContext()
+  text = '''
+#if defined  FOO
+int a = 1;
+#endif
+const char* s = "ab";
+'''
+  with ctx.uses_language('cpp'):
+    pp, rest = cpp.preprocessing_file.split(ctx, spanstr(text))
+  assert rest == ''
+  empty, section, lines = pp.content.group
+  expr = section.if_group.expression
+  assert isinstance(expr, cxx.postfix_expression_call)
+  assert expr.expression_list.tostring() == "'FOO'@2:14..17"
+  assert section.location() == (2, 2, 2)
+  s = lines.content[0].pp_tokens.pp_tokens[5]
+  assert isinstance(s, cxx.ordinary_string_literal_quotes)
+  assert s.content.content.tostring() == "'ab'@5:18..20"
+  assert s.location() == (53, 5, 18)
+
+  r = cpp.preprocess(text, locations=True)
+  assert r.location()[1:] == (5, 1)
+  out = r.torope()  # preprocessed text with source locations
+  assert out == str(r) == '\n\n\n\nconst char * s = "ab" ;\n'
+  assert out.location(out.index('"ab"') + 1) == (53, 5, 18)
+  assert out.location(out.index('char')) == (text.index('char'), 5, 7)
+  assert out.location(out.index('*') + 1) is None
+  assert cpp.preprocess(text).location() is None
+
+def test_preprocess_comments_table():
+  text = '''
+#define N 1 // the size
+int a[N]; // array
+'''
+  r = cpp.preprocess(text, comments='table')
+  assert str(r) == '\n\nint a [ 1 ] ;\n'
+  ctx = r._ctx
+  assert [c.text for c in ctx.comments] == [' the size', ' array']
+  line = r.content.group[-1]
+  # the expansion of N does not carry the location of the #define line
+  assert [c.text for c in ctx.attached_comments(line)] == [' array']
+  semicolon = line.pp_tokens.pp_tokens[0].pp_tokens[-1]
+  assert str(semicolon) == ';'
+  assert [c.text for c in ctx.attached_comments(semicolon)] == [' array']
+
+  text = text.replace('int a', ''.join(f'int {c}; // {c}\n' for c in 'bcdef') + 'int a')
+  r = cpp.preprocess(text, comments='table')
+  tokens = r.content.group[-1].pp_tokens.pp_tokens[-1]
+  assert str(tokens) == 'int a [ 1 ] ;'
+  assert [c.text for c in r._ctx.attached_comments(tokens)] == [' array']
+
+def test_preprocess_include(tmp_path):
+  from parseonly.cpp.includes import IncludePaths, FileSystemCache
+  for d in ['src', 'd1/sub', 'd2/sub']:
+    (tmp_path / d).mkdir(parents=True)
+  (tmp_path / 'src/a.h').write_text('#define LOCAL 1\n#include <sub/b.h>\n')
+  (tmp_path / 'd1/sub/b.h').write_text('#define B1 1\n#include_next <sub/b.h>\n')
+  (tmp_path / 'd2/sub/b.h').write_text('#define B2 2\n')
+  text = '#include "a.h"\n#include <missing.h>\nint x = B1 + B2 + LOCAL;\n'
+  cache = FileSystemCache()
+  paths = IncludePaths.from_options(['-I' + str(tmp_path / 'd1'), '-isystem', str(tmp_path / 'd2')], cache=cache)
+  assert paths.angled == [str(tmp_path / 'd1')] and paths.system == [str(tmp_path / 'd2')]
+
+  r = cpp.preprocess(text, include_paths=paths, filename=str(tmp_path / 'src/main.c'))
+  assert str(r) == '\n\nint x = 1 + 2 + 1 ;\n'
+  assert r._ctx.included_files == [str(tmp_path / p) for p in ['src/a.h', 'd1/sub/b.h', 'd2/sub/b.h']]
+  assert r._ctx.unresolved_includes == {'<missing.h>'}
+
+  # "..." includes are not searched from the current directory of <...> includes
+  assert paths.resolve('a.h', angled=True, current_dir=str(tmp_path / 'src')) == (None, None)
+  # lookups are memoized
+  listed = len(cache._listdir)
+  assert IncludePaths(angled=[str(tmp_path / 'd1')], cache=cache).resolve('sub/b.h') == (str(tmp_path / 'd1/sub/b.h'), 0)
+  assert len(cache._listdir) == listed
+
+  # without include paths, includes are not followed
+  assert str(cpp.preprocess(text)) == '\n\nint x = B1 + B2 + LOCAL ;\n'
+
+def test_include_guard(tmp_path):
+  headers = {
+    'guard.h': '// license\n\n#ifndef GUARD_H  // guard\n#define GUARD_H\n#include "guard.h"\nint g;\n#endif\n\n',
+    'defined.h': '#if !defined(DEFINED_H)\n#define DEFINED_H\n#endif\n',
+    'once.h': '#pragma once\n#include "once.h"\n',
+    'plain.h': '#define PLAIN 1\n',
+    'after.h': '#ifndef AFTER_H\n#define AFTER_H\n#endif\nint a;\n',
+  }
+  for name, content in headers.items():
+    (tmp_path / name).write_text(content)
+  guards = {name: cpp.include_guard(cpp._split_header(str(tmp_path / name))) for name in headers}
+  assert guards == {'guard.h': 'GUARD_H', 'defined.h': 'DEFINED_H', 'once.h': True, 'plain.h': None, 'after.h': None}
+
+  text = ''.join(f'#include "{name}"\n' for name in headers) * 2
+  r = cpp.preprocess(text, include_paths=[], filename=str(tmp_path / 'main.c'))
+  names = [os.path.basename(path) for path in r._ctx.included_files]
+  # guarded headers are read only once
+  assert names == list(headers) + ['plain.h', 'after.h']
+
+def test_header_cache(tmp_path):
+  from parseonly.cpp.includes import HeaderCache
+  (tmp_path / 'a.h').write_text('#define A 1\n')
+  (tmp_path / 'b.h').write_text('#define B 2\n')
+  cache = HeaderCache(maxsize=1)
+  for define in ['', '#define A 3\n']:
+    text = define + '#include "a.h"\nint x = A;\n'
+    r = cpp.preprocess(text, include_paths=[], filename=str(tmp_path / 'main.c'), header_cache=cache)
+    # the cached tree is evaluated in the context of each includer
+    assert str(r).splitlines()[-1] == 'int x = 1 ;'
+  assert (cache.hits, cache.misses) == (1, 1)
+
+  # modified files are parsed again
+  (tmp_path / 'a.h').write_text('#define A 10\n')
+  r = cpp.preprocess('#include "a.h"\nint x = A;\n', include_paths=[], filename=str(tmp_path / 'main.c'), header_cache=cache)
+  assert str(r) == '\nint x = 10 ;\n'
+  assert (cache.hits, cache.misses, len(cache)) == (1, 2, 1)
+
+  parsed = []
+  cache.get(str(tmp_path / 'b.h'), parsed.append)
+  cache.get(str(tmp_path / 'a.h'), parsed.append)
+  assert len(cache) == 1 and len(parsed) == 2
+
+def test_macro_table():
+  from parseonly.cpp.macros import MacroTable, options_source
+  t = MacroTable(dict(A=1, B=2))
+  f = t.fork()
+  f['C'] = 3
+  del f['A']
+  t['D'] = 4
+  assert dict(t) == dict(A=1, B=2, D=4)
+  assert dict(f) == dict(B=2, C=3)
+  assert 'A' not in f and len(f) == 2
+  f['E'] = 5
+  del f['B']
+  assert f.get('E') == 5 and 'B' not in f and dict(f) == dict(C=3, E=5)
+  assert dict(t) == dict(A=1, B=2, D=4) and dict(t.fork()) == dict(A=1, B=2, D=4)
+  for i in range(2 * MacroTable.max_depth):
+    f = f.fork()
+    f[f'X{i}'] = i
+  assert f._depth <= MacroTable.max_depth and f['X0'] == 0 and 'A' not in f
+  # lookups after forking do not copy the layers, the base is shared
+  # by the whole chain of forks
+  base = t._layers[-1]
+  assert f._layers[-1] is base and len(f._layers) <= MacroTable.max_depth + 1
+  g = f.fork()
+  assert g.get('X1') == 1 and g.get('C') == 3 and g.get('B') is None
+  assert g._layers[1:] == f._layers[1:] and g._layers[-1] is base
+
+  assert options_source(['-DA', '-D', 'B=2', '-Ifoo', '-UC', '-DF(x)=x']) == '#define A 1\n#define B 2\n#undef C\n#define F(x) x\n'
+
+  defines = cpp.macro_table('gcc', ['-DNDEBUG', '-U__GXX_RTTI', '-DV(x)=x+1'])
+  assert '__GXX_RTTI' not in defines and '__GXX_RTTI' in cpp.macro_table('gcc')
+  text = '#ifndef __clang__\nint v = V(__GNUC__);\n#endif\n'
+  assert str(cpp.preprocess(text, defines=defines)) == '\nint v = 13 + 1 ;\n\n'
+  assert str(cpp.preprocess(text, defines=cpp.macro_table('clang', ['-DNDEBUG']))) == '\n\n\n'
+
+
+def test_skip_inactive():
+  from parseonly.cpp.utils import find_group_end
+  text = 'a\n # if X\n#else\n#endif\n  @@@<1@@@ # elif 1\nb\n'
+  assert find_group_end(text) == text.index('  @@@<1@@@')
+  assert find_group_end('a\n#if X\n#endif\n') == -1
+
+  text = '''\
+#if 0
+char *s = "not a pp-token;
+#  if 1
+x
+#  endif
+#elif defined(B)
+int b;
+#endif
+#ifndef A
+int a;
+#endif
+#ifdef C
+c
+#endif
+#define C
+'''
+  r = cpp.preprocess(text, skip_inactive=True)
+  assert str(r) == '\n' * 9 + 'int a ;\n' + '\n' * 5
+  assert str(cpp.preprocess(text.replace('"not', 'not'))).split() == str(r).split()
+
+  text = '#if FOO\na\n#else\nb\n#endif\n'
+  assert str(cpp.preprocess(text, skip_inactive=True)) == str(cpp.preprocess(text))
+
+  text = '#define X\n#define N 3\n#ifdef X\nint a[N];\n#endif\n#if N > 2\nint b;\n#endif\n'
+  assert str(cpp.preprocess(text, skip_inactive=True)).split() == ['int', 'a', '[', '3', ']', ';', 'int', 'b', ';']
+  text = '#if __GNUC__ >= 4\nint g;\n#else\nint h;\n#endif\n'
+  assert str(cpp.preprocess(text, skip_inactive=True, defines=cpp.macro_table('gcc'))).split() == ['int', 'g', ';']
+
+  # a group that is skipped by its own condition is active after an
+  # unknown condition
+  text = '#if VERSION >= 3\nint a;\n#elif defined(_WIN32)\n#include <windows.h>\n#endif\nint b;\n'
+  for locations in [False, True]:
+    assert str(cpp.preprocess(text, skip_inactive=True, locations=locations)) == str(cpp.preprocess(text))
+
+  r = cpp.skipped_group(cpp.spanstr('a\nb\n'))
+  assert str(r.resolve(False)) == '\n\n'
+  with pytest.raises(RuntimeError, match='must be split'):
+    r.resolve(True)
+
+def test_evaluate_condition():
+  from parseonly.cpp import conditions
+  ctx = cpp.CPPContext()
+  ev = lambda text: ctx.evaluate_condition(conditions.normalize(text))
+  assert ev('1 && 0') == 0 and ev('1 || X') == 1 and ev('0 && f(1)') == 0
+  assert ev('(2 + 3) * 4 == 20 ? 0x10 : 1') == 16 and ev("-7 / 2 == -3 && 'a' == 97") == 1
+  assert ev('X') is None and ev('f(1)') is None and ev('1 +') is None and ev('1 / 0') is None
+  ctx.register_define('B', None, [cpp.pp_identifier('A')])
+  assert ev('B > 1') is None and ev('defined B') == 1
+  ctx.register_define('A', None, [cxx.decimal_literal('2')])
+  assert ev('B > 1') == 1
+  assert dict(ctx.condition_values['B > 1'][1]) == dict(B=ctx.defines['B'], A=ctx.defines['A'])
+  ctx.unregister_define('A')
+  assert ev('B > 1') is None
+
+  text = '''\
+#if 0
+#define A
+#elif defined A || 2 > 1
+int b;
+#else
+int c;
+#endif
+#ifdef A
+int a;
+#endif
+'''
+  assert str(cpp.preprocess(text)).split() == ['int', 'b', ';']
+
+
+def test_macro_dependencies(tmp_path):
+  from parseonly.cpp import macros
+  assert macros.changed_macros(['-DA', '-DB=2', '-UC'], ['-DA=1', '-DB=3', '-DF(x)=x']) == {'B', 'C', 'F'}
+
+  (tmp_path / 'h.h').write_text('#ifdef USE_H\nint h;\n#endif\n')
+  (tmp_path / 'g.h').write_text('#ifndef G_H\n#define G_H\nint g;\n#endif\n')
+  text = '#include "h.h"\n#if defined(NDEBUG) || LEVEL > 2\nint a = X;\n#else\nint b;\n#endif\n'
+  defines = cpp.macro_table(options=['-DNDEBUG'])
+  r = cpp.preprocess(text, include_paths=[], filename=str(tmp_path / 'a.c'), defines=defines, track_dependencies=True)
+  deps = r._ctx.dependencies
+  assert [(d.kind, os.path.basename(d.filename), d.lineno) for d in deps.records] == [
+    ('if_section', 'h.h', 1), ('if_section', 'a.c', 2), ('text_line', 'a.c', 3)]
+  assert deps.records[1].names == {'NDEBUG'} and {'X', 'int', 'a'} <= deps.names
+  assert 'LEVEL' not in deps.names and 'b' not in deps.names
+  assert deps.invalidated(macros.changed_macros(['-DNDEBUG'], ['-DNDEBUG', '-DLEVEL=3'])) == []
+  assert [d.lineno for d in deps.invalidated({'NDEBUG', 'USE_H'})] == [1, 2]
+  assert macros.invalidated_files({'a.c': deps, 'b.c': macros.MacroDependencies()}, {'X'}) == ['a.c']
+  assert cpp.preprocess(text)._ctx.dependencies is None
+
+  # the second include is skipped because the guard macro is defined
+  r = cpp.preprocess('#include "g.h"\n#include "g.h"\n', include_paths=[], filename=str(tmp_path / 'a.c'), track_dependencies=True)
+  deps = r._ctx.dependencies
+  assert [(d.kind, os.path.basename(d.filename), d.lineno, d.names) for d in deps.records] == [
+    ('if_section', 'g.h', 1, {'G_H'}), ('text_line', 'g.h', 3, {'int', 'g'}), ('include', 'a.c', 2, {'G_H'})]
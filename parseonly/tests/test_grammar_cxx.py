@@ -1,6 +1,6 @@
 
 from parseonly.cxx import grammar as g
-from parseonly.cpp.utils import separate_comments, remove_backslashes, reference_comments
+from parseonly.cpp.utils import separate_comments, remove_backslashes, reference_comments, find_group_boundaries, collect_comments, iter_logical_lines, iter_group_parts
 
 def test_reference_comments():
   text = '''
@@ -44,6 +44,10 @@ def test_separate_comments():
   assert stext == '\n                                     void foo()\n    {\n      int \t                         i;\n    }\n    class A {\n      int a;              \n      FOO("See this site http://comment.com that has inline comments /* like this */!")\n    };'
   assert ctext == '\n    /******************************/           \n     \n          \t /* this is i comment */   \n     \n             \n              // this is a\n                                                                                       \n      '
 
+  stext, ctext = separate_comments('int/**/a; char* s = "/* x */";')
+  assert stext == 'int    a; char* s = "/* x */";'
+  assert ctext == '   /**/' + ' ' * 23
+
 def test_remove_backslashes():
   text = r'''
   a\   
@@ -59,6 +63,9 @@ B
   assert stext == '\n  a\nb\n  A   B\n\n  a   b   c\n\n\n  d\n  '
   assert text.count('\n') == stext.count('\n')
 
+  assert remove_backslashes('\ufeffa \\\nb') == 'a b\n'
+  assert remove_backslashes('a \\ b\\') == 'a  b'
+
 def test_identifier():
   ctx = g.Context()
   w, rest = g.identifier.split(ctx, 'hello there')
@@ -66,3 +73,58 @@ def test_identifier():
 
   w, rest = g.identifier.split(ctx, 'if there')
   assert w is None
+
+def test_find_group_boundaries():
+  text = '#define A\nint a;\n#if A\n#define B\n#else\n#endif\nint b;\n#include <c>\nint c;\n'
+  offsets = find_group_boundaries(text)
+  assert [text[:i].splitlines()[-1] for i in offsets] == ['#define A', '#endif', '#include <c>']
+  assert find_group_boundaries('#if A\n#define B\n') == []
+
+  for size in range(1, len(text) + 1):
+    parts = list(iter_group_parts(text[i:i + size] for i in range(0, len(text), size)))
+    assert ''.join(parts) == text
+    ends = [len(''.join(parts[:k + 1])) for k in range(len(parts) - 1)]
+    assert set(ends) <= set(offsets) and (size > 1 or ends == offsets)
+  # a part is yielded as soon as it is complete
+  consumed = []
+  def pieces():
+    for line in text.splitlines(keepends=True):
+      consumed.append(line)
+      yield line
+  assert next(iter_group_parts(pieces())) == '#define A\n' and len(consumed) == 1
+  assert list(iter_group_parts(['#endif\n', '#define B\n'])) == ['#endif\n#define B\n']
+
+def test_collect_comments():
+  text = '''int x;
+// leading
+int a; // trailing a
+/* block
+   two */ int b;
+'''
+  stext, comments = collect_comments(text)
+  assert len(stext) == len(text)
+  assert [i for i, c in enumerate(stext) if c == '\n'] == [i for i, c in enumerate(text) if c == '\n']
+  assert stext == 'int x;\n          \nint a;              \n        \n          int b;\n'
+  assert [(c.direction, c.text) for c in comments] == [('>', ' leading'), ('<', ' trailing a'), ('>', ' block\n   two ')]
+
+  a = text.index('int a')
+  assert [c.text for c in comments.attached(a, a + 6)] == [' leading', ' trailing a']
+  b = text.index('int b')
+  assert [c.text for c in comments.attached(b, b + 6)] == [' block\n   two ']
+  assert comments.attached(0, 6) == []
+  assert [c.text for c in comments.within(0, len(text))] == [c.text for c in comments]
+
+  stext2, cdict = reference_comments(text)
+  assert list(cdict.values()) == [c.text for c in comments]
+
+def test_iter_logical_lines():
+  text = '\ufeff// c1\nint a; /* c2\n */ int b \\\n = "/* \\\n"; // c3 \\\n continued\nint c;'
+  stext, cdict = reference_comments(remove_backslashes(text))
+  for size in range(1, len(text) + 1):
+    chunks = [text[i:i + size] for i in range(0, len(text), size)]
+    cdict2 = dict()
+    pieces = list(iter_logical_lines(chunks, cdict=cdict2))
+    assert ''.join(pieces) == stext
+    assert cdict2 == cdict
+  assert next(iter_logical_lines(iter(text))) == '@@@<1@@@\n'
+  assert list(cdict.values()) == [' c1', ' c2\n ', ' c3  continued']
@@ -0,0 +1,89 @@
+from parseonly.parallel import parse_many, make_chunks
+
+
+def _write(path, content):
+  path.write_text(content)
+  return str(path)
+
+
+def test_make_chunks(tmp_path):
+  items = []
+  for name, size in [('a.h', 10), ('b.h', 300), ('c.h', 20), ('d.h', 5)]:
+    items.append((name, _write(tmp_path / name, 'x' * size)))
+  chunks = make_chunks(items, chunk_bytes=25)
+  assert [[filename for index, filename, path in chunk] for chunk in chunks] == [['b.h'], ['c.h', 'a.h'], ['d.h']]
+  assert [index for index, filename, path in chunks[1]] == [2, 0]
+
+
+def test_parse_many(tmp_path):
+  for i in range(6):
+    _write(tmp_path / f'f{i}.h', str(i) * (i + 1))
+  _write(tmp_path / 'bad.h', 'abc')
+  _write(tmp_path / 'skip.txt', '1')
+
+  for jobs in [1, 2]:
+    results = {fn: (r, e) for fn, r, e in parse_many(str(tmp_path), jobs=jobs, parse=int, file_exts=['.h'],
+                                                     root_path=str(tmp_path), chunk_bytes=4)}
+    assert sorted(results) == ['bad.h'] + [f'f{i}.h' for i in range(6)]
+    assert results['f3.h'] == (3333, None)
+    r, e = results['bad.h']
+    assert r is None and isinstance(e, ValueError)
+
+  paths = [_write(tmp_path / f'g{i}.h', 'x' * (10 - i)) for i in range(5)]
+  results = list(parse_many(paths, jobs=2, parse=len, ordered=True, root_path=str(tmp_path), chunk_bytes=1))
+  assert results == [(f'g{i}.h', 10 - i, None) for i in range(5)]
+
+
+def test_parse_many_cpp(tmp_path):
+  path = _write(tmp_path / 'a.h', '#define A 1\nint x = A;\n')
+  [(fn, tree, error)] = parse_many(path, jobs=2)
+  assert error is None
+  assert str(tree) == '\nint x = 1 ;\n'
+  # the parsing context is not sent back from worker processes
+  assert not hasattr(tree, '_ctx')
+  [(fn, tree, error)] = parse_many(path, jobs=1)
+  assert str(tree) == '\nint x = 1 ;\n' and 'A' in tree._ctx.defines
+
+
+def _parse_counting_headers(text):
+  from parseonly.cpp import includes, preprocess
+  preprocess(text, include_paths=[])
+  cache = includes.default_header_cache
+  return cache.hits, cache.misses
+
+
+def test_parse_many_header_cache(tmp_path):
+  from parseonly.cpp import includes, preprocess
+  header = _write(tmp_path / 'a.h', '#define A 1\n')
+  path = _write(tmp_path / 'a.cpp', f'#include "{header}"\nint x = A;\n')
+  cache = includes.HeaderCache()
+  preprocess(f'#include "{header}"\n', include_paths=[], header_cache=cache)
+  assert (cache.hits, cache.misses) == (0, 1)
+  # the workers start with a copy of the cache
+  [(fn, r, error)] = parse_many(path, jobs=2, parse=_parse_counting_headers, header_cache=cache)
+  assert error is None and r == (1, 1)
+  assert (cache.hits, cache.misses) == (0, 1)
+
+
+def test_split_preprocessing_file():
+  from parseonly.parallel import split_preprocessing_file
+  from parseonly.cpp import grammar as cpp
+
+  text = ''.join(f'''#define A{i} {i}
+int a{i} = A{i};
+#ifdef A{i}
+#define B{i}
+#else
+int b{i};
+#endif
+''' for i in range(20))
+  ctx = cpp.CPPContext()
+  with ctx.uses_language('cpp'):
+    expected, rest = cpp.preprocessing_file.split(ctx, text)
+  r, rest = split_preprocessing_file(text, jobs=2, min_chunk_size=50)
+  assert rest == ''
+  assert str(r) == str(expected)
+  assert str(cpp.preprocess(text, jobs=2)) == str(cpp.preprocess(text))
+
+  r, rest = split_preprocessing_file(text + '#if 1\n', jobs=2, min_chunk_size=50)
+  assert rest == '#if 1\n'
@@ -0,0 +1,38 @@
+from parseonly.reader import map_source, read_source, iter_sources, iter_chunks
+from parseonly.spanstr import asciistorage
+
+
+def test_map_source(tmp_path):
+  ascii_path = tmp_path / 'a.h'
+  ascii_path.write_bytes(b'int a;\n// b\n')
+  s = map_source(str(ascii_path))
+  assert isinstance(s.storage, asciistorage)
+  assert s == read_source(str(ascii_path))
+  assert s[7:].lineno == 2
+
+  # files that are not mapped as is
+  for name, content in [('b.h', 'int ä;\n'.encode('utf-8')),
+                        ('c.h', b'int a;\r\nint b;\r\n'),
+                        ('d.h', b'\xef\xbb\xbfint a;\n'),
+                        ('e.h', b'')]:
+    path = tmp_path / name
+    path.write_bytes(content)
+    s = map_source(str(path))
+    assert not isinstance(s.storage, asciistorage)
+    assert s == read_source(str(path))
+
+  assert dict(iter_sources(str(tmp_path), root_path=str(tmp_path), use_mmap=True))['a.h'] == 'int a;\n// b\n'
+
+
+def test_iter_chunks(tmp_path):
+  from parseonly.cpp import preprocess
+  path = tmp_path / 'a.h'
+  path.write_bytes(b'\xef\xbb\xbf#define A 1 // one\r\nint a = \\\r\n A;\r\n')
+  chunks = list(iter_chunks(str(path), chunk_size=4))
+  assert max(map(len, chunks)) == 4
+  assert ''.join(chunks) == '\ufeff' + read_source(str(path))
+  assert str(preprocess(iter_chunks(str(path), chunk_size=4))) == str(preprocess(read_source(str(path))))
+
+  path.write_text('#define A 1\nint a = A;\n#if A\nint b; /* b\n */\n#endif\nint c = (;\n')
+  for chunk_size in (1, 4, 1 << 16):
+    assert str(preprocess(iter_chunks(str(path), chunk_size=chunk_size))) == str(preprocess(read_source(str(path))))
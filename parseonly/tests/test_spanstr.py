@@ -1,5 +1,6 @@
+import pytest
 
-from parseonly.spanstr import spanstr
+from parseonly.spanstr import spanstr, asciistorage, concat, ropestr
 
 def test_ctor():
     s = spanstr('ABCD')
@@ -58,3 +59,114 @@ def test_getitem():
     assert str(spanstr('ABCD')[1:3]) == 'BC'
     assert str(spanstr('ABCD')[0:3][:]) == 'ABC'
     assert str(spanstr('ABCD')[0:3][:4]) == 'ABC'
+
+def test_location():
+    s = spanstr('ab\ncd\n\nefg')
+    for i, c in enumerate(str(s)):
+        t = s[i]
+        assert t.lineno == str(s)[:i].count('\n') + 1
+        assert t.start == i - str(s)[:i].rfind('\n')
+        assert t.newlines is s.newlines
+    assert s[3:5].tostring() == "'cd'@2:1..3"
+    assert s[7:].tostring() == "'efg'@4:1..4"
+    assert s.lstrip('ab').tostring() == "'\\ncd\\n\\nefg'@1:3..11"
+
+def test_search():
+    s = spanstr('xx ab\ncd ab yy')[3:11]
+    d = str(s)
+    for sub in ['ab', 'b', 'cd', 'zz', '']:
+        for args in [(), (1,), (-3,), (2, 5), (9,)]:
+            assert s.find(sub, *args) == d.find(sub, *args)
+            assert s.rfind(sub, *args) == d.rfind(sub, *args)
+            assert s.count(sub, *args) == d.count(sub, *args)
+            assert s.startswith(sub, *args) == d.startswith(sub, *args)
+            assert s.endswith(sub, *args) == d.endswith(sub, *args)
+        assert (sub in s) == (sub in d)
+    assert 'yy' not in s
+    assert s.startswith(('zz', 'ab'))
+
+def test_compare():
+    s = spanstr('ab ab abc')
+    assert s[0:2] == 'ab' and 'ab' == s[0:2]
+    assert s[0:2] == s[3:5]
+    assert s[0:2] != s[6:9] and s[6:8] != 'abc'
+    assert len(s[3:]) == 6
+    assert not s[2:2] and s[2:3]
+    assert hash(s[3:5]) == hash('ab')
+    assert {s[0:2]: 1}['ab'] == 1
+
+def test_split_spans():
+    s = spanstr('xx AB,, CD\nEF\r\n')[3:]
+    for sep in [None, ',']:
+        for t in s.split(sep):
+            assert t.storage[slice(*t.span)] == str(t)
+    assert [t.span for t in s.split(',')] == [(3, 5), (6, 6), (7, 15)]
+    assert [t.span for t in s.splitlines()] == [(3, 10), (11, 13)]
+    assert [t.span for t in s.partition(',')] == [(3, 5), (5, 6), (6, 15)]
+
+def test_asciistorage():
+    storage = asciistorage(b'  ab\ncd ab\n')
+    s = spanstr(storage)
+    assert str(s) == '  ab\ncd ab\n' and len(s) == 11
+    t = s.lstrip()
+    assert t == 'ab\ncd ab\n' and t.span == (2, 11)
+    assert t.find('ab', 1) == 6 and t.rfind('ab') == 6 and t.count('ab') == 2
+    assert t.startswith('ab') and not t.startswith('é')
+    assert t[3:].tostring() == "'cd ab\\n'@2:1..7"
+    assert [str(w) for w in t.split()] == ['ab', 'cd', 'ab']
+    assert s.strip().span == (2, 10)
+    assert hash(t[:2]) == hash('ab') and t[:2] == t[6:8]
+
+def test_chars():
+    s = spanstr('xABCD')[1:]
+    assert not hasattr(s, '__dict__')
+    assert s.span == (1, 5)
+    assert [c.span for c in s] == [(1, 2), (2, 3), (3, 4), (4, 5)]
+    assert list(s.iterchars()) == ['A', 'B', 'C', 'D']
+    assert list(s[1:3].iterchars()) == ['B', 'C']
+    assert s.charat(0) == 'A' and s.charat(-1) == 'D'
+    assert type(s.charat(1)) is str
+    with pytest.raises(IndexError):
+        s.charat(4)
+
+def test_concat():
+    s = spanstr('"ab" "cd"')
+    t = concat([s[1], s[2:3]])
+    assert isinstance(t, spanstr) and t.span == (1, 3)
+    assert concat([s[1:3], s[6:8]]) == 'abcd'
+    assert type(s[1:3] + s[6:8]) is ropestr
+    assert type('x' + s[1:3]) is ropestr
+    assert (s[1:3] + s[3:4]).span == (1, 4)
+    assert concat(['a', 'b']) == 'ab' and type(concat(['a', 'b'])) is str
+
+def test_ropestr():
+    s = spanstr('int a;\nint b;\n')
+    r = s[0:4] + 'x' + s[11:13]
+    assert isinstance(r, ropestr)
+    assert str(r) == 'int xb;' and r == 'int xb;' and hash(r) == hash('int xb;')
+    assert len(r) == 7 and r.startswith('int') and r.find('b') == 5
+    assert [str(p) for p in r.pieces()] == ['int ', 'x', 'b;']
+    assert r.origin(0).tostring() == "'i'@1:1..2"
+    assert r.origin(4) is None
+    assert r.origin(-1).tostring() == "';'@2:6..7"
+    assert r.location(5) == (11, 2, 5) and r.location(4) is None
+    assert r[5:].tostring() == "'b;'@2:5..7"
+    t = r[2:6]
+    assert isinstance(t, ropestr) and t == 't xb'
+    assert [p for p in t.pieces() if isinstance(p, spanstr)][1].span == (11, 12)
+    assert r[-2] == 'b' and isinstance(r[-2], spanstr)
+    assert (r + r) == 'int xb;int xb;'
+    a, b = r.split(' ')
+    assert a.tostring() == "'int'@1:1..4" and isinstance(b, ropestr) and b == 'xb;'
+    assert r.partition('x')[2].tostring() == "'b;'@2:5..7"
+    assert r.removeprefix('int ') == 'xb;' and r.endswith(('b;', 'c'))
+    u = r.upper()
+    assert u == 'INT XB;' and [p.tostring() for p in u.pieces() if isinstance(p, spanstr)] == ["'INT '@1:1..5", "'B;'@2:5..7"]
+    assert not hasattr(r, 'zfill')
+
+    # deep ropes are handled without recursion
+    r = spanstr('')
+    for i in range(3000):
+        r = r + s[i % 13:i % 13 + 1]
+    assert len(r) == 3000 and len(r[100:2900]) == 2800
+    assert ropestr.frompieces(list(r.pieces())) == r
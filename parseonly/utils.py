@@ -1,3 +1,5 @@
+from .diagnostics import ERROR, snippet
+
 
 def require_and_drop_semicolon(split):
   """Splitter for
@@ -14,21 +16,17 @@ def require_and_drop_semicolon(split):
     return result
   return _require_and_drop_semicolon
 
-def report_unexpected_block_end(cls, head_lines, rest):
-  print(f'{cls.__name__}: unexpected return when parsing the following block:')
-  print('v'*120)
-  print(head_lines.rstrip())
-  print('...... <SNIP LINES> ......')
-  #raw, rest_ = split_until(rest, '}', keep_mark=True, require_mark=False)
-  if '}' in raw:
-    raw = rest[:raw.index('}') + 1]
-  else:
-    raw = rest
-  lines = str(raw).splitlines()
-  if len(lines) > 25:
-    lines = lines[:15] + [f'...... <SNIP {len(lines) - 25} LINES> ......'] + lines[-5:]
-  print('\n'.join(lines))
-  print('^'*120)
+def report_unexpected_block_end(ctx, cls, head_lines, rest):
+  """Report the unparsed rest of a block as an error to ctx.diagnostics,
+  the snippet of rest ends at the first `}`.
+  """
+  diagnostics = ctx.diagnostics
+  if not diagnostics.enabled(ERROR):
+    return
+  i = rest.find('}')
+  raw = rest if i == -1 else rest[:i + 1]
+  diagnostics.error('{}: unexpected return when parsing the block after\n{}', cls.__name__,
+                    snippet(head_lines.rstrip(), diagnostics.snippet_size), source=raw)
 
 def split_until_gt(text):
   """Assuming that the preceding character of text was `<` (lt), split